@@ -0,0 +1,89 @@
+"""
+Compare the token-aware chunker against the previous character splitter on a synthetic crawl.
+
+Usage:
+    python -m benchmarks.bench_chunker [--pages 5000] [--workers 4]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+import tiktoken
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from src.chunker import TokenChunker
+
+WORDS = (
+    "the pump controller reports error ERR-404 when the pressure sensor drifts "
+    "reset firmware v2.1 calibration valve flow rate maintenance schedule manual "
+    "operator warning temperature threshold network gateway configuration"
+).split()
+
+
+def make_corpus(pages: int, seed: int = 0) -> list[Document]:
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(pages):
+        sections = []
+        for s in range(rng.randint(1, 6)):
+            paragraphs = [
+                " ".join(rng.choices(WORDS, k=rng.randint(10, 300))) + "."
+                for _ in range(rng.randint(1, 5))
+            ]
+            sections.append(f"## Section {s}\n\n" + "\n\n".join(paragraphs))
+        corpus.append(
+            Document(
+                page_content="\n\n".join(sections),
+                metadata={"source": f"https://example.com/{i}", "title": str(i)},
+            )
+        )
+    return corpus
+
+
+def report(name: str, chunks: list[Document], seconds: float, pages: int, encoding):
+    sizes = [len(encoding.encode(chunk.page_content)) for chunk in chunks]
+    mean = statistics.mean(sizes)
+    stdev = statistics.pstdev(sizes)
+    print(
+        f"{name:<28} {pages / seconds:>10.0f} pages/s {len(chunks):>8} chunks "
+        f"{mean:>7.1f} mean tokens {stdev:>7.1f} stdev {stdev / mean:>6.2f} cv "
+        f"{max(sizes):>6} max"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.pages)
+    encoding = tiktoken.get_encoding("cl100k_base")
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000, chunk_overlap=20, length_function=len
+    )
+    start = time.perf_counter()
+    chunks = [chunk for page in corpus for chunk in splitter.split_documents([page])]
+    report(
+        "character splitter", chunks, time.perf_counter() - start, args.pages, encoding
+    )
+
+    for workers in sorted({1, args.workers}):
+        chunker = TokenChunker(max_workers=workers)
+        start = time.perf_counter()
+        chunks = list(chunker.iter_chunks(iter(corpus)))
+        report(
+            f"token chunker ({workers} proc)",
+            chunks,
+            time.perf_counter() - start,
+            args.pages,
+            encoding,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Measure import times and the cold first render of the authentication page, each in a fresh
+interpreter, as a container replica would see them.
+
+Usage:
+    python -m benchmarks.bench_cold_start [--repeat 5] [--root .] [--output cold_start.json]
+
+`--root` points at another checkout (e.g. a `git worktree` of an older commit) to compare against.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules the UI imports before the user is authenticated
+AUTH_PAGE_MODULES = [
+    "streamlit",
+    "streamlit_chat",
+    "audio_recorder_streamlit",
+    "src.auth",
+    "src.consts",
+    "src.jobs",
+]
+APP_MODULES = ["src.generator", "src.db_router"]
+
+IMPORT_SCRIPT = """
+import importlib, sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+print(time.perf_counter() - start)
+"""
+
+RENDER_SCRIPT = """
+import time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("ui.py", default_timeout=120).run()
+elapsed = time.perf_counter() - start
+assert not app.exception, app.exception
+print(elapsed)
+"""
+
+
+def run(script: str, root: str, args: list[str], env: dict[str, str]) -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        cwd=root,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure(name: str, script: str, root: str, args: list[str], env, repeat: int):
+    seconds = [run(script, root, args, env) for _ in range(repeat)]
+    stats = {
+        "median_s": round(statistics.median(seconds), 3),
+        "min_s": round(min(seconds), 3),
+        "max_s": round(max(seconds), 3),
+    }
+    print(
+        f"{name:<32} median {stats['median_s']:>6.3f} s  "
+        f"min {stats['min_s']:>6.3f} s  max {stats['max_s']:>6.3f} s"
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--root", default=".")
+    parser.add_argument("--output", help="Path of the JSON report")
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    env = {**os.environ, "PYTHONPATH": root}
+    # Without credentials the run stops at the authentication page
+    for var in (
+        "OPENAI_API_KEY",
+        "ACTIVELOOP_TOKEN",
+        "ACTIVELOOP_ORG_ID",
+        "COHERE_API_KEY",
+        "APIFY_API_TOKEN",
+    ):
+        env.pop(var, None)
+
+    report = {
+        "auth_page_imports": measure(
+            "auth page imports",
+            IMPORT_SCRIPT,
+            root,
+            AUTH_PAGE_MODULES,
+            env,
+            args.repeat,
+        ),
+        "app_imports": measure(
+            "app imports", IMPORT_SCRIPT, root, APP_MODULES, env, args.repeat
+        ),
+    }
+    for warmup in ("false", "true"):
+        report[f"first_render_warmup_{warmup}"] = measure(
+            f"first render (warm-up {warmup})",
+            RENDER_SCRIPT,
+            root,
+            [],
+            {**env, "WARMUP_ENABLED": warmup},
+            args.repeat,
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""
+Benchmark ingestion, metadata listing and querying end to end against local fakes of Apify,
+OpenAI, Cohere and DeepLake, so runs are offline, deterministic and comparable across commits.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--urls 40] [--tranches 4] [--queries 50]
+        [--collections 1] [--word-tokenizer] [--output bench.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+import numpy as np
+
+# The caches and job database of the app are kept out of the working tree
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="bench-cache-"))
+
+from langchain.chains.conversational_retrieval.base import (  # noqa: E402
+    ConversationalRetrievalChain,
+)
+from langchain.retrievers import (  # noqa: E402
+    ContextualCompressionRetriever,
+    EnsembleRetriever,
+)
+from langchain.retrievers.document_compressors import (  # noqa: E402
+    DocumentCompressorPipeline,
+)
+
+from tests.fakes import (  # noqa: E402
+    WORDS,
+    FakeChatModel,
+    FakeCrawlerDBRouter,
+    FakeReranker,
+    HashEmbeddings,
+    LocalDeepLake,
+    WordEncoding,
+)
+from src.aio import AsyncRunner  # noqa: E402
+from src.answer_cache import SemanticAnswerCache  # noqa: E402
+from src.collection_router import (  # noqa: E402
+    Collection,
+    CollectionCentroid,
+    CollectionRouter,
+    MultiCollectionRetriever,
+)
+from src.consts import DEFAULT_COLLECTION, SNAPSHOTS_PATH  # noqa: E402
+from src.context import ContextAssembler  # noqa: E402
+from src.generator import Generator, Resources  # noqa: E402
+from src.lexical_index import BM25Index, LexicalIndexRetriever  # noqa: E402
+from src.sessions import SessionPool  # noqa: E402
+from src.snapshot import snapshot_path  # noqa: E402
+
+STAGES = ("embed", "retrieve", "rerank", "assemble", "generate", "end_to_end")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def percentiles(seconds: list[float]) -> dict[str, float]:
+    ms = np.asarray(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+    }
+
+
+def timed(function, repeat: int = 1) -> float:
+    """
+    Median wall time of a call, in seconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return float(np.median(durations))
+
+
+def bench_ingest(
+    routers: list[FakeCrawlerDBRouter], args
+) -> tuple[list[dict], list[dict]]:
+    """
+    Ingest the corpus tranche by tranche, timing ingestion and metadata listing as it grows.
+
+    URLs are spread over the collections, each tranche ingesting into every collection in turn.
+    """
+    urls = [f"https://docs.example.com/{i}" for i in range(args.urls)]
+    per_tranche = -(-len(urls) // args.tranches)
+    ingest, metadata = [], []
+    for start in range(0, len(urls), per_tranche):
+        tranche = urls[start : start + per_tranche]
+        began = time.perf_counter()
+        chunks = 0
+        for i, router in enumerate(routers):
+            results = router.add_documents_by_urls(tranche[i :: len(routers)], {})
+            chunks += sum(len(result["ids"]) for result in results.values())
+        seconds = time.perf_counter() - began
+        ingest.append(
+            {
+                "urls": len(tranche),
+                "pages": len(tranche) * args.pages_per_url,
+                "chunks": chunks,
+                "seconds": round(seconds, 3),
+                "pages_per_s": round(len(tranche) * args.pages_per_url / seconds, 1),
+                "chunks_per_s": round(chunks / seconds, 1),
+            }
+        )
+        metadata.append(
+            {
+                "chunks": sum(len(router.ds) for router in routers),
+                "sources": sum(
+                    len(router.get_all_documents_metadata) for router in routers
+                ),
+                "list_ms": round(
+                    timed(
+                        lambda: [
+                            router.get_all_documents_metadata for router in routers
+                        ],
+                        5,
+                    )
+                    * 1000,
+                    3,
+                ),
+                # Full scan the index falls back to when it is missing or out of sync
+                "rebuild_ms": round(
+                    timed(
+                        lambda: [
+                            router.source_index.rebuild(router.ds) for router in routers
+                        ]
+                    )
+                    * 1000,
+                    3,
+                ),
+            }
+        )
+        print(
+            f"ingest  {ingest[-1]['pages_per_s']:>9.1f} pages/s "
+            f"{ingest[-1]['chunks_per_s']:>9.1f} chunks/s | "
+            f"{metadata[-1]['chunks']:>7} chunks: list {metadata[-1]['list_ms']:.3f} ms, "
+            f"rebuild {metadata[-1]['rebuild_ms']:.1f} ms"
+        )
+    return ingest, metadata
+
+
+def bench_queries(resources: Resources, args) -> dict[str, dict[str, float]]:
+    """
+    Time every stage of the query path on its own, then the whole path through the generator.
+    """
+    runner = resources.async_runner
+    chain = resources.chat_model
+    retriever = chain.retriever
+    rng = random.Random(args.seed)
+    names = list(resources.collections)
+    # Each question is on the topic of one collection, which routing should pick first
+    topics = [rng.randrange(len(names)) for _ in range(args.queries)]
+    questions = [
+        " ".join(rng.choices(WORDS[topic :: len(names)], k=rng.randint(3, 8))) + "?"
+        for topic in topics
+    ]
+    routed = 0
+
+    durations = {stage: [] for stage in STAGES}
+
+    def measure(stage, coro):
+        start = time.perf_counter()
+        result = runner.run(coro)
+        durations[stage].append(time.perf_counter() - start)
+        return result
+
+    for topic, question in zip(topics, questions):
+        embedding = measure("embed", resources.db.embeddings.aembed_query(question))
+        routed += retriever.base_retriever.router.route(embedding)[:1] == [names[topic]]
+        documents = measure("retrieve", retriever.base_retriever.ainvoke(question))
+        reranker, assembler = retriever.base_compressor.transformers
+        reranked = measure("rerank", reranker.acompress_documents(documents, question))
+        context = measure("assemble", assembler.acompress_documents(reranked, question))
+        measure(
+            "generate",
+            chain.combine_docs_chain.ainvoke(
+                {"input_documents": context, "question": question}
+            ),
+        )
+        # Fresh sessions, so every query is a first turn and skips condensation
+        generator = Generator({}, session_id=uuid.uuid4().hex, resources=resources)
+        measure("end_to_end", generator.asearch_db(question))
+
+    summary = {stage: percentiles(seconds) for stage, seconds in durations.items()}
+    for stage, stats in summary.items():
+        print(
+            f"query   {stage:<10} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms"
+        )
+    summary["routing"] = {"top1_accuracy": round(routed / len(questions), 3)}
+    print(
+        f"query   routing    top-1 accuracy {summary['routing']['top1_accuracy']:.3f}"
+    )
+    return summary
+
+
+def bench_refresh(routers: list[FakeCrawlerDBRouter], args) -> dict[str, float]:
+    """
+    Time a scheduled refresh of the whole corpus with a fraction of the pages edited.
+
+    A baseline check records the validators first; the crawl and ingest load of the refresh should
+    then follow the edited pages, not the corpus size.
+    """
+    rng = random.Random(args.seed)
+    totals = Counter()
+    seconds = 0.0
+    for router in routers:
+        router.freshness.max_pages = len(router.get_all_documents_metadata)
+        router.freshness.run_once()
+        sources = [metadata["source"] for metadata in router.get_all_documents_metadata]
+        for source in rng.sample(sources, round(len(sources) * args.changed_fraction)):
+            router.revisions[source] = router.revisions.get(source, 0) + 1
+        crawled = router.pages_crawled
+        start = time.perf_counter()
+        totals.update(router.freshness.refresh_now())
+        seconds += time.perf_counter() - start
+        totals["crawled"] += router.pages_crawled - crawled
+    result = {
+        "pages": totals["checked"],
+        "changed": totals["changed"],
+        "crawled": totals["crawled"],
+        "chunks_added": totals["added"],
+        "chunks_removed": totals["removed"],
+        "seconds": round(seconds, 3),
+    }
+    print(
+        f"refresh {result['pages']:>7} pages checked, {result['crawled']} crawled, "
+        f"{result['chunks_added']} chunks added, {result['chunks_removed']} removed "
+        f"in {result['seconds']:.3f} s"
+    )
+    return result
+
+
+def bench_snapshot(router: FakeCrawlerDBRouter, path: str) -> dict[str, float]:
+    """
+    Time exporting a collection to a snapshot and bulk importing it into a fresh dataset.
+    """
+    snapshot = snapshot_path(SNAPSHOTS_PATH, "bench")
+    start = time.perf_counter()
+    manifest = router.export_snapshot("bench", {})
+    export_seconds = time.perf_counter() - start
+    size = sum(
+        os.path.getsize(os.path.join(snapshot, name)) for name in os.listdir(snapshot)
+    )
+
+    target = FakeCrawlerDBRouter(
+        LocalDeepLake(os.path.join(path, "imported"), router.db.embeddings),
+        collection="imported",
+    )
+    start = time.perf_counter()
+    target.import_snapshot("bench")
+    import_seconds = time.perf_counter() - start
+
+    result = {
+        "chunks": manifest["count"],
+        "megabytes": round(size / 1e6, 2),
+        "export_seconds": round(export_seconds, 3),
+        "import_seconds": round(import_seconds, 3),
+        "import_chunks_per_s": round(manifest["count"] / import_seconds, 1),
+        "import_mb_per_s": round(size / 1e6 / import_seconds, 1),
+    }
+    print(
+        f"snapshot {result['chunks']:>6} chunks, {result['megabytes']} MB: "
+        f"export {result['export_seconds']:.3f} s, import {result['import_seconds']:.3f} s "
+        f"({result['import_chunks_per_s']:.0f} chunks/s, {result['import_mb_per_s']} MB/s)"
+    )
+    return result
+
+
+def build_resources(collections: dict[str, Collection], encoding, args) -> Resources:
+    embeddings = next(iter(collections.values())).db.embeddings
+    retrievers = {}
+    for name, collection in collections.items():
+        retrievers[name] = collection.db.as_retriever(search_kwargs={"k": args.top_k})
+        if collection.lexical_index is not None:
+            retrievers[name] = EnsembleRetriever(
+                retrievers=[
+                    retrievers[name],
+                    LexicalIndexRetriever(index=collection.lexical_index, k=args.top_k),
+                ],
+                weights=[0.5, 0.5],
+            )
+    base_retriever = MultiCollectionRetriever(
+        retrievers=retrievers,
+        router=CollectionRouter(
+            {name: collection.centroid for name, collection in collections.items()},
+            max_collections=args.route_max,
+        ),
+        embeddings=embeddings,
+    )
+    context_assembler = ContextAssembler(encoding=encoding)
+    chat_model = ConversationalRetrievalChain.from_llm(
+        llm=FakeChatModel(
+            first_token_latency=args.llm_first_token_latency,
+            token_latency=args.llm_token_latency,
+        ),
+        retriever=ContextualCompressionRetriever(
+            base_compressor=DocumentCompressorPipeline(
+                transformers=[
+                    FakeReranker(top_n=3, latency=args.rerank_latency),
+                    context_assembler,
+                ]
+            ),
+            base_retriever=base_retriever,
+        ),
+        chain_type="stuff",
+        return_source_documents=True,
+    )
+    return Resources(
+        async_runner=AsyncRunner(),
+        db=next(iter(collections.values())).db,
+        chat_model=chat_model,
+        # Never hit, so every query runs the full pipeline
+        answer_cache=SemanticAnswerCache(threshold=2.0),
+        context_assembler=context_assembler,
+        sessions=SessionPool(),
+        collections=collections,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--urls", type=int, default=40)
+    parser.add_argument("--pages-per-url", type=int, default=10)
+    parser.add_argument("--tranches", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--crawl-latency", type=float, default=0.0)
+    parser.add_argument("--embed-latency", type=float, default=0.0)
+    parser.add_argument("--rerank-latency", type=float, default=0.0)
+    parser.add_argument("--llm-first-token-latency", type=float, default=0.0)
+    parser.add_argument("--llm-token-latency", type=float, default=0.0)
+    parser.add_argument("--no-hybrid", action="store_true")
+    parser.add_argument("--collections", type=int, default=1)
+    parser.add_argument(
+        "--changed-fraction",
+        type=float,
+        default=0.1,
+        help="Fraction of the pages edited before the refresh",
+    )
+    parser.add_argument(
+        "--route-max", type=int, default=2, help="Collections searched per query"
+    )
+    parser.add_argument(
+        "--word-tokenizer",
+        action="store_true",
+        help="Count whitespace words instead of tiktoken tokens (no download needed)",
+    )
+    parser.add_argument("--output", help="Path of the JSON report")
+    args = parser.parse_args()
+
+    encoding = WordEncoding() if args.word_tokenizer else None
+    embeddings = HashEmbeddings(latency=args.embed_latency)
+    with tempfile.TemporaryDirectory(prefix="bench-dataset-") as path:
+        collections, routers = {}, []
+        for i in range(args.collections):
+            name = DEFAULT_COLLECTION if i == 0 else f"c{i}"
+            db = LocalDeepLake(os.path.join(path, name), embeddings)
+            router = FakeCrawlerDBRouter(
+                db,
+                collection=name,
+                pages_per_url=args.pages_per_url,
+                crawl_latency=args.crawl_latency,
+                encoding=encoding,
+                # Collections get distinct topics, so routing has something to tell apart
+                words=WORDS[i :: args.collections],
+            )
+            collection = Collection(
+                name=name,
+                db=db,
+                centroid=CollectionCentroid(db.ds()),
+                lexical_index=None if args.no_hybrid else BM25Index(),
+            )
+            for listener in collection.listeners:
+                router.add_listener(listener)
+            collections[name] = collection
+            routers.append(router)
+
+        ingest, metadata = bench_ingest(routers, args)
+        resources = build_resources(collections, encoding, args)
+        query = bench_queries(resources, args)
+        refresh = bench_refresh(routers, args)
+        snapshot = bench_snapshot(routers[0], path)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "ingest": ingest,
+        "metadata": metadata,
+        "query": query,
+        "refresh": refresh,
+        "snapshot": snapshot,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+import httpx
+
+from src.rate_limit import RateLimitedAsyncTransport, RequestScheduler
+
+
+class AsyncRunner:
+    """
+    Runs coroutines on a dedicated event loop thread.
+
+    Streamlit reruns the script in a new thread every time, so pooled async HTTP clients are bound
+    to this long-lived loop instead, and reused by every rerun and session of the process.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        timeout: float = 60,
+        scheduler: Optional[RequestScheduler] = None,
+    ):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="async-runner", daemon=True
+        )
+        self._thread.start()
+
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            )
+        )
+        # Requests to rate-limited providers are paced and retried by the scheduler
+        if scheduler is not None:
+            transport = RateLimitedAsyncTransport(scheduler, transport)
+        self.http_client = httpx.AsyncClient(transport=transport, timeout=timeout)
+
+    def submit(self, coro: Coroutine) -> Future:
+        """
+        Schedule a coroutine on the event loop.
+
+        Args:
+            coro: Coroutine to run.
+
+        Returns:
+            A concurrent future resolving to the coroutine's result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        Run a coroutine on the event loop and wait for its result.
+
+        Args:
+            coro: Coroutine to run.
+            timeout: Maximum number of seconds to wait.
+
+        Returns:
+            The coroutine's result.
+        """
+        return self.submit(coro).result(timeout)
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from src.listeners import DocumentListener
+
+
+class SemanticAnswerCache(DocumentListener):
+    """
+    Response cache keyed on the embedding of the standalone question.
+
+    A cached answer is returned when a new question is close enough (cosine similarity above the
+    threshold) to a previous one searched in the same collections. Entries expire after a TTL, are
+    evicted in LRU order above the size bound, and are invalidated when any of their sources is
+    added to or deleted from the database.
+    """
+
+    def __init__(
+        self, threshold: float = 0.95, ttl: float = 3600, max_entries: int = 1000
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._next_key = 0
+
+    @property
+    def stats(self) -> dict[str, Any]:
+        """
+        Hit/miss statistics of the cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+    def lookup(
+        self, embedding: list[float], collections: frozenset[str] = frozenset()
+    ) -> Optional[dict[str, Any]]:
+        """
+        Find the cached response of the most similar previous question.
+
+        Args:
+            embedding: Embedding of the standalone question.
+            collections: Collections the question is searched in.
+
+        Returns:
+            The cached answer and source documents, or None on a miss.
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            self._expire()
+            best_key, best_similarity = None, self.threshold
+            keys = [
+                key
+                for key, entry in self._entries.items()
+                if entry["collections"] == collections
+            ]
+            if keys:
+                matrix = np.stack([self._entries[key]["embedding"] for key in keys])
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= best_similarity:
+                    best_key, best_similarity = keys[best], float(similarities[best])
+
+            if best_key is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            entry = self._entries[best_key]
+            return {
+                "answer": entry["answer"],
+                "source_documents": entry["source_documents"],
+                "similarity": best_similarity,
+            }
+
+    def store(
+        self,
+        embedding: list[float],
+        answer: str,
+        source_documents: list[Document],
+        collections: frozenset[str] = frozenset(),
+    ) -> None:
+        """
+        Cache the response to a standalone question.
+
+        Args:
+            embedding: Embedding of the standalone question.
+            answer: Generated answer.
+            source_documents: Documents the answer is based on.
+            collections: Collections searched for the documents.
+        """
+        with self._lock:
+            self._entries[self._next_key] = {
+                "embedding": self._normalize(embedding),
+                "answer": answer,
+                "source_documents": source_documents,
+                "sources": {doc.metadata.get("source") for doc in source_documents},
+                "collections": collections,
+                "created_at": time.monotonic(),
+            }
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_sources(self, sources: set[str]) -> None:
+        """
+        Drop every cached response based on any of the given sources.
+
+        Args:
+            sources: Source URLs whose content changed.
+        """
+        with self._lock:
+            for key in [
+                key
+                for key, entry in self._entries.items()
+                if entry["sources"] & sources
+            ]:
+                del self._entries[key]
+
+    def on_documents_added(
+        self, docs: list[Document], ids: list[str], embeddings: list[list[float]]
+    ) -> None:
+        self.invalidate_sources({doc.metadata.get("source") for doc in docs})
+
+    def on_documents_deleted(self, ids_by_source: dict[str, list[str]]) -> None:
+        self.invalidate_sources(
+            {source for source, ids in ids_by_source.items() if ids}
+        )
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for key in [
+            key
+            for key, entry in self._entries.items()
+            if now - entry["created_at"] > self.ttl
+        ]:
+            del self._entries[key]
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
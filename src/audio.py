@@ -0,0 +1,160 @@
+import functools
+import hashlib
+import io
+import logging
+import threading
+import wave
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+SAMPLE_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+def audio_hash(audio_bytes: bytes) -> str:
+    """
+    Hash of a recording, used as its transcription cache key.
+
+    Args:
+        audio_bytes: Encoded audio.
+
+    Returns:
+        Hex digest of the audio.
+    """
+    return hashlib.sha256(audio_bytes).hexdigest()
+
+
+def prepare_audio(
+    audio_bytes: bytes, sample_rate: int = 16000, compression: Optional[str] = None
+) -> tuple[bytes, str]:
+    """
+    Shrink a WAV recording before upload: downmix to mono, resample and optionally compress it.
+
+    Whisper works on 16 kHz mono audio, so nothing is lost by sending less. Compression needs the
+    optional `soundfile` package and is skipped, with a warning, if it is not installed or cannot
+    write the format. Recordings that cannot be read as WAV are returned as they are, for Whisper
+    to decode.
+
+    Args:
+        audio_bytes: WAV recording.
+        sample_rate: Target sample rate.
+        compression: Format to compress to (e.g. "flac"), or None to keep WAV.
+
+    Returns:
+        The encoded audio and its file name, whose extension tells Whisper the format.
+    """
+    try:
+        with wave.open(io.BytesIO(audio_bytes), "rb") as wav:
+            channels = wav.getnchannels()
+            sample_width = wav.getsampwidth()
+            source_rate = wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return audio_bytes, "audio.wav"
+    if sample_width not in SAMPLE_DTYPES:
+        return audio_bytes, "audio.wav"
+    # A truncated recording can end in the middle of a frame
+    frames = frames[: len(frames) - len(frames) % (sample_width * channels)]
+
+    samples = np.frombuffer(frames, dtype=SAMPLE_DTYPES[sample_width]).astype(
+        np.float32
+    )
+    if sample_width == 1:
+        samples = (samples - 128) / 128
+    else:
+        samples /= float(np.iinfo(SAMPLE_DTYPES[sample_width]).max)
+    samples = samples.reshape(-1, channels).mean(axis=1)
+
+    if source_rate > sample_rate:
+        samples = _resample(samples, source_rate, sample_rate)
+    else:
+        sample_rate = source_rate
+    pcm = (np.clip(samples, -1, 1) * 32767).astype(np.int16)
+
+    if compression and _can_compress(compression):
+        import soundfile
+
+        output = io.BytesIO()
+        soundfile.write(output, pcm, sample_rate, format=compression.upper())
+        return output.getvalue(), f"audio.{compression}"
+
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm.tobytes())
+    return output.getvalue(), "audio.wav"
+
+
+@functools.lru_cache(maxsize=None)
+def _can_compress(compression: str) -> bool:
+    # Cached, so a missing codec is only warned about once per format
+    try:
+        import soundfile
+    except ImportError:
+        logging.warning(
+            f"Audio compression to {compression} needs the soundfile package, uploading WAV"
+        )
+        return False
+    if compression.upper() not in soundfile.available_formats():
+        logging.warning(f"soundfile cannot write {compression}, uploading WAV")
+        return False
+    return True
+
+
+def _resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    # Windowed-sinc low-pass below the new Nyquist frequency, then linear interpolation
+    cutoff = 0.5 * target_rate / source_rate
+    taps = np.arange(-32, 33)
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+    filtered = np.convolve(samples, kernel / kernel.sum(), mode="same")
+
+    duration = len(samples) / source_rate
+    target_times = np.arange(int(duration * target_rate)) / target_rate
+    return np.interp(
+        target_times, np.arange(len(samples)) / source_rate, filtered
+    ).astype(np.float32)
+
+
+class TranscriptionCache:
+    """
+    In-memory LRU cache of transcriptions keyed by the hash of the recording.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, str] = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get a cached transcription.
+
+        Args:
+            key: Hash of the recording.
+
+        Returns:
+            The transcription, or None on a miss.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: str, transcription: str) -> None:
+        """
+        Cache a transcription.
+
+        Args:
+            key: Hash of the recording.
+            transcription: Its transcription.
+        """
+        with self._lock:
+            self._entries[key] = transcription
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -1,9 +1,5 @@
 import streamlit as st
-import openai
-import cohere
-from apify_client import ApifyClient
 import os
-import deeplake
 from src.consts import (
     OPENAI_HELP,
     ACTIVELOOP_HELP,
@@ -122,6 +118,12 @@ class Auth:
             st.error("Credentials neither set nor stored", icon=":material/error:")
             return
         try:
+            # The API clients are heavy to import, so the form renders without them
+            import cohere
+            import deeplake
+            import openai
+            from apify_client import ApifyClient
+
             # Try to access the APIs with the provided credentials
             with st.spinner("Authenticating..."):
                 openai.api_key = openai_api_key
@@ -0,0 +1,237 @@
+import multiprocessing
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Iterable, Iterator, Optional
+
+import tiktoken
+from langchain.docstore.document import Document
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+\S")
+PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
+class TokenChunker:
+    """
+    Splitter sizing chunks in tokens and cutting at headings, paragraphs and sentences.
+
+    Sections start at markdown-style headings; paragraphs of a section are packed into chunks of at most
+    `chunk_tokens` tokens, with paragraphs and then sentences too long to fit split further. Consecutive
+    chunks of a section share their last `overlap_tokens` tokens. Large crawls are chunked on a process
+    pool once more than `parallel_threshold` pages have been seen.
+    """
+
+    def __init__(
+        self,
+        chunk_tokens: int = 256,
+        overlap_tokens: int = 16,
+        min_tokens: int = 32,
+        encoding_name: str = "cl100k_base",
+        encoding: Any = None,
+        max_workers: int = 1,
+        parallel_threshold: int = 64,
+        pages_per_task: int = 16,
+    ):
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+        self.encoding_name = encoding_name
+        self.encoding = encoding
+        self.max_workers = max_workers
+        self.parallel_threshold = parallel_threshold
+        self.pages_per_task = pages_per_task
+
+        self._loaded_encoding = None
+
+    def __getstate__(self) -> dict:
+        # tiktoken encodings are rebuilt in the worker processes rather than pickled
+        state = self.__dict__.copy()
+        state["_loaded_encoding"] = None
+        return state
+
+    def iter_chunks(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """
+        Lazily split documents into chunks, in order.
+
+        Args:
+            docs: Documents to split, possibly a lazy iterator.
+
+        Yields:
+            Chunks carrying the metadata of their document.
+        """
+        docs = iter(docs)
+        for doc in islice(docs, self.parallel_threshold):
+            yield from self.split_document(doc)
+        if self.max_workers <= 1:
+            for doc in docs:
+                yield from self.split_document(doc)
+            return
+
+        # At most a few tasks per worker are in flight, so the crawl is consumed at the pace of chunking
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            in_flight = deque()
+            while task := list(islice(docs, self.pages_per_task)):
+                in_flight.append(executor.submit(self.split_documents, task))
+                if len(in_flight) >= 2 * self.max_workers:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+
+    def split_documents(self, docs: list[Document]) -> list[Document]:
+        """
+        Split documents into chunks.
+
+        Args:
+            docs: Documents to split.
+
+        Returns:
+            Chunks carrying the metadata of their document.
+        """
+        return [chunk for doc in docs for chunk in self.split_document(doc)]
+
+    def split_document(self, doc: Document) -> list[Document]:
+        """
+        Split a document into chunks.
+
+        Args:
+            doc: Document to split.
+
+        Returns:
+            Chunks carrying the metadata of the document.
+        """
+        return [
+            Document(page_content=text, metadata=dict(doc.metadata))
+            for text in self.split_text(doc.page_content)
+        ]
+
+    def split_text(self, text: str) -> list[str]:
+        """
+        Split a text into chunks of at most `chunk_tokens` tokens.
+
+        Args:
+            text: Text to split.
+
+        Returns:
+            Chunk texts.
+        """
+        chunks = []
+        for section in self._sections(text):
+            pieces = [
+                (piece, self._count(piece))
+                for paragraph in PARAGRAPH_PATTERN.split(section)
+                if paragraph.strip()
+                for piece in self._fit(paragraph.strip())
+            ]
+            section_chunks = self._pack(pieces)
+            # A heading with little content under it is kept with the next section
+            if (
+                chunks
+                and section_chunks
+                and self._count(chunks[-1]) < self.min_tokens
+                and self._count(chunks[-1]) + self._count(section_chunks[0])
+                <= self.chunk_tokens
+            ):
+                section_chunks[0] = (
+                    chunks.pop() + PARAGRAPH_SEPARATOR + section_chunks[0]
+                )
+            chunks.extend(section_chunks)
+        # Same for a short last section, kept with the previous one
+        if (
+            len(chunks) > 1
+            and self._count(chunks[-1]) < self.min_tokens
+            and self._count(chunks[-2]) + self._count(chunks[-1]) <= self.chunk_tokens
+        ):
+            chunks[-2:] = [chunks[-2] + PARAGRAPH_SEPARATOR + chunks[-1]]
+        return chunks
+
+    def _sections(self, text: str) -> list[str]:
+        sections, current = [], []
+        for line in text.splitlines():
+            if current and HEADING_PATTERN.match(line):
+                sections.append("\n".join(current))
+                current = []
+            current.append(line)
+        if current:
+            sections.append("\n".join(current))
+        return [section for section in sections if section.strip()]
+
+    def _fit(self, paragraph: str) -> list[str]:
+        """
+        Split a paragraph too long for one chunk by sentences, then by tokens.
+        """
+        if self._count(paragraph) <= self.chunk_tokens:
+            return [paragraph]
+
+        pieces = []
+        for sentence in SENTENCE_PATTERN.split(paragraph):
+            tokens = self._encode(sentence)
+            if len(tokens) <= self.chunk_tokens:
+                pieces.append(sentence)
+                continue
+            step = self.chunk_tokens - self.overlap_tokens
+            pieces.extend(
+                self._decode(tokens[start : start + self.chunk_tokens])
+                for start in range(0, len(tokens) - self.overlap_tokens, step)
+            )
+        return self._pack([(piece, self._count(piece)) for piece in pieces], " ")
+
+    def _pack(
+        self, pieces: list[tuple[str, int]], separator: str = PARAGRAPH_SEPARATOR
+    ) -> list[str]:
+        chunks, current, size = [], [], 0
+        for piece, count in pieces:
+            if current and size + count + 1 > self.chunk_tokens:
+                chunk = separator.join(current)
+                chunks.append(chunk)
+                overlap = self._overlap(chunk)
+                current, size = (
+                    ([overlap], self._count(overlap)) if overlap else ([], 0)
+                )
+                if size + count + 1 > self.chunk_tokens:
+                    current, size = [], 0
+            current.append(piece)
+            size += count + 1
+        if current:
+            chunks.append(separator.join(current))
+        return chunks
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens of a text with the chunker's tokenizer.
+
+        Args:
+            text: Text to count the tokens of.
+
+        Returns:
+            Number of tokens of the text.
+        """
+        return self._count(text)
+
+    def _overlap(self, chunk: str) -> Optional[str]:
+        if not self.overlap_tokens:
+            return None
+        overlap = self._decode(self._encode(chunk)[-self.overlap_tokens :]).strip()
+        # Only exact suffixes are kept, so overlapping chunks can be stitched back together
+        return overlap if overlap and chunk.endswith(overlap) else None
+
+    def _count(self, text: str) -> int:
+        return len(self._encode(text))
+
+    def _encode(self, text: str) -> list:
+        return self._get_encoding().encode(text)
+
+    def _decode(self, tokens: list) -> str:
+        return self._get_encoding().decode(tokens)
+
+    def _get_encoding(self):
+        if self.encoding is not None:
+            return self.encoding
+        if self._loaded_encoding is None:
+            self._loaded_encoding = tiktoken.get_encoding(self.encoding_name)
+        return self._loaded_encoding
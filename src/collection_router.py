@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import chain, zip_longest
+from typing import Any, Optional
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from src.consts import DEFAULT_COLLECTION
+from src.listeners import DocumentListener
+
+
+def collection_path(base: str, collection: str) -> str:
+    """
+    Path or name of a per-collection resource, derived from the one of the default collection.
+
+    The default collection keeps the unsuffixed name, so existing single-collection deployments
+    keep their dataset, indices and job table.
+
+    Args:
+        base: Path or name of the resource of the default collection.
+        collection: Name of the collection.
+
+    Returns:
+        The path or name of the resource of the collection.
+    """
+    if collection == DEFAULT_COLLECTION:
+        return base
+    root, ext = os.path.splitext(base)
+    return f"{root}_{collection}{ext}"
+
+
+class CollectionCentroid(DocumentListener):
+    """
+    Mean of the normalized chunk embeddings of a collection, used to route queries to it.
+
+    The sum and count of the embeddings are kept up to date: additions are folded in from their
+    embeddings, and deletions subtract the embeddings of the deleted rows, read from the dataset
+    before they are deleted. With a path, they are persisted there after every change, so the
+    dataset is only scanned when no saved centroid matches it.
+    """
+
+    def __init__(self, ds, path: Optional[str] = None, block_size: int = 8192):
+        self.ds = ds
+        self.path = path
+        self.block_size = block_size
+
+        self._lock = threading.Lock()
+        self._sum: Optional[np.ndarray] = None
+        self._count = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count
+
+    @property
+    def vector(self) -> Optional[np.ndarray]:
+        """
+        Normalized centroid, or None for an empty collection.
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            return (self._sum / (np.linalg.norm(self._sum) or 1.0)).astype(np.float32)
+
+    def load(self) -> bool:
+        """
+        Load the centroid persisted at the path.
+
+        Returns:
+            True if a centroid of as many rows as the dataset was found on disk, False otherwise.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        with np.load(self.path) as stored:
+            total, count = stored["sum"], int(stored["count"])
+        # A centroid left behind by a process that stopped between a write and its save
+        if count != len(self.ds):
+            return False
+        with self._lock:
+            self._sum, self._count = (total if count else None), count
+        return True
+
+    def save(self) -> None:
+        """
+        Persist the centroid at the path, if it has one.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            total, count = self._sum, self._count
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        np.savez(
+            self.path + ".tmp.npz",
+            sum=np.zeros(0) if total is None else total,
+            count=count,
+        )
+        os.replace(self.path + ".tmp.npz", self.path)
+
+    def rebuild(self) -> None:
+        """
+        Recompute the centroid from a full scan of the dataset embeddings.
+        """
+        logging.info("Building collection centroid from a full dataset scan")
+
+        total, count = None, 0
+        for start in range(0, len(self.ds), self.block_size):
+            block = self.ds.embedding[start : start + self.block_size].numpy()
+            block_sum = self._normalize(block).sum(axis=0, dtype=np.float64)
+            total = block_sum if total is None else total + block_sum
+            count += len(block)
+        with self._lock:
+            self._sum, self._count = total, count
+        self.save()
+
+    def on_documents_added(
+        self, docs: list[Document], ids: list[str], embeddings: list[list[float]]
+    ) -> None:
+        block = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            total = block.sum(axis=0, dtype=np.float64)
+            self._sum = total if self._sum is None else self._sum + total
+            self._count += len(block)
+        self.save()
+
+    def on_documents_deleting(self, rows: list[int]) -> None:
+        block = self._normalize(self.ds.embedding[rows].numpy())
+        with self._lock:
+            self._count -= len(block)
+            if self._count <= 0 or self._sum is None:
+                self._sum, self._count = None, 0
+            else:
+                self._sum = self._sum - block.sum(axis=0, dtype=np.float64)
+
+    def on_documents_deleted(self, ids_by_source: dict[str, list[str]]) -> None:
+        self.save()
+
+    @staticmethod
+    def _normalize(block: np.ndarray) -> np.ndarray:
+        block = block.astype(np.float32, copy=False)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        return block / np.where(norms == 0, 1, norms)
+
+
+@dataclass
+class Collection:
+    """
+    Vector database of a named collection with the components mirroring it.
+    """
+
+    name: str
+    db: Any
+    centroid: CollectionCentroid
+    local_index: Optional[DocumentListener] = None
+    lexical_index: Optional[DocumentListener] = None
+
+    @property
+    def listeners(self) -> list[DocumentListener]:
+        """
+        Components to keep in sync with the collection's writes and deletes.
+        """
+        return [
+            listener
+            for listener in (self.centroid, self.local_index, self.lexical_index)
+            if listener is not None
+        ]
+
+
+class CollectionRouter:
+    """
+    Picks the collections a query is searched in from the similarity to their centroids.
+    """
+
+    def __init__(
+        self,
+        centroids: dict[str, CollectionCentroid],
+        max_collections: int = 2,
+        margin: float = 0.05,
+    ):
+        self.centroids = centroids
+        self.max_collections = max_collections
+        self.margin = margin
+
+    def route(self, embedding: list[float]) -> list[str]:
+        """
+        Pick the collections closest to a query.
+
+        Collections are kept while within `margin` of the best cosine similarity, up to
+        `max_collections`. Empty collections are never searched.
+
+        Args:
+            embedding: Embedding of the query.
+
+        Returns:
+            Names of the picked collections, closest first.
+        """
+        vectors = {
+            name: vector
+            for name, centroid in self.centroids.items()
+            if (vector := centroid.vector) is not None
+        }
+        if len(vectors) <= 1:
+            return list(vectors)
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        names = list(vectors)
+        scores = np.stack([vectors[name] for name in names]) @ query
+        order = np.argsort(-scores)[: self.max_collections]
+        return [names[i] for i in order if scores[i] >= scores[order[0]] - self.margin]
+
+
+class MultiCollectionRetriever(BaseRetriever):
+    """
+    Retriever searching the routed (or selected) collections in parallel and merging the results.
+
+    Results are interleaved by rank, so the reranker downstream sees the best chunks of every
+    searched collection, and tagged with their collection.
+    """
+
+    retrievers: dict[str, BaseRetriever]
+    """Retriever of every collection."""
+    router: CollectionRouter
+    """Router picking the collections to search."""
+    embeddings: Embeddings
+    """Embeddings used to route queries when no embedding is given."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        names = self._route(self.embeddings.embed_query(query))
+        with ThreadPoolExecutor(max_workers=max(len(names), 1)) as executor:
+            results = list(
+                executor.map(lambda name: self.retrievers[name].invoke(query), names)
+            )
+        return self.merge(dict(zip(names, results)))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return await self.aretrieve(query, await self.embeddings.aembed_query(query))
+
+    async def aretrieve(
+        self,
+        query: str,
+        embedding: Optional[list[float]] = None,
+        collections: Optional[list[str]] = None,
+    ) -> list[Document]:
+        """
+        Search collections in parallel.
+
+        Args:
+            query: The query to search with.
+            embedding: Embedding of the query, used for routing when no collections are selected.
+            collections: Collections to search, or None to route the query.
+
+        Returns:
+            The merged documents of the searched collections.
+        """
+        if not collections and embedding is None:
+            embedding = await self.embeddings.aembed_query(query)
+        names = self.resolve(embedding, collections)
+        results = await asyncio.gather(
+            *(self.retrievers[name].ainvoke(query) for name in names)
+        )
+        return self.merge(dict(zip(names, results)))
+
+    def resolve(
+        self, embedding: list[float], collections: Optional[list[str]] = None
+    ) -> list[str]:
+        """
+        Names of the collections a query is searched in.
+
+        Args:
+            embedding: Embedding of the query, used for routing when no collections are selected.
+            collections: Selected collections, or None to route the query.
+
+        Returns:
+            The selected collections that exist, or the routed ones.
+        """
+        if collections:
+            return [name for name in collections if name in self.retrievers]
+        return self._route(embedding)
+
+    @staticmethod
+    def merge(results: dict[str, list[Document]]) -> list[Document]:
+        """
+        Interleave the ranked results of several collections, tagging them with their collection.
+
+        Args:
+            results: Ranked documents per collection.
+
+        Returns:
+            The merged documents.
+        """
+        tagged = [
+            [
+                Document(
+                    doc.page_content, metadata={**doc.metadata, "collection": name}
+                )
+                for doc in docs
+            ]
+            for name, docs in results.items()
+        ]
+        return [doc for doc in chain.from_iterable(zip_longest(*tagged)) if doc]
+
+    def _route(self, embedding: list[float]) -> list[str]:
+        names = self.router.route(embedding)
+        logging.debug(f"Routed query to collections {names}")
+        return names
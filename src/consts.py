@@ -22,6 +22,110 @@ Once you are logged in, you find the API token [here](https://console.apify.com/
 """
 
 ACTIVELOOP_DATASET_NAME = "rag_with_knowledge_base_management"
+# Named collections, each in its own dataset; the default one uses the dataset name above
+DEFAULT_COLLECTION = "default"
+COLLECTIONS = [
+    name.strip()
+    for name in os.environ.get("COLLECTIONS", DEFAULT_COLLECTION).split(",")
+    if name.strip()
+]
+# Queries are searched in the collections whose centroid is within the margin of the closest one
+COLLECTION_ROUTE_MAX = int(os.environ.get("COLLECTION_ROUTE_MAX", 2))
+COLLECTION_ROUTE_MARGIN = float(os.environ.get("COLLECTION_ROUTE_MARGIN", 0.05))
+
+CACHE_DIR = os.environ.get("CACHE_DIR", ".cache")
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(
+    os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 200_000)
+)
+
+CHUNK_TOKENS = int(os.environ.get("CHUNK_TOKENS", 256))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 16))
+# Worker processes chunking large crawls (1 keeps chunking in-process)
+CHUNK_MAX_WORKERS = int(
+    os.environ.get("CHUNK_MAX_WORKERS", min(4, os.cpu_count() or 1))
+)
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 256))
+INGEST_MAX_IN_FLIGHT = int(os.environ.get("INGEST_MAX_IN_FLIGHT", 2))
+# Rows read from the dataset and written to it at once by snapshot exports and imports
+SNAPSHOT_BLOCK_SIZE = int(os.environ.get("SNAPSHOT_BLOCK_SIZE", 8192))
+# Snapshots are only read from and written to named directories under this one
+SNAPSHOTS_PATH = os.path.join(CACHE_DIR, "snapshots")
+JOBS_DB_PATH = os.path.join(CACHE_DIR, "jobs.sqlite3")
+JOB_MAX_WORKERS = int(os.environ.get("JOB_MAX_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 2))
+FRESHNESS_DB_PATH = os.path.join(CACHE_DIR, "freshness.sqlite3")
+# Stored pages are checked in the background with conditional requests and only the changed
+# ones are re-crawled; the interval (seconds) is the default one, each source can override it.
+# Off by default, as the checks and re-crawls use the Apify, OpenAI and ActiveLoop credentials of
+# the app; set REFRESH_ENABLED=true to turn them on
+REFRESH_ENABLED = os.environ.get("REFRESH_ENABLED", "false").lower() == "true"
+REFRESH_INTERVAL = float(os.environ.get("REFRESH_INTERVAL", 86400))
+REFRESH_POLL_INTERVAL = float(os.environ.get("REFRESH_POLL_INTERVAL", 60))
+REFRESH_MAX_CONCURRENCY = int(os.environ.get("REFRESH_MAX_CONCURRENCY", 4))
+# Pages checked per run, which also bounds the pages re-crawled at once
+REFRESH_MAX_PAGES = int(os.environ.get("REFRESH_MAX_PAGES", 500))
+# Consecutive checks a page must be found gone (404/410) on before its chunks are deleted
+REFRESH_GONE_CHECKS = int(os.environ.get("REFRESH_GONE_CHECKS", 3))
+# Client-side provider quotas shared by ingestion and interactive calls; the OpenAI ones are
+# synced with the rate limit headers of its responses
+OPENAI_REQUESTS_PER_MINUTE = float(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", 3000))
+OPENAI_TOKENS_PER_MINUTE = float(os.environ.get("OPENAI_TOKENS_PER_MINUTE", 1_000_000))
+COHERE_REQUESTS_PER_MINUTE = float(os.environ.get("COHERE_REQUESTS_PER_MINUTE", 1000))
+# Fraction of the quotas ingestion leaves to interactive calls
+RATE_LIMIT_INTERACTIVE_RESERVE = float(
+    os.environ.get("RATE_LIMIT_INTERACTIVE_RESERVE", 0.2)
+)
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", 6))
+RATE_LIMIT_MAX_BACKOFF = float(os.environ.get("RATE_LIMIT_MAX_BACKOFF", 30))
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000))
+SPECULATIVE_RETRIEVAL_THRESHOLD = float(
+    os.environ.get("SPECULATIVE_RETRIEVAL_THRESHOLD", 0.9)
+)
+# Number of conversation turns rendered at once, older ones are paged in on demand
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", 10))
+CHAT_HISTORY_WINDOW = int(os.environ.get("CHAT_HISTORY_WINDOW", 3))
+SESSION_POOL_MAX_SESSIONS = int(os.environ.get("SESSION_POOL_MAX_SESSIONS", 256))
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", 1800))
+LOCAL_INDEX_ENABLED = os.environ.get("LOCAL_INDEX_ENABLED", "false").lower() == "true"
+LOCAL_INDEX_PATH = os.path.join(CACHE_DIR, "local_index")
+LOCAL_INDEX_DTYPE = os.environ.get("LOCAL_INDEX_DTYPE", "float32")
+# IVF clustering is enabled when the number of lists is positive
+LOCAL_INDEX_IVF_LISTS = int(os.environ.get("LOCAL_INDEX_IVF_LISTS", 0))
+LOCAL_INDEX_IVF_PROBE = int(os.environ.get("LOCAL_INDEX_IVF_PROBE", 8))
+HYBRID_RETRIEVAL_ENABLED = (
+    os.environ.get("HYBRID_RETRIEVAL_ENABLED", "true").lower() == "true"
+)
+LEXICAL_INDEX_PATH = os.path.join(CACHE_DIR, "lexical_index")
+# Sum and count of the normalized embeddings of a collection, used to route queries to it
+CENTROID_PATH = os.path.join(CACHE_DIR, "centroid.npz")
+LEXICAL_TOP_K = int(os.environ.get("LEXICAL_TOP_K", 4))
+# One of "cohere", "lexical" or "onnx"
+RERANKER = os.environ.get("RERANKER", "cohere")
+RERANKER_ONNX_MODEL_PATH = os.environ.get("RERANKER_ONNX_MODEL_PATH", "")
+# Seconds to wait for Cohere before falling back to the local lexical reranker (0 disables it)
+RERANK_LATENCY_BUDGET = float(os.environ.get("RERANK_LATENCY_BUDGET", 1.5))
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", 2000))
+TRACE_LOG_PATH = os.path.join(CACHE_DIR, "traces.jsonl")
+TRACE_LOG_MAX_BYTES = int(os.environ.get("TRACE_LOG_MAX_BYTES", 10_000_000))
+METRICS_PATH = os.path.join(CACHE_DIR, "metrics.prom")
+METRICS_WRITE_INTERVAL = float(os.environ.get("METRICS_WRITE_INTERVAL", 15))
+# Port of the Prometheus metrics endpoint (0 disables it, the metrics file is always written)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+# Show the stage timings of the session's recent traces in the sidebar
+DEBUG_TRACES = os.environ.get("DEBUG_TRACES", "false").lower() == "true"
+# Import the heavy modules and build the shared resources (with credentials from the environment)
+# in the background on the first page load
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
 
-TEMP_AUDIO_PATH = "temp_audio.wav"
 AUDIO_FORMAT = "audio/wav"
+# Recordings are downmixed and resampled to this rate before upload, Whisper's native rate
+AUDIO_SAMPLE_RATE = int(os.environ.get("AUDIO_SAMPLE_RATE", 16000))
+# Compression format of the uploaded audio, e.g. "flac" (needs the optional soundfile package),
+# empty to upload WAV
+AUDIO_COMPRESSION = os.environ.get("AUDIO_COMPRESSION", "")
+TRANSCRIPTION_CACHE_MAX_ENTRIES = int(
+    os.environ.get("TRANSCRIPTION_CACHE_MAX_ENTRIES", 256)
+)
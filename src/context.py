@@ -0,0 +1,227 @@
+import logging
+import re
+import threading
+from copy import deepcopy
+from typing import Any, Optional, Sequence
+
+import tiktoken
+from langchain_core.callbacks.manager import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.pydantic_v1 import Field
+
+from src.source_index import chunk_hash
+
+
+class ContextStats:
+    """
+    Token counters of a context assembler.
+
+    Pydantic copies the assembler when it is validated into a pipeline or a retriever; the counters
+    are not copied with it, so the statistics of the assembler move whichever copy does the work.
+    """
+
+    def __init__(self):
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self._lock = threading.Lock()
+
+    def __copy__(self) -> "ContextStats":
+        return self
+
+    def __deepcopy__(self, memo: dict) -> "ContextStats":
+        return self
+
+    def add(self, tokens_in: int, tokens_out: int) -> None:
+        """
+        Count the tokens of one assembled context.
+
+        Args:
+            tokens_in: Tokens of the chunks received.
+            tokens_out: Tokens of the assembled context.
+        """
+        with self._lock:
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+
+    def as_dict(self) -> dict[str, int]:
+        """
+        Snapshot of the counters, with the tokens saved.
+        """
+        with self._lock:
+            return {
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "tokens_saved": self.tokens_in - self.tokens_out,
+            }
+
+
+class ContextAssembler(BaseDocumentCompressor):
+    """
+    Last compression stage before the LLM, packing the reranked chunks into a token budget.
+
+    Chunks of the same source overlapping each other (as produced by the splitter) are merged with the
+    overlap stripped, near-identical passages are dropped, and the remaining chunks are packed in rank
+    order until the token budget is reached, truncating the last one if needed.
+    """
+
+    max_tokens: int = 2000
+    """Token budget of the assembled context."""
+    min_overlap: int = 8
+    """Minimum number of characters for two chunks to be considered overlapping."""
+    max_overlap: int = 200
+    """Maximum number of characters of overlap looked for between two chunks."""
+    dedup_threshold: float = 0.9
+    """Jaccard similarity of word shingles above which a passage is a duplicate."""
+    model_name: str = "gpt-3.5-turbo"
+    """Model whose tokenizer counts the tokens."""
+    encoding: Any = None
+    """Tokenizer with `encode` and `decode`, loaded from tiktoken if not given."""
+
+    counters: ContextStats = Field(default_factory=ContextStats)
+    """Tokens received and assembled so far, shared with the copies of the assembler."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """
+        Token statistics of the contexts assembled so far.
+        """
+        return self.counters.as_dict()
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        """
+        Merge, deduplicate and pack the documents into the token budget.
+
+        Args:
+            documents: Reranked documents, most relevant first.
+            query: The query the documents were retrieved for.
+            callbacks: Callbacks to run during the compression process.
+
+        Returns:
+            The assembled documents, most relevant first.
+        """
+        encoding = self._get_encoding()
+        tokens_in = sum(len(encoding.encode(doc.page_content)) for doc in documents)
+
+        assembled, budget = [], self.max_tokens
+        for doc in self._deduplicate(self._merge(documents)):
+            tokens = encoding.encode(doc.page_content)
+            if len(tokens) > budget:
+                if not budget:
+                    break
+                doc.page_content = encoding.decode(tokens[:budget])
+                tokens = tokens[:budget]
+            assembled.append(doc)
+            budget -= len(tokens)
+
+        tokens_out = self.max_tokens - budget
+        logging.info(
+            f"Assembled {len(assembled)} of {len(documents)} chunks into {tokens_out} tokens "
+            f"({tokens_in - tokens_out} saved)"
+        )
+        self.counters.add(tokens_in, tokens_out)
+        return assembled
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        return self.compress_documents(documents, query, callbacks)
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens of a text with the assembler's tokenizer.
+
+        Args:
+            text: Text to count the tokens of.
+
+        Returns:
+            Number of tokens of the text.
+        """
+        return len(self._get_encoding().encode(text))
+
+    def _get_encoding(self):
+        if self.encoding is None:
+            self.encoding = tiktoken.encoding_for_model(self.model_name)
+        return self.encoding
+
+    def _merge(self, documents: Sequence[Document]) -> list[Document]:
+        merged: list[Document] = []
+        for doc in documents:
+            doc = Document(doc.page_content, metadata=deepcopy(doc.metadata))
+            doc.metadata.setdefault("chunk_hashes", [chunk_hash(doc.page_content)])
+
+            # Fold the chunk into a higher ranked chunk of the same source it overlaps with
+            for i, kept in enumerate(merged):
+                if kept.metadata.get("source") != doc.metadata.get("source"):
+                    continue
+                if (
+                    overlap := self._overlap(kept.page_content, doc.page_content)
+                ) is not None:
+                    merged[i] = self._join(kept, doc, overlap)
+                    break
+                if (
+                    overlap := self._overlap(doc.page_content, kept.page_content)
+                ) is not None:
+                    merged[i] = self._join(doc, kept, overlap, first_ranked=False)
+                    break
+            else:
+                merged.append(doc)
+        return merged
+
+    def _overlap(self, first: str, second: str) -> Optional[int]:
+        for size in range(
+            min(self.max_overlap, len(first), len(second)), self.min_overlap - 1, -1
+        ):
+            if first.endswith(second[:size]):
+                return size
+        return None
+
+    @staticmethod
+    def _join(
+        first: Document, second: Document, overlap: int, first_ranked: bool = True
+    ) -> Document:
+        # The metadata of the higher ranked chunk is kept
+        kept, other = (first, second) if first_ranked else (second, first)
+        metadata = kept.metadata
+        metadata["chunk_hashes"] = (
+            first.metadata["chunk_hashes"] + second.metadata["chunk_hashes"]
+        )
+        if "relevance_score" in other.metadata:
+            metadata["relevance_score"] = max(
+                metadata.get("relevance_score", 0), other.metadata["relevance_score"]
+            )
+        return Document(
+            first.page_content + second.page_content[overlap:], metadata=metadata
+        )
+
+    def _deduplicate(self, documents: list[Document]) -> list[Document]:
+        kept, kept_shingles = [], []
+        for doc in documents:
+            shingles = self._shingles(doc.page_content)
+            if any(
+                len(shingles & other) / max(len(shingles | other), 1)
+                >= self.dedup_threshold
+                for other in kept_shingles
+            ):
+                continue
+            kept.append(doc)
+            kept_shingles.append(shingles)
+        return kept
+
+    @staticmethod
+    def _shingles(text: str, size: int = 3) -> set[tuple[str, ...]]:
+        words = re.findall(r"\w+", text.lower())
+        return {
+            tuple(words[i : i + size]) for i in range(max(len(words) - size + 1, 1))
+        }
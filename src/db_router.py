@@ -1,36 +1,119 @@
+import contextvars
+import hashlib
+import json
 import logging
-from collections import defaultdict
-from langchain_community.utilities import ApifyWrapper
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
+
+import deeplake
+from apify_client import ApifyClient
 from langchain.docstore.document import Document
 from langchain_community.vectorstores import DeepLake
 from dotenv import load_dotenv
 
+from src.chunker import TokenChunker
+from src.collection_router import collection_path
+from src.consts import (
+    CHUNK_MAX_WORKERS,
+    CHUNK_OVERLAP_TOKENS,
+    CHUNK_TOKENS,
+    DEFAULT_COLLECTION,
+    INGEST_BATCH_SIZE,
+    INGEST_MAX_IN_FLIGHT,
+    SNAPSHOT_BLOCK_SIZE,
+    SNAPSHOTS_PATH,
+    JOBS_DB_PATH,
+    JOB_MAX_WORKERS,
+)
+from src.jobs import Job, JobCancelled, JobQueue
+from src.snapshot import export_snapshot, iter_snapshot, read_manifest, snapshot_path
+from src.listeners import DocumentListener
+from src.source_index import SourceIndex, chunk_hash
+from src.tracing import tracer
+
+if TYPE_CHECKING:
+    from src.freshness import RefreshScheduler
+
 load_dotenv()
 
 
 class DBRouter:
     """
     Router to manage vector database (DeepLake) operations.
+
+    A router manages the dataset of one collection; every collection has its own router, shared by
+    the sessions of every credentials, so the dataset has a single write lock and source index per
+    process. The credentials of the crawler and of the dataset are passed to the calls needing them.
     """
 
-    def __init__(self, credentials: dict[str, str], db: DeepLake):
-        self.credentials = credentials
+    def __init__(
+        self,
+        db: DeepLake,
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = INGEST_BATCH_SIZE,
+        max_in_flight: int = INGEST_MAX_IN_FLIGHT,
+        jobs_path: Optional[str] = None,
+    ):
+        self.collection = collection
+
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.chunker = TokenChunker(
+            chunk_tokens=CHUNK_TOKENS,
+            overlap_tokens=CHUNK_OVERLAP_TOKENS,
+            max_workers=CHUNK_MAX_WORKERS,
+        )
 
         self.db = db
         self.ds = db.ds()
+        self.source_index = SourceIndex.load(self.ds)
+
+        # DeepLake datasets are not safe for concurrent writes from several ingestion threads
+        self._write_lock = threading.RLock()
+        self._listeners: list[DocumentListener] = []
+        # Row IDs in dataset order and the row of each ID, loaded on first use. Appends extend both
+        # in place; deletes swap in a new pair, so readers without the lock see a consistent one
+        self._rows: Optional[tuple[list[str], dict[str, int]]] = None
+        self.jobs_path = jobs_path or collection_path(JOBS_DB_PATH, collection)
+        # Job queue of each credentials, which only sees and runs its own jobs and crawls with them
+        self._jobs: dict[str, JobQueue] = {}
+        self._jobs_lock = threading.Lock()
+        # Attached by the app
+        self.freshness: Optional["RefreshScheduler"] = None
+
+    def attach_refresh_scheduler(self, scheduler: "RefreshScheduler") -> None:
+        """
+        Attach the refresh scheduler of the collection, which tracks the pages this router writes.
+
+        Args:
+            scheduler: Refresh scheduler of the collection.
+        """
+        self.freshness = scheduler
+        self.add_listener(scheduler)
+
+    def add_listener(self, listener: DocumentListener) -> None:
+        """
+        Register a component to be notified after every write to and delete from the database.
+
+        Args:
+            listener: Listener to register.
+        """
+        self._listeners.append(listener)
 
     @property
     def get_all_documents_metadata(self) -> list[dict]:
         """
-        Get all documents metadata from the database.
+        Get all documents metadata from the per-source index.
 
         Returns:
             List of documents metadata.
         """
         try:
-            raw_metadata = [doc.data()["value"] for doc in self.ds.metadata]
-            return self._parse_metadata(raw_metadata)
+            return self.source_index.list_sources()
         except Exception as e:
             raise Exception(f"Error getting all documents metadata: {str(e)}")
 
@@ -45,92 +128,850 @@ class DBRouter:
             True if documents were deleted, False otherwise.
         """
         try:
-            return self.db.delete(filter={"metadata": {"source": url}})
+            return bool(self.delete_documents_by_urls([url]))
         except Exception as e:
             raise Exception(f"Error deleting documents by URL: {str(e)}")
 
-    def add_document_by_url(self, url: str) -> list[str]:
+    def delete_documents_by_urls(self, urls: list[str], compact: bool = False) -> int:
+        """
+        Delete the documents of many URLs in one dataset operation.
+
+        Row IDs are resolved from the per-source index instead of scanning the dataset's metadata.
+
+        Args:
+            urls: URLs of the documents to delete.
+            compact: Whether to compact the dataset storage afterwards.
+
+        Returns:
+            Number of deleted chunks.
+        """
+        try:
+            deleted = self._delete_ids(
+                {url: self.source_index.get_ids(url) for url in urls}
+            )
+            with self._write_lock:
+                for url in urls:
+                    self.source_index.remove(url)
+                self.source_index.save(self.ds)
+            if compact and deleted:
+                self.compact()
+            return deleted
+        except Exception as e:
+            raise Exception(f"Error deleting documents by URLs: {str(e)}")
+
+    def compact(self) -> None:
+        """
+        Rewrite the dataset chunks to reclaim the space left by deleted rows.
+        """
+        logging.info("Compacting the vector database storage")
+        with self._write_lock:
+            self.ds.rechunk(progressbar=False)
+
+    def add_document_by_url(
+        self, url: str, credentials: dict[str, str], job: Optional[Job] = None
+    ) -> list[str]:
         """
         Add a document to vector store by URL.
 
+        The crawl is streamed page by page through splitting, embedding and writing in fixed-size
+        batches, so memory stays bounded and a failure only loses the current batch.
+
         Args:
             url: URL of the document to add.
+            credentials: The credentials to access the APIs.
+            job: Optional background job to report progress to and check for cancellation.
 
         Returns:
             List of added document IDs.
         """
         try:
-            return self.db.add_documents(self._split_data(self._scrape_data(url)))
+            with tracer.trace("ingest", collection=self.collection, url=url) as trace:
+                pages = self._iter_pages(url, credentials)
+                if job is not None:
+                    pages = self._track_pages(pages, job)
+                ids = self._ingest(self._iter_chunks(pages), job=job)
+                trace.set(chunks=len(ids))
+                return ids
+        except JobCancelled:
+            raise
         except Exception as e:
             raise Exception(f"Error adding document by URL: {str(e)}")
 
-    @staticmethod
-    def _parse_metadata(raw_metadata: list[dict]) -> list[dict]:
-        metadata_count = defaultdict(int)
+    def submit_document_by_url(self, url: str, credentials: dict[str, str]) -> int:
+        """
+        Queue adding a document by URL as a background job.
 
-        for metadata in raw_metadata:
-            metadata_tuple = tuple(metadata.items())
-            metadata_count[metadata_tuple] += 1
+        Args:
+            url: URL of the document to add.
+            credentials: The credentials to access the APIs, the job is only visible to them.
+
+        Returns:
+            ID of the job, shared with any job already in flight for the same URL.
+        """
+        try:
+            return self._job_queue(credentials).submit(url)
+        except Exception as e:
+            raise Exception(f"Error submitting document by URL: {str(e)}")
+
+    def submit_documents_by_urls(
+        self, urls: list[str], credentials: dict[str, str]
+    ) -> int:
+        """
+        Queue adding documents by many URLs at once as one background job, which crawls them
+        concurrently and embeds and writes their chunks in shared batches.
+
+        Args:
+            urls: URLs of the documents to add.
+            credentials: The credentials to access the APIs, the job is only visible to them.
+
+        Returns:
+            ID of the job, shared with any job already in flight for the same URLs.
+        """
+        try:
+            return self._job_queue(credentials).submit("\n".join(dict.fromkeys(urls)))
+        except Exception as e:
+            raise Exception(f"Error submitting documents by URLs: {str(e)}")
+
+    def get_jobs(self, credentials: dict[str, str], limit: int = 20) -> list[dict]:
+        """
+        Get the status and progress of the most recent ingestion jobs of some credentials.
+
+        Args:
+            credentials: The credentials the jobs were submitted with.
+            limit: Maximum number of jobs to return.
+
+        Returns:
+            List of job records, newest first.
+        """
+        try:
+            return self._job_queue(credentials).list_jobs(limit)
+        except Exception as e:
+            raise Exception(f"Error getting jobs: {str(e)}")
 
-        unique_metadata_with_counts = [
-            {**dict(metadata_tuple), "count": count}
-            for metadata_tuple, count in metadata_count.items()
+    def cancel_job(self, job_id: int, credentials: dict[str, str]) -> bool:
+        """
+        Cancel a queued or running ingestion job.
+
+        Args:
+            job_id: ID of the job to cancel.
+            credentials: The credentials the job was submitted with.
+
+        Returns:
+            True if the job was in flight, False otherwise.
+        """
+        return self._job_queue(credentials).cancel(job_id)
+
+    def _job_queue(self, credentials: dict[str, str]) -> JobQueue:
+        """
+        Job queue of some credentials, created on first use; creating it resumes the jobs they
+        left queued in a previous process.
+        """
+        owner = hashlib.sha256(
+            json.dumps([credentials, self.ds.path], sort_keys=True).encode()
+        ).hexdigest()[:16]
+        with self._jobs_lock:
+            if owner not in self._jobs:
+                self._jobs[owner] = JobQueue(
+                    self.jobs_path,
+                    lambda job: self._run_job(job, credentials),
+                    max_workers=JOB_MAX_WORKERS,
+                    owner=owner,
+                )
+            return self._jobs[owner]
+
+    def _run_job(self, job: Job, credentials: dict[str, str]) -> None:
+        """
+        Run an ingestion job of one URL, or of many URLs one per line.
+
+        A job of many URLs fails if any of them does, after the chunks of the others are written.
+        """
+        urls = job.url.splitlines()
+        if len(urls) == 1:
+            self.add_document_by_url(urls[0], credentials, job=job)
+            return
+        results = self.add_documents_by_urls(urls, credentials, job=job)
+        errors = [
+            f"{url}: {result['error']}"
+            for url, result in results.items()
+            if result["error"]
         ]
+        if errors:
+            raise Exception(
+                f"{len(errors)} of {len(urls)} URLs failed: " + "; ".join(errors)
+            )
+
+    def add_documents_by_urls(
+        self,
+        urls: list[str],
+        credentials: dict[str, str],
+        max_workers: int = 8,
+        job: Optional[Job] = None,
+    ) -> dict[str, dict]:
+        """
+        Add documents to vector store by many URLs at once.
 
-        return unique_metadata_with_counts
+        Crawls run concurrently on a bounded worker pool, while the resulting chunks of all URLs
+        are streamed into the same batched embedding and writing pipeline.
 
-    def _scrape_data(self, url: str) -> list[Document]:
+        Args:
+            urls: URLs of the documents to add.
+            credentials: The credentials to access the APIs.
+            max_workers: Maximum number of concurrent crawls.
+            job: Optional background job to report progress to and check for cancellation.
+
+        Returns:
+            Mapping of each URL to its added document IDs and error (None on success).
+        """
+        results = {url: {"ids": [], "error": None} for url in urls}
+        origins = deque()
+
+        def iter_chunks():
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                # Crawls run in the context of the trace, so their spans are recorded with it
+                futures = {
+                    executor.submit(
+                        contextvars.copy_context().run, self._crawl, url, credentials
+                    ): url
+                    for url in results
+                }
+                for future in as_completed(futures):
+                    url = futures[future]
+                    try:
+                        pages = self._iter_fetched_pages(future.result(), credentials)
+                        if job is not None:
+                            pages = self._track_pages(pages, job)
+                        for chunk in self._iter_chunks(pages):
+                            origins.append(url)
+                            yield chunk
+                    except JobCancelled:
+                        raise
+                    except Exception as e:
+                        results[url][
+                            "error"
+                        ] = f"Error scraping document by URL: {str(e)}"
+            finally:
+                # Crawls not started yet are dropped when the job is cancelled
+                executor.shutdown(cancel_futures=True)
+
+        def on_batch(batch, ids, error):
+            for doc_id in ids or [None] * len(batch):
+                url = origins.popleft()
+                if error:
+                    results[url][
+                        "error"
+                    ] = f"Error adding document by URL: {str(error)}"
+                else:
+                    results[url]["ids"].append(doc_id)
+
+        with tracer.trace(
+            "ingest", collection=self.collection, urls=len(urls)
+        ) as trace:
+            self._ingest(iter_chunks(), on_batch=on_batch, job=job)
+            trace.set(chunks=sum(len(result["ids"]) for result in results.values()))
+        return results
+
+    def refresh_document_by_url(
+        self, url: str, credentials: dict[str, str]
+    ) -> dict[str, int]:
         """
-        Scrape data from a given URL.
+        Re-ingest a document by URL, only touching the chunks whose content changed.
+
+        Chunk content hashes of the fresh crawl are compared against the stored ones per source:
+        chunks that disappeared are deleted, new chunks are embedded and inserted, the rest is kept.
+        Every stored page under the URL is diffed, so pages the crawl no longer reaches are deleted.
 
         Args:
-            url: URL to scrape data from.
+            url: URL of the document to refresh.
+            credentials: The credentials to access the APIs.
+
+        Returns:
+            Counts of kept, added and removed chunks.
+        """
+        try:
+            counts = {"kept": 0, "added": 0, "removed": 0}
+            refreshed = self._refresh_chunks(
+                self._iter_chunks(self._iter_pages(url, credentials)),
+                sources=[url, *self.source_index.get_sources_under(url)],
+            )
+            for source_counts in refreshed.values():
+                for key, count in source_counts.items():
+                    counts[key] += count
+
+            logging.info(
+                f"Refreshed {url}: {counts['kept']} kept, {counts['added']} added, "
+                f"{counts['removed']} removed"
+            )
+            return counts
+        except Exception as e:
+            raise Exception(f"Error refreshing document by URL: {str(e)}")
+
+    def refresh_pages_by_urls(
+        self, urls: list[str], credentials: dict[str, str]
+    ) -> dict[str, dict[str, int]]:
+        """
+        Re-crawl individual pages, without following their links, and re-ingest their changed chunks.
+
+        All the pages are crawled in one crawler run. Pages missing from the crawl are left as they
+        are, rather than deleted.
+
+        Args:
+            urls: URLs of the pages to refresh.
+            credentials: The credentials to access the APIs.
+
+        Returns:
+            Counts of kept, added and removed chunks of each refreshed page.
+        """
+        try:
+            if not urls:
+                return {}
+            pages = self._iter_fetched_pages(
+                self._crawl_pages(urls, credentials), credentials
+            )
+            return self._refresh_chunks(self._iter_chunks(pages))
+        except Exception as e:
+            raise Exception(f"Error refreshing pages by URLs: {str(e)}")
+
+    def get_chunk_texts(self, source: str, hashes: list[str]) -> list[Optional[str]]:
+        """
+        Fetch the stored text of chunks from their source and content hash.
+
+        Args:
+            source: Source URL of the chunks.
+            hashes: Content hashes of the chunks.
+
+        Returns:
+            The texts, aligned with hashes (None for chunks no longer stored).
+        """
+        try:
+            id_of = {
+                doc_hash: doc_id
+                for doc_id, doc_hash in self.source_index.get_chunks(source)
+            }
+            ids = [id_of[doc_hash] for doc_hash in hashes if doc_hash in id_of]
+            text_of = self._read_texts(ids)
+            if text_of is None:
+                with self._write_lock:
+                    rows = self._resolve_rows(ids)
+                    row_ids = self._rows[0]
+                    texts = (
+                        self.ds.text[rows].data(aslist=True)["value"] if rows else []
+                    )
+                    text_of = {row_ids[row]: text for row, text in zip(rows, texts)}
+            return [text_of.get(id_of.get(doc_hash)) for doc_hash in hashes]
+        except Exception as e:
+            raise Exception(f"Error fetching chunk texts: {str(e)}")
+
+    def export_snapshot(
+        self,
+        name: str,
+        credentials: dict[str, str],
+        block_size: int = SNAPSHOT_BLOCK_SIZE,
+    ) -> dict:
+        """
+        Export the collection to a local snapshot, to seed another dataset without re-crawling and
+        re-embedding.
+
+        The dataset is committed and the snapshot read from a read-only view of that commit, so it
+        is consistent while writes go on during the export.
+
+        Args:
+            name: Name of the snapshot, stored under the snapshots directory; an existing snapshot
+                of that name is replaced.
+            credentials: The credentials to access the dataset.
+            block_size: Number of rows read and written at once.
+
+        Returns:
+            The manifest of the snapshot.
+        """
+        try:
+            path = snapshot_path(SNAPSHOTS_PATH, name)
+            with tracer.trace("snapshot.export", collection=self.collection) as trace:
+                with self._write_lock:
+                    commit_id = self.ds.commit(
+                        f"Snapshot export {name}", allow_empty=True
+                    )
+                version = deeplake.load(
+                    self.ds.path,
+                    read_only=True,
+                    token=credentials.get("activeloop_token"),
+                    verbose=False,
+                )
+                version.checkout(commit_id)
+                manifest = export_snapshot(
+                    version,
+                    path,
+                    block_size=block_size,
+                    collection=self.collection,
+                    commit_id=commit_id,
+                )
+                trace.set(chunks=manifest["count"])
+                return manifest
+        except Exception as e:
+            raise Exception(f"Error exporting snapshot: {str(e)}")
+
+    def import_snapshot(self, name: str, batch_size: int = SNAPSHOT_BLOCK_SIZE) -> int:
+        """
+        Bulk import a snapshot into the empty dataset of the collection.
+
+        The stored embeddings are written as they are, in large batches, so no embedding API call
+        is made. Chunks keep their row IDs; the source index and the listeners are updated as on
+        ingestion.
+
+        Args:
+            name: Name of the snapshot, stored under the snapshots directory.
+            batch_size: Number of rows written at once.
+
+        Returns:
+            Number of imported chunks.
+        """
+        try:
+            path = snapshot_path(SNAPSHOTS_PATH, name)
+            read_manifest(path)
+            with self._write_lock:
+                if len(self.ds):
+                    raise ValueError("the dataset is not empty")
+            with tracer.trace("snapshot.import", collection=self.collection) as trace:
+                write_span = tracer.start_span("snapshot.write")
+                imported = 0
+                try:
+                    batches = tracer.iter_span(
+                        "snapshot.read",
+                        iter_snapshot(path, batch_size),
+                        count="batches",
+                    )
+                    for batch, embeddings, ids in batches:
+                        start = time.perf_counter()
+                        imported += len(self._write_batch(batch, embeddings, ids))
+                        write_span.add(time.perf_counter() - start, items=len(batch))
+                finally:
+                    with self._write_lock:
+                        self.source_index.save(self.ds)
+                    self._flush_listeners()
+                trace.set(chunks=imported)
+            logging.info(f"Imported {imported} chunks from snapshot {path}")
+            return imported
+        except Exception as e:
+            raise Exception(f"Error importing snapshot: {str(e)}")
+
+    def rebuild_source_index(self) -> None:
+        """
+        Rebuild the per-source index from a full scan of the database.
+        """
+        try:
+            self.source_index.rebuild(self.ds)
+        except Exception as e:
+            raise Exception(f"Error rebuilding source index: {str(e)}")
+
+    def _refresh_chunks(
+        self, chunks: Iterable[Document], sources: Iterable[str] = ()
+    ) -> dict[str, dict[str, int]]:
+        """
+        Diff freshly crawled chunks against the stored ones by content hash, per source.
+
+        Chunks that disappeared are deleted, new chunks are embedded and inserted, the rest is kept.
+        The new chunks are inserted before the stale ones are deleted, so a source never goes
+        missing from search while it is refreshed, and keeps its old chunks if ingestion fails.
+
+        Args:
+            chunks: Chunks of the fresh crawl.
+            sources: Sources to diff even if the crawl returned nothing for them, which deletes
+                all their chunks.
+
+        Returns:
+            Counts of kept, added and removed chunks of each source.
+        """
+        docs_by_source = defaultdict(list)
+        for doc in chunks:
+            docs_by_source[doc.metadata["source"]].append(doc)
+
+        counts, new_docs, stale_ids = {}, [], {}
+        for source in {*sources, *docs_by_source}:
+            stored_ids = defaultdict(list)
+            for doc_id, doc_hash in self.source_index.get_chunks(source):
+                stored_ids[doc_hash].append(doc_id)
+
+            kept = 0
+            for doc in docs_by_source.get(source, []):
+                matching_ids = stored_ids.get(chunk_hash(doc.page_content))
+                if matching_ids:
+                    matching_ids.pop()
+                    kept += 1
+                else:
+                    new_docs.append(doc)
+
+            stale_ids[source] = [
+                doc_id for ids in stored_ids.values() for doc_id in ids
+            ]
+            counts[source] = {
+                "kept": kept,
+                "added": len(docs_by_source.get(source, [])) - kept,
+                "removed": len(stale_ids[source]),
+            }
+
+        self._ingest(new_docs)
+        self._delete_ids(stale_ids)
+        return counts
+
+    def _ingest(
+        self,
+        chunks: Iterable[Document],
+        on_batch: Optional[
+            Callable[[list[Document], list[str], Optional[Exception]], None]
+        ] = None,
+        job: Optional[Job] = None,
+    ) -> list[str]:
+        """
+        Embed and write chunks to the vector store batch by batch and register them in the source index.
+
+        Batches are embedded on a worker pool with at most `max_in_flight` batches pending; the input
+        iterator is not advanced while the pool is full, which bounds memory to a few batches.
+        Batches are written in order, and each written batch is durable on its own.
+
+        Args:
+            chunks: Chunks to add, possibly a lazy iterator.
+            on_batch: Optional callback receiving each batch with its IDs and error. When given,
+                failed batches are reported to it and ingestion continues, otherwise the error is raised.
+            job: Optional background job to report progress to and check for cancellation.
 
         Returns:
-            List of scraped documents.
+            List of added document IDs.
+        """
+        ids = []
+        # Batches are embedded concurrently, so the embedding span sums their busy time
+        embed_span = tracer.start_span("ingest.embed")
+        write_span = tracer.start_span("ingest.write")
+
+        def embed(texts):
+            start = time.perf_counter()
+            embeddings = self.db.embeddings.embed_documents(texts)
+            embed_span.add(
+                time.perf_counter() - start,
+                items=len(texts),
+                tokens=sum(self.chunker.count_tokens(text) for text in texts),
+            )
+            return embeddings
+
+        def write_oldest():
+            batch, future = in_flight.popleft()
+            try:
+                embeddings = future.result()
+                if job is not None:
+                    job.advance("chunks_embedded", len(batch))
+                start = time.perf_counter()
+                batch_ids = self._write_batch(batch, embeddings)
+                write_span.add(time.perf_counter() - start, items=len(batch_ids))
+            except Exception as e:
+                if on_batch is None:
+                    raise
+                on_batch(batch, [], e)
+                return
+            ids.extend(batch_ids)
+            if job is not None:
+                job.advance("chunks_written", len(batch_ids))
+            if on_batch is not None:
+                on_batch(batch, batch_ids, None)
+
+        in_flight = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+                for batch in self._iter_batches(chunks, self.batch_size):
+                    if job is not None:
+                        job.raise_if_cancelled()
+                    texts = [doc.page_content for doc in batch]
+                    in_flight.append((batch, executor.submit(embed, texts)))
+                    if len(in_flight) >= self.max_in_flight:
+                        write_oldest()
+                while in_flight:
+                    write_oldest()
+        finally:
+            with self._write_lock:
+                self.source_index.save(self.ds)
+            self._flush_listeners()
+        return ids
+
+    def _write_batch(
+        self,
+        batch: list[Document],
+        embeddings: list[list[float]],
+        ids: Optional[list[str]] = None,
+    ) -> list[str]:
+        """
+        Append one batch of embedded chunks to the vector store.
+
+        Args:
+            batch: Chunks to write.
+            embeddings: Embeddings of the chunks, aligned with batch.
+            ids: Row IDs of the chunks, generated if not given.
+
+        Returns:
+            List of added document IDs.
+        """
+        with self._write_lock:
+            batch_ids = self.db.vectorstore.add(
+                **({"id": ids} if ids is not None else {}),
+                text=[doc.page_content for doc in batch],
+                metadata=[
+                    {
+                        **doc.metadata,
+                        SourceIndex.HASH_KEY: chunk_hash(doc.page_content),
+                    }
+                    for doc in batch
+                ],
+                embedding=embeddings,
+                return_ids=True,
+            )
+            self.source_index.add(batch, batch_ids)
+            if self._rows is not None:
+                row_ids, row_of = self._rows
+                for doc_id in batch_ids:
+                    row_of[doc_id] = len(row_ids)
+                    row_ids.append(doc_id)
+        for listener in self._listeners:
+            listener.on_documents_added(batch, batch_ids, embeddings)
+        return batch_ids
+
+    @staticmethod
+    def _iter_batches(
+        items: Iterable[Document], batch_size: int
+    ) -> Iterator[list[Document]]:
+        iterator = iter(items)
+        while batch := list(islice(iterator, batch_size)):
+            yield batch
+
+    def _delete_ids(self, ids_by_source: dict[str, list[str]]) -> int:
+        """
+        Delete chunks by row ID in one dataset operation and drop them from the source index.
+
+        Args:
+            ids_by_source: Row IDs to delete, per source.
+
+        Returns:
+            Number of deleted chunks.
+        """
+        ids = [doc_id for source_ids in ids_by_source.values() for doc_id in source_ids]
+        if not ids:
+            return 0
+        with self._write_lock:
+            rows = self._resolve_rows(ids)
+            # IDs no longer in the dataset are only dropped from the index; DeepLake rejects an
+            # empty selection
+            if rows:
+                for listener in self._listeners:
+                    listener.on_documents_deleting(rows)
+                self.db.vectorstore.delete(row_ids=rows)
+            deleted = set(ids)
+            row_ids = [doc_id for doc_id in self._rows[0] if doc_id not in deleted]
+            self._rows = (
+                row_ids,
+                {doc_id: row for row, doc_id in enumerate(row_ids)},
+            )
+            for source, source_ids in ids_by_source.items():
+                self.source_index.remove_ids(source, source_ids)
+            self.source_index.save(self.ds)
+        for listener in self._listeners:
+            listener.on_documents_deleted(ids_by_source)
+        self._flush_listeners()
+        return len(rows)
+
+    def _flush_listeners(self) -> None:
+        """
+        Let the listeners persist the changes they buffered, without failing the completed operation.
+        """
+        for listener in self._listeners:
+            try:
+                listener.flush()
+            except Exception as e:
+                logging.warning(f"Error flushing {type(listener).__name__}: {str(e)}")
+
+    def _resolve_rows(self, ids: list[str]) -> list[int]:
+        """
+        Map row IDs to dataset row positions, without scanning the metadata.
+
+        The row order of IDs is read from the ID tensor once and then maintained on every write and
+        delete; positions are checked against the dataset before use, and re-read if they drifted.
+        Must be called with the write lock held.
+
+        Args:
+            ids: Row IDs.
+
+        Returns:
+            Sorted dataset row positions of the IDs still present.
+        """
+        for reload in (False, True):
+            if reload or self._rows is None or len(self._rows[0]) != len(self.ds):
+                row_ids = self.ds.id.data(aslist=True)["value"]
+                self._rows = (
+                    row_ids,
+                    {doc_id: row for row, doc_id in enumerate(row_ids)},
+                )
+            row_ids, row_of = self._rows
+            rows = sorted(row_of[doc_id] for doc_id in set(ids) if doc_id in row_of)
+            if not rows or self.ds.id[rows].data(aslist=True)["value"] == [
+                row_ids[row] for row in rows
+            ]:
+                return rows
+        raise RuntimeError("Row positions do not match the dataset")
+
+    def _read_texts(self, ids: list[str]) -> Optional[dict[str, str]]:
+        """
+        Read the texts of chunks without taking the write lock.
+
+        Rows are looked up in the current ID map, and the IDs are read back after the texts: deletes
+        only move rows down, so an ID still at its looked-up row was there when its text was read.
+
+        Args:
+            ids: Row IDs.
+
+        Returns:
+            The text of each ID still present, or None if the map is not loaded or a concurrent
+            write moved the rows, for the caller to read under the lock.
+        """
+        state = self._rows
+        if state is None:
+            return None
+        row_ids, row_of = state
+        expected = sorted(
+            (row, doc_id)
+            for doc_id in set(ids)
+            if (row := row_of.get(doc_id)) is not None
+        )
+        if len(expected) != len(set(ids)):
+            # IDs missing from the map may have been added since it was loaded
+            return None
+        if not expected:
+            return {}
+        rows = [row for row, _ in expected]
+        try:
+            texts = self.ds.text[rows].data(aslist=True)["value"]
+            stored_ids = self.ds.id[rows].data(aslist=True)["value"]
+        except Exception:
+            return None
+        if stored_ids != [doc_id for _, doc_id in expected]:
+            return None
+        return {doc_id: text for (_, doc_id), text in zip(expected, texts)}
+
+    def _run_crawler(self, url: str, credentials: dict[str, str]) -> str:
+        """
+        Run the website content crawler on a given URL.
+
+        Args:
+            url: URL to crawl.
+            credentials: The credentials to access the crawler.
+
+        Returns:
+            ID of the Apify dataset holding the crawled pages.
         """
         logging.info(f"Scraping data from url: {url}")
 
-        apify = ApifyWrapper(apify_api_token=self.credentials["apify_api_token"])
-        loader = apify.call_actor(
-            actor_id="apify/website-content-crawler",
-            run_input={"startUrls": [{"url": url}]},
-            dataset_mapping_function=lambda dataset_item: Document(
+        client = ApifyClient(credentials["apify_api_token"])
+        actor_call = client.actor("apify/website-content-crawler").call(
+            run_input={"startUrls": [{"url": url}], "saveMarkdown": True}
+        )
+        return actor_call["defaultDatasetId"]
+
+    def _run_page_crawler(self, urls: list[str], credentials: dict[str, str]) -> str:
+        """
+        Run the website content crawler on individual pages, without following their links.
+
+        Args:
+            urls: URLs of the pages to crawl.
+            credentials: The credentials to access the crawler.
+
+        Returns:
+            ID of the Apify dataset holding the crawled pages.
+        """
+        logging.info(f"Scraping data from {len(urls)} pages")
+
+        client = ApifyClient(credentials["apify_api_token"])
+        actor_call = client.actor("apify/website-content-crawler").call(
+            run_input={
+                "startUrls": [{"url": url} for url in urls],
+                "maxCrawlDepth": 0,
+                "maxCrawlPages": len(urls),
+                "saveMarkdown": True,
+            }
+        )
+        return actor_call["defaultDatasetId"]
+
+    def _iter_dataset_pages(
+        self, dataset_id: str, credentials: dict[str, str]
+    ) -> Iterator[Document]:
+        """
+        Page through a crawled Apify dataset without loading it into memory at once.
+
+        Pages are read as Markdown, which keeps the headings the chunker splits sections on, and
+        as plain text when the crawler saved none.
+
+        Args:
+            dataset_id: ID of the Apify dataset.
+            credentials: The credentials to access the crawler.
+
+        Yields:
+            Scraped documents, one per crawled page.
+        """
+        client = ApifyClient(credentials["apify_api_token"])
+        for dataset_item in client.dataset(dataset_id).iterate_items():
+            yield Document(
                 page_content=(
-                    dataset_item["text"]
-                    if dataset_item["text"]
-                    else "No content available"
+                    dataset_item.get("markdown")
+                    or dataset_item["text"]
+                    or "No content available"
                 ),
                 metadata={
                     "source": dataset_item["url"],
                     "title": dataset_item["metadata"]["title"],
                 },
-            ),
+            )
+
+    def _iter_pages(self, url: str, credentials: dict[str, str]) -> Iterator[Document]:
+        """
+        Crawl a given URL and lazily yield the scraped pages.
+
+        Args:
+            url: URL to scrape data from.
+            credentials: The credentials to access the crawler.
+
+        Yields:
+            Scraped documents, one per crawled page.
+        """
+        yield from self._iter_fetched_pages(self._crawl(url, credentials), credentials)
+
+    def _crawl(self, url: str, credentials: dict[str, str]) -> str:
+        with tracer.span("ingest.crawl", url=url, items=1):
+            return self._run_crawler(url, credentials)
+
+    def _crawl_pages(self, urls: list[str], credentials: dict[str, str]) -> str:
+        with tracer.span("ingest.crawl", pages=len(urls), items=1):
+            return self._run_page_crawler(urls, credentials)
+
+    def _iter_fetched_pages(
+        self, dataset_id: str, credentials: dict[str, str]
+    ) -> Iterator[Document]:
+        return tracer.iter_span(
+            "ingest.fetch",
+            self._iter_dataset_pages(dataset_id, credentials),
+            count="pages",
         )
-        return loader.load()
 
     @staticmethod
-    def _split_data(
-        docs, chunk_size: int = 1000, chunk_overlap: int = 20, length_function=len
-    ) -> list[Document]:
+    def _track_pages(pages: Iterable[Document], job: Job) -> Iterator[Document]:
+        for page in pages:
+            job.raise_if_cancelled()
+            job.advance("pages_crawled")
+            yield page
+
+    def _iter_chunks(self, pages: Iterable[Document]) -> Iterator[Document]:
         """
-        Split the scraped data into smaller chunks.
+        Lazily split scraped pages into token-sized chunks.
 
         Args:
-            docs: List of documents to split.
-            chunk_size: Size of each chunk.
-            chunk_overlap: Overlap between chunks.
-            length_function: Function to calculate the length of the document.
+            pages: Scraped documents, possibly a lazy iterator.
 
-        Returns:
-            List of split documents.
+        Yields:
+            Split documents.
         """
-        logging.info("Splitting data into smaller chunks")
-
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=length_function,
+        logging.debug("Splitting data into smaller chunks")
+        yield from tracer.iter_span(
+            "ingest.split", self.chunker.iter_chunks(pages), count="chunks"
         )
-        docs_split = text_splitter.split_documents(docs)
-        return docs_split
@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """
+    On-disk, size-bounded embedding cache with LRU eviction, keyed by a hash of chunk text and model name.
+
+    The number of rows is counted once on open and then kept up to date by the writes, so checking
+    the size bound does not scan the table.
+    """
+
+    def __init__(self, path: str, max_entries: int = 200_000):
+        self.path = path
+        self.max_entries = max_entries
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+            )
+            self._count = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+
+    @staticmethod
+    def make_key(text: str, model_name: str) -> str:
+        """
+        Build the content address of a chunk for a given embedding model.
+
+        Args:
+            text: Chunk text.
+            model_name: Name of the embedding model.
+
+        Returns:
+            Hex digest identifying the (model, text) pair.
+        """
+        return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """
+        Look up cached embeddings and mark them as recently used.
+
+        Args:
+            keys: Cache keys to look up.
+
+        Returns:
+            Mapping of the found keys to their embeddings.
+        """
+        found = {}
+        with self._lock, self._conn:
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = array("f", vector).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+        return found
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        """
+        Store embeddings, evicting the least recently used ones above the size bound.
+
+        Args:
+            items: Mapping of cache keys to embeddings.
+        """
+        now = time.time()
+        keys = list(items)
+        with self._lock, self._conn:
+            existing = sum(
+                self._conn.execute(
+                    f"SELECT COUNT(*) FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchone()[0]
+                for batch in (keys[i : i + 500] for i in range(0, len(keys), 500))
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [
+                    (key, array("f", vector).tobytes(), now)
+                    for key, vector in items.items()
+                ],
+            )
+            self._count += len(keys) - existing
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                self._count -= self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                ).rowcount
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that checks the embedding cache before calling the embedding API.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        cache: EmbeddingCache,
+        model_name: str,
+        max_queries: int = 1024,
+    ):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+        # Queries are embedded by both the answer cache and the retriever, keep recent ones in memory
+        self.max_queries = max_queries
+        self._queries: OrderedDict[str, list[float]] = OrderedDict()
+        # Guards the recent queries and the hit counters, documents are embedded from several threads
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed documents, only sending texts that are not cached yet to the embedding API.
+
+        Args:
+            texts: Texts to embed.
+
+        Returns:
+            List of embeddings, aligned with texts.
+        """
+        keys = [self.cache.make_key(text, self.model_name) for text in texts]
+        vectors = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        hits = sum(key in vectors for key in keys)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(texts) - hits
+        logging.info(f"Embedding cache: {hits} hits, {len(texts) - hits} misses")
+
+        if missing:
+            embedded = self.embeddings.embed_documents(list(missing.values()))
+            # Round to float32 like the cache does, so hits and misses return identical vectors
+            new_vectors = {
+                key: array("f", vector).tolist()
+                for key, vector in zip(missing.keys(), embedded)
+            }
+            self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self._get_query(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._put_query(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        vector = self._get_query(text)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self._put_query(text, vector)
+        return vector
+
+    def _get_query(self, text: str) -> Optional[list[float]]:
+        with self._lock:
+            if text in self._queries:
+                self._queries.move_to_end(text)
+                return self._queries[text]
+        return None
+
+    def _put_query(self, text: str, vector: list[float]) -> None:
+        with self._lock:
+            self._queries[text] = vector
+            while len(self._queries) > self.max_queries:
+                self._queries.popitem(last=False)
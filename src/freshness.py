@@ -0,0 +1,593 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Iterable, Optional
+
+from langchain.docstore.document import Document
+
+from src.listeners import DocumentListener
+from src.tracing import tracer
+
+if TYPE_CHECKING:
+    from src.db_router import DBRouter
+
+PAGE_FIELDS = (
+    "source",
+    "interval",
+    "etag",
+    "last_modified",
+    "content_hash",
+    "status",
+    "error",
+    "checked_at",
+    "changed_at",
+    "next_check_at",
+    "gone_checks",
+)
+# HTTP statuses meaning the page was removed, so its chunks are deleted once confirmed
+GONE_STATUSES = (404, 410)
+
+
+@dataclass
+class PageCheck:
+    """
+    Outcome of a conditional fetch of a page.
+    """
+
+    status: str
+    """One of "not_modified", "fetched", "gone" or "failed"."""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    error: Optional[str] = None
+
+
+def fetch_page(
+    url: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    timeout: float = 30,
+) -> PageCheck:
+    """
+    Fetch a page conditionally on its recorded validators.
+
+    The body is only downloaded when the server cannot confirm the page is unchanged, and is
+    hashed in blocks rather than kept.
+
+    Args:
+        url: URL of the page.
+        etag: ETag recorded on the previous fetch.
+        last_modified: Last-Modified recorded on the previous fetch.
+        timeout: Timeout of the request in seconds.
+
+    Returns:
+        The outcome of the fetch.
+    """
+    headers = {"User-Agent": "knowledge-base-refresh"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            digest = hashlib.blake2b(digest_size=16)
+            while block := response.read(65536):
+                digest.update(block)
+            return PageCheck(
+                "fetched",
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                content_hash=digest.hexdigest(),
+            )
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return PageCheck(
+                "not_modified",
+                etag=e.headers.get("ETag"),
+                last_modified=e.headers.get("Last-Modified"),
+            )
+        if e.code in GONE_STATUSES:
+            return PageCheck("gone", error=f"HTTP {e.code}")
+        return PageCheck("failed", error=f"HTTP {e.code}")
+    except Exception as e:
+        return PageCheck("failed", error=str(e))
+
+
+class FreshnessStore:
+    """
+    Persistent SQLite table of the stored pages with their validators and refresh schedule.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "source TEXT PRIMARY KEY, interval REAL NOT NULL, etag TEXT, "
+                "last_modified TEXT, content_hash TEXT, status TEXT, error TEXT, "
+                "checked_at REAL, changed_at REAL, next_check_at REAL NOT NULL, "
+                "gone_checks INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(pages)")]
+            if "gone_checks" not in columns:
+                self._conn.execute(
+                    "ALTER TABLE pages ADD COLUMN gone_checks INTEGER NOT NULL DEFAULT 0"
+                )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS pages_next_check ON pages (next_check_at)"
+            )
+
+    def register(self, sources: Iterable[str], interval: float, now: float) -> None:
+        """
+        Start tracking pages, leaving the already tracked ones as they are.
+
+        New pages are due at once, so their validators are recorded close to their ingestion.
+
+        Args:
+            sources: Source URLs of the pages.
+            interval: Refresh interval of the pages in seconds.
+            now: Current time.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO pages (source, interval, next_check_at) VALUES (?, ?, ?)",
+                [(source, interval, now) for source in sources],
+            )
+
+    def remove(self, sources: Iterable[str]) -> None:
+        """
+        Stop tracking pages.
+
+        Args:
+            sources: Source URLs of the pages.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM pages WHERE source = ?", [(source,) for source in sources]
+            )
+
+    def sources(self) -> set[str]:
+        """
+        Source URLs of all the tracked pages.
+        """
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT source FROM pages")}
+
+    def get(self, source: str) -> Optional[dict]:
+        """
+        Get the validators and schedule of a page.
+
+        Args:
+            source: Source URL of the page.
+
+        Returns:
+            The page record, or None if the page is not tracked.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(PAGE_FIELDS)} FROM pages WHERE source = ?",
+                (source,),
+            ).fetchone()
+        return dict(zip(PAGE_FIELDS, row)) if row else None
+
+    def due(self, now: float, limit: int) -> list[dict]:
+        """
+        List the pages due for a check, most overdue first.
+
+        Args:
+            now: Current time.
+            limit: Maximum number of pages to return.
+
+        Returns:
+            Page records.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(PAGE_FIELDS)} FROM pages WHERE next_check_at <= ? "
+                "ORDER BY next_check_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+        return [dict(zip(PAGE_FIELDS, row)) for row in rows]
+
+    def summary(self, now: float) -> dict[str, int]:
+        """
+        Count the tracked pages, the due ones and the ones per status of their last check.
+
+        Args:
+            now: Current time.
+
+        Returns:
+            Counts of pages.
+        """
+        with self._lock:
+            counts = dict(
+                self._conn.execute(
+                    "SELECT COALESCE(status, 'pending'), COUNT(*) FROM pages GROUP BY 1"
+                ).fetchall()
+            )
+            (due,) = self._conn.execute(
+                "SELECT COUNT(*) FROM pages WHERE next_check_at <= ?", (now,)
+            ).fetchone()
+        return {"pages": sum(counts.values()), "due": due, **counts}
+
+    def record(self, source: str, now: float, **fields) -> None:
+        """
+        Record the outcome of a check and schedule the next one after the page's interval.
+
+        Args:
+            source: Source URL of the page.
+            now: Time of the check.
+            fields: Page fields to update.
+        """
+        fields = {key: value for key, value in fields.items() if key in PAGE_FIELDS}
+        assignments = "".join(f"{key} = ?, " for key in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE pages SET {assignments}checked_at = ?, "
+                "next_check_at = ? + interval WHERE source = ?",
+                (*fields.values(), now, now, source),
+            )
+
+    def set_interval(self, source: str, interval: float) -> int:
+        """
+        Change the refresh interval of a source and of the pages under it.
+
+        Args:
+            source: Source URL.
+            interval: Refresh interval in seconds.
+
+        Returns:
+            Number of updated pages.
+        """
+        prefix = source.rstrip("/") + "/%"
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE pages SET interval = ?, "
+                "next_check_at = COALESCE(checked_at, next_check_at) + ? "
+                "WHERE source = ? OR source LIKE ?",
+                (interval, interval, source, prefix),
+            ).rowcount
+
+    def mark_due(self, sources: Optional[Iterable[str]] = None) -> None:
+        """
+        Make pages due for a check now.
+
+        Args:
+            sources: Source URLs of the pages, or None for all pages.
+        """
+        with self._lock, self._conn:
+            if sources is None:
+                self._conn.execute("UPDATE pages SET next_check_at = 0")
+            else:
+                self._conn.executemany(
+                    "UPDATE pages SET next_check_at = 0 WHERE source = ?",
+                    [(source,) for source in sources],
+                )
+
+
+class RefreshScheduler(DocumentListener):
+    """
+    Background scheduler keeping the stored pages of a collection fresh.
+
+    Every due page is fetched conditionally on its recorded ETag and Last-Modified, and its body
+    hash is compared when the server cannot tell. Only the pages that changed are re-crawled, in
+    one crawler run without following links, and their chunks diffed against the stored ones;
+    pages found gone on `gone_checks` consecutive checks are deleted, so a transient 404 does not
+    drop them. Crawl spend and ingestion load thus scale with the changes, while unchanged pages
+    cost a conditional request each.
+
+    There is one scheduler per collection and process, attached to the router of the collection,
+    which re-crawls the changed pages with the credentials it was created with. As a listener of the
+    router, it starts tracking pages as they are ingested and stops once all their chunks are
+    deleted.
+    """
+
+    def __init__(
+        self,
+        db_router: "DBRouter",
+        path: str,
+        credentials: dict[str, str],
+        default_interval: float = 86400,
+        max_concurrency: int = 4,
+        max_pages: int = 500,
+        poll_interval: float = 60,
+        gone_checks: int = 3,
+        fetch: Callable[..., PageCheck] = fetch_page,
+    ):
+        self.db_router = db_router
+        self.store = FreshnessStore(path)
+        self.credentials = credentials
+        self.default_interval = default_interval
+        self.max_concurrency = max_concurrency
+        self.max_pages = max_pages
+        self.poll_interval = poll_interval
+        self.gone_checks = gone_checks
+        self.fetch = fetch
+
+        # Result of the last run serving a requested check, None until then
+        self.last_result: Optional[dict[str, int]] = None
+
+        # Checks triggered from the UI must not overlap with the scheduled ones
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Requested checks are numbered, a run serves the requests made before it started
+        self._request_lock = threading.Lock()
+        self._requested = 0
+        self._served = 0
+
+    @property
+    def refresh_pending(self) -> bool:
+        """
+        Whether a requested check has not finished yet.
+        """
+        with self._request_lock:
+            return self._served < self._requested
+
+    def start(self) -> None:
+        """
+        Start checking the due pages periodically on a daemon thread.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="refresh-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the periodic checks after the current one.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sync(self) -> None:
+        """
+        Track the pages stored before the scheduler existed and drop the pages no longer stored.
+        """
+        stored = {
+            metadata["source"] for metadata in self.db_router.get_all_documents_metadata
+        }
+        self.store.remove(self.store.sources() - stored)
+        self.store.register(stored, self.default_interval, time.time())
+
+    def set_interval(self, source: str, interval: float) -> int:
+        """
+        Change the refresh interval of a source and of the pages under it.
+
+        Args:
+            source: Source URL.
+            interval: Refresh interval in seconds.
+
+        Returns:
+            Number of updated pages.
+        """
+        try:
+            return self.store.set_interval(source, interval)
+        except Exception as e:
+            raise Exception(f"Error setting refresh interval: {str(e)}")
+
+    def refresh_now(self, sources: Optional[list[str]] = None) -> dict[str, int]:
+        """
+        Check pages at once, regardless of their schedule.
+
+        Args:
+            sources: Source URLs of the pages, or None for all pages.
+
+        Returns:
+            Counts of the outcome of the checks and of the refreshed chunks.
+        """
+        self.store.mark_due(sources)
+        return self.run_once()
+
+    def request_refresh(self, sources: Optional[list[str]] = None) -> None:
+        """
+        Check pages as soon as possible, regardless of their schedule, without waiting for it.
+
+        The check runs on the scheduler thread, or on a thread of its own if the scheduler is not
+        started; its result is then available as `last_result`.
+
+        Args:
+            sources: Source URLs of the pages, or None for all pages.
+        """
+        self.store.mark_due(sources)
+        with self._request_lock:
+            self._requested += 1
+        if self._thread is None:
+            threading.Thread(
+                target=self._run_requested, name="refresh-request", daemon=True
+            ).start()
+        else:
+            self._wake.set()
+
+    def run_once(self, now: Optional[float] = None) -> dict[str, int]:
+        """
+        Check the due pages and refresh the changed ones.
+
+        At most `max_pages` pages are checked per run, with at most `max_concurrency` requests in
+        flight. Pages seen for the first time only record a baseline.
+
+        Args:
+            now: Current time, defaults to the wall clock.
+
+        Returns:
+            Counts of the outcome of the checks and of the refreshed chunks.
+        """
+        with self._run_lock, tracer.trace(
+            "refresh", collection=self.db_router.collection
+        ) as trace:
+            now = time.time() if now is None else now
+            pages = self.store.due(now, self.max_pages)
+            with tracer.span("refresh.check", items=len(pages)):
+                with ThreadPoolExecutor(
+                    max_workers=max(min(self.max_concurrency, len(pages)), 1)
+                ) as executor:
+                    checks = list(executor.map(self._check, pages))
+
+            outcomes = Counter()
+            changed, gone = [], []
+            for page, check in zip(pages, checks):
+                outcome = self._classify(page, check)
+                if outcome == "gone" and page["gone_checks"] + 1 < self.gone_checks:
+                    # Not deleted until it is found gone on consecutive checks
+                    outcome = "missing"
+                outcomes[outcome] += 1
+                if outcome == "changed":
+                    changed.append((page, check))
+                elif outcome == "gone":
+                    gone.append(page["source"])
+                elif outcome == "missing":
+                    self.store.record(
+                        page["source"],
+                        now,
+                        status=outcome,
+                        error=check.error,
+                        gone_checks=page["gone_checks"] + 1,
+                    )
+                else:
+                    self._record(page["source"], now, outcome, check)
+
+            chunks = Counter()
+            if changed:
+                chunks.update(self._refresh_changed(changed, now))
+            if gone:
+                chunks["removed"] += self.db_router.delete_documents_by_urls(gone)
+                self.store.remove(gone)
+
+            result = {"checked": len(pages), **outcomes, **chunks}
+            trace.set(**result)
+        if pages:
+            logging.info(f"Refresh of {self.db_router.collection}: {result}")
+        return result
+
+    def on_documents_added(
+        self, docs: list[Document], ids: list[str], embeddings: list[list[float]]
+    ) -> None:
+        self.store.register(
+            {doc.metadata["source"] for doc in docs}, self.default_interval, time.time()
+        )
+
+    def on_documents_deleted(self, ids_by_source: dict[str, list[str]]) -> None:
+        self.store.remove(
+            source
+            for source in ids_by_source
+            if not self.db_router.source_index.get_ids(source)
+        )
+
+    def _loop(self) -> None:
+        try:
+            self.sync()
+        except Exception as e:
+            logging.warning(f"Error syncing refresh schedule: {str(e)}")
+        while not self._stop.is_set():
+            self._wake.clear()
+            self._run_requested()
+            self._wake.wait(self.poll_interval)
+
+    def _run_requested(self) -> None:
+        with self._request_lock:
+            requested = self._requested
+        try:
+            result = self.run_once()
+        except Exception as e:
+            logging.warning(f"Error refreshing documents: {str(e)}")
+            result = {"checked": 0, "error": str(e)}
+        with self._request_lock:
+            if requested > self._served:
+                self._served, self.last_result = requested, result
+
+    def _check(self, page: dict) -> PageCheck:
+        return self.fetch(
+            page["source"], etag=page["etag"], last_modified=page["last_modified"]
+        )
+
+    @staticmethod
+    def _classify(page: dict, check: PageCheck) -> str:
+        if check.status == "not_modified":
+            return "unchanged"
+        if check.status != "fetched":
+            return check.status
+        if page["content_hash"] is None:
+            return "baseline"
+        return "unchanged" if check.content_hash == page["content_hash"] else "changed"
+
+    def _refresh_changed(
+        self, changed: list[tuple[dict, PageCheck]], now: float
+    ) -> Counter:
+        """
+        Re-crawl the changed pages and record their new validators once their chunks are updated.
+
+        Pages the crawl did not return keep their previous validators, so they are found changed
+        again on their next check.
+        """
+        chunks = Counter()
+        try:
+            refreshed = self.db_router.refresh_pages_by_urls(
+                [page["source"] for page, _ in changed], self.credentials
+            )
+        except Exception as e:
+            for page, _ in changed:
+                self.store.record(
+                    page["source"], now, status="failed", error=str(e), gone_checks=0
+                )
+            return chunks
+        for page, check in changed:
+            if page["source"] in refreshed:
+                chunks.update(refreshed[page["source"]])
+                self._record(page["source"], now, "changed", check, changed_at=now)
+            else:
+                self.store.record(
+                    page["source"],
+                    now,
+                    status="failed",
+                    error="Page missing from the crawl",
+                    gone_checks=0,
+                )
+        return chunks
+
+    def _record(
+        self, source: str, now: float, outcome: str, check: PageCheck, **fields
+    ) -> None:
+        if outcome == "failed":
+            self.store.record(
+                source, now, status=outcome, error=check.error, gone_checks=0
+            )
+            return
+        # A 304 may omit the validators, which then stay as recorded
+        validators = {
+            key: value
+            for key, value in (
+                ("etag", check.etag),
+                ("last_modified", check.last_modified),
+                ("content_hash", check.content_hash),
+            )
+            if value is not None
+        }
+        self.store.record(
+            source,
+            now,
+            status=outcome,
+            error=None,
+            gone_checks=0,
+            **validators,
+            **fields,
+        )
@@ -1,19 +1,130 @@
+import asyncio
+import atexit
+import queue
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator, Optional
+
+import cohere
+import numpy as np
 import openai
-from langchain.chains.conversational_retrieval.base import ConversationalRetrievalChain
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from langchain_core.retrievers import BaseRetriever
+from langchain.chains.conversational_retrieval.base import (
+    ConversationalRetrievalChain,
+    _get_chat_history,
+)
 from langchain.memory import ConversationBufferWindowMemory
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import CohereRerank
+from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
+from langchain.retrievers.document_compressors import DocumentCompressorPipeline
 from langchain_community.chat_models import ChatOpenAI
 from langchain_community.embeddings import OpenAIEmbeddings
 from langchain_community.vectorstores import DeepLake
 import streamlit as st
 
-from src.consts import ACTIVELOOP_DATASET_NAME
+from src.aio import AsyncRunner
+from src.answer_cache import SemanticAnswerCache
+from src.audio import TranscriptionCache, audio_hash, prepare_audio
+from src.consts import (
+    ACTIVELOOP_DATASET_NAME,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL,
+    AUDIO_COMPRESSION,
+    AUDIO_SAMPLE_RATE,
+    CENTROID_PATH,
+    CHAT_HISTORY_WINDOW,
+    COHERE_REQUESTS_PER_MINUTE,
+    COLLECTION_ROUTE_MARGIN,
+    COLLECTION_ROUTE_MAX,
+    COLLECTIONS,
+    CONTEXT_MAX_TOKENS,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    HYBRID_RETRIEVAL_ENABLED,
+    LEXICAL_INDEX_PATH,
+    LEXICAL_TOP_K,
+    LOCAL_INDEX_DTYPE,
+    LOCAL_INDEX_ENABLED,
+    LOCAL_INDEX_IVF_LISTS,
+    LOCAL_INDEX_IVF_PROBE,
+    LOCAL_INDEX_PATH,
+    OPENAI_REQUESTS_PER_MINUTE,
+    OPENAI_TOKENS_PER_MINUTE,
+    RATE_LIMIT_INTERACTIVE_RESERVE,
+    RATE_LIMIT_MAX_BACKOFF,
+    RATE_LIMIT_MAX_RETRIES,
+    RERANK_LATENCY_BUDGET,
+    RERANKER,
+    RERANKER_ONNX_MODEL_PATH,
+    SESSION_IDLE_TTL,
+    SESSION_POOL_MAX_SESSIONS,
+    SPECULATIVE_RETRIEVAL_THRESHOLD,
+    TRANSCRIPTION_CACHE_MAX_ENTRIES,
+)
+from src.collection_router import (
+    Collection,
+    CollectionCentroid,
+    CollectionRouter,
+    MultiCollectionRetriever,
+    collection_path,
+)
+from src.context import ContextAssembler
+from src.embedding_cache import CachedEmbeddings, EmbeddingCache
+from src.lexical_index import BM25Index, LexicalIndexRetriever
+from src.rate_limit import ProviderLimiter, RateLimitedEmbeddings, RequestScheduler
+from src.local_index import LocalIndexRetriever, LocalVectorIndex
+from src.rerankers import (
+    AsyncCohereRerank,
+    FallbackReranker,
+    LexicalReranker,
+    OnnxCrossEncoderReranker,
+)
+from src.sessions import SessionPool, make_window_memory
+from src.tracing import tracer
+
+
+class _StreamingHandler(BaseCallbackHandler):
+    """
+    Callback handler forwarding the answer tokens to a queue.
+    """
+
+    # Called directly on the event loop, so tokens are queued in the order they arrive
+    run_inline = True
+
+    def __init__(self, events: queue.Queue):
+        self.events = events
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.events.put(("token", token))
+
+
+@dataclass
+class Resources:
+    """
+    Heavy components shared by every session of the process.
+
+    The chat model is built without memory, so it is stateless and safe to share; conversation
+    memories live in the session pool instead.
+    """
+
+    async_runner: AsyncRunner
+    db: DeepLake
+    chat_model: ConversationalRetrievalChain
+    answer_cache: SemanticAnswerCache
+    context_assembler: ContextAssembler
+    sessions: SessionPool
+    collections: dict[str, Collection] = field(default_factory=dict)
+    transcription_cache: TranscriptionCache = field(default_factory=TranscriptionCache)
 
 
 class Generator:
     """
     A class to generate text & audio using OpenAI's models.
+
+    A generator is a lightweight per-session view over the shared process-wide resources, which are
+    loaded once per process unless injected (e.g. fakes in benchmarks and tests).
     """
 
     def __init__(
@@ -22,67 +133,297 @@ class Generator:
         chat_model_name: str = "gpt-3.5-turbo",
         cohere_rerank_model_name: str = "rerank-english-v2.0",
         transcription_model_name: str = "whisper-1",
+        session_id: str = "default",
+        search_collections: Optional[list[str]] = None,
+        chat_history: Optional[list[tuple[str, str]]] = None,
+        resources: Optional[Resources] = None,
     ):
         self.credentials = credentials
 
         self.chat_model_name = chat_model_name
         self.cohere_rerank_model_name = cohere_rerank_model_name
         self.transcription_model_name = transcription_model_name
+        self.session_id = session_id
+        # Collections searched by the session, routed per query when not set
+        self.search_collections = search_collections
+        # Exchanges of the session so far, to rebuild its memory if the pool evicted it
+        self.chat_history = chat_history
 
-        self.db = self._load_embeddings_and_database()
-        self.chat_model, self.memory = self._load_chat_model()
+        self.resources = resources or self._load_resources()
+        self.async_runner = self.resources.async_runner
+        self.db = self.resources.db
+        self.collections = self.resources.collections
+        self.context_assembler = self.resources.context_assembler
+        self.chat_model = self.resources.chat_model
+        self.answer_cache = self.resources.answer_cache
+        self.sessions = self.resources.sessions
+        self.transcription_cache = self.resources.transcription_cache
+
+    @property
+    def memory(self) -> ConversationBufferWindowMemory:
+        """
+        Conversation memory of the generator's session.
+        """
+        return self.sessions.get(self.session_id, self.chat_history)
+
+    def _load_resources(self) -> Resources:
+        # Every loader is cached once per process, and the later ones build on the earlier ones
+        self.async_runner = self._load_async_runner()
+        self.collections = {name: self._load_collection(name) for name in COLLECTIONS}
+        # All collections share the same embeddings
+        self.db = self.collections[COLLECTIONS[0]].db
+        self.context_assembler = self._load_context_assembler()
+        return Resources(
+            async_runner=self.async_runner,
+            db=self.db,
+            chat_model=self._load_chat_model(),
+            answer_cache=self._load_answer_cache(),
+            context_assembler=self.context_assembler,
+            sessions=self._load_session_pool(),
+            collections=self.collections,
+            transcription_cache=self._load_transcription_cache(),
+        )
+
+    @st.cache_resource
+    def _load_request_scheduler(_self) -> RequestScheduler:
+        openai_limiter = ProviderLimiter(
+            "openai",
+            requests_per_minute=OPENAI_REQUESTS_PER_MINUTE,
+            tokens_per_minute=OPENAI_TOKENS_PER_MINUTE,
+            interactive_reserve=RATE_LIMIT_INTERACTIVE_RESERVE,
+            max_retries=RATE_LIMIT_MAX_RETRIES,
+            max_delay=RATE_LIMIT_MAX_BACKOFF,
+        )
+        cohere_limiter = ProviderLimiter(
+            "cohere",
+            requests_per_minute=COHERE_REQUESTS_PER_MINUTE,
+            interactive_reserve=RATE_LIMIT_INTERACTIVE_RESERVE,
+            max_retries=RATE_LIMIT_MAX_RETRIES,
+            max_delay=RATE_LIMIT_MAX_BACKOFF,
+        )
+        return RequestScheduler(
+            {
+                "openai.com": openai_limiter,
+                "cohere.com": cohere_limiter,
+                "cohere.ai": cohere_limiter,
+            }
+        )
 
     @st.cache_resource
-    def _load_embeddings_and_database(_self) -> DeepLake:
+    def _load_async_runner(_self) -> AsyncRunner:
+        # Embeddings, chat, Whisper and Cohere calls share the provider quotas of the process
+        return AsyncRunner(scheduler=_self._load_request_scheduler())
+
+    @st.cache_resource
+    def _load_embeddings(_self) -> CachedEmbeddings:
         try:
-            embeddings = OpenAIEmbeddings(
-                openai_api_key=_self.credentials["openai_api_key"]
+            scheduler = _self._load_request_scheduler()
+            # Retries are left to the request scheduler
+            openai_embeddings = OpenAIEmbeddings(
+                openai_api_key=_self.credentials["openai_api_key"],
+                async_client=_self._async_openai().embeddings,
+                http_client=scheduler.sync_client(),
+                max_retries=0,
+            )
+            return CachedEmbeddings(
+                RateLimitedEmbeddings(
+                    openai_embeddings, scheduler.for_host("api.openai.com")
+                ),
+                EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES),
+                model_name=openai_embeddings.model,
             )
+        except Exception as e:
+            raise Exception(f"Error loading embeddings: {str(e)}")
+
+    @st.cache_resource
+    def _load_collection(_self, name: str) -> Collection:
+        try:
             ACTIVELOOP_ORG_ID = _self.credentials["activeloop_org_id"]
+            dataset_name = collection_path(ACTIVELOOP_DATASET_NAME, name)
             db = DeepLake(
-                dataset_path=f"hub://{ACTIVELOOP_ORG_ID}/{ACTIVELOOP_DATASET_NAME}",
-                embedding_function=embeddings,
+                dataset_path=f"hub://{ACTIVELOOP_ORG_ID}/{dataset_name}",
+                embedding_function=_self._load_embeddings(),
                 token=_self.credentials["activeloop_token"],
             )
-            return db
+            ds = db.vectorstore.dataset
+            centroid = CollectionCentroid(ds, collection_path(CENTROID_PATH, name))
+            # A centroid left behind by a process that stopped before saving it is rebuilt
+            if not centroid.load():
+                centroid.rebuild()
+            return Collection(
+                name=name,
+                db=db,
+                centroid=centroid,
+                local_index=(
+                    _self._load_local_index(name, ds) if LOCAL_INDEX_ENABLED else None
+                ),
+                lexical_index=(
+                    _self._load_lexical_index(name, ds)
+                    if HYBRID_RETRIEVAL_ENABLED
+                    else None
+                ),
+            )
+        except Exception as e:
+            raise Exception(f"Error loading collection {name}: {str(e)}")
+
+    def _load_local_index(self, name: str, ds) -> LocalVectorIndex:
+        try:
+            local_index = LocalVectorIndex(
+                collection_path(LOCAL_INDEX_PATH, name),
+                dtype=LOCAL_INDEX_DTYPE,
+                n_probe=LOCAL_INDEX_IVF_PROBE,
+            )
+            # A mirror left behind by a process that stopped before flushing is rebuilt
+            if not local_index.load() or len(local_index) != len(ds):
+                local_index.sync_from_dataset(ds)
+            if LOCAL_INDEX_IVF_LISTS and not local_index.has_ivf:
+                local_index.build_ivf(LOCAL_INDEX_IVF_LISTS)
+            # Also flushed at exit, for an ingestion interrupted by the process shutting down
+            atexit.register(local_index.flush)
+            return local_index
         except Exception as e:
-            raise Exception(f"Error loading embeddings and database: {str(e)}")
+            raise Exception(f"Error loading local vector index: {str(e)}")
+
+    def _load_lexical_index(self, name: str, ds) -> BM25Index:
+        try:
+            lexical_index = BM25Index(collection_path(LEXICAL_INDEX_PATH, name))
+            # An index left behind by a process that stopped before flushing is rebuilt
+            if not lexical_index.load() or len(lexical_index) != len(ds):
+                lexical_index.rebuild(ds)
+            # Also flushed at exit, for an ingestion interrupted by the process shutting down
+            atexit.register(lexical_index.flush)
+            return lexical_index
+        except Exception as e:
+            raise Exception(f"Error loading lexical index: {str(e)}")
+
+    @st.cache_resource
+    def _load_context_assembler(_self) -> ContextAssembler:
+        return ContextAssembler(
+            max_tokens=CONTEXT_MAX_TOKENS, model_name=_self.chat_model_name
+        )
 
     @st.cache_resource
-    def _load_chat_model(
-        _self, top_n: int = 3, k_history: int = 3
-    ) -> tuple[ConversationalRetrievalChain, ConversationBufferWindowMemory]:
+    def _load_chat_model(_self, top_n: int = 3) -> ConversationalRetrievalChain:
         try:
-            retriever = _self.db.as_retriever()
-            compressor = CohereRerank(
-                model=_self.cohere_rerank_model_name,
-                top_n=top_n,
-                cohere_api_key=_self.credentials["cohere_api_key"],
+            # Collections are searched in parallel and their results merged before reranking
+            retriever = MultiCollectionRetriever(
+                retrievers={
+                    name: _self._build_retriever(collection)
+                    for name, collection in _self.collections.items()
+                },
+                router=CollectionRouter(
+                    {
+                        name: collection.centroid
+                        for name, collection in _self.collections.items()
+                    },
+                    max_collections=COLLECTION_ROUTE_MAX,
+                    margin=COLLECTION_ROUTE_MARGIN,
+                ),
+                embeddings=_self.db.embeddings,
+            )
+            compressor = DocumentCompressorPipeline(
+                transformers=[_self._load_reranker(top_n), _self.context_assembler]
             )
             compression_retriever = ContextualCompressionRetriever(
                 base_compressor=compressor, base_retriever=retriever
             )
-            memory = ConversationBufferWindowMemory(
-                k=k_history,
-                memory_key="chat_history",
-                return_messages=True,
-                output_key="answer",
-            )
             chat_model = ConversationalRetrievalChain.from_llm(
                 llm=ChatOpenAI(
                     model_name=_self.chat_model_name,
                     openai_api_key=_self.credentials["openai_api_key"],
+                    async_client=_self._async_openai().chat.completions,
+                    streaming=True,
+                    max_retries=0,
+                ),
+                # Kept non-streaming, so only answer tokens reach the streaming handler
+                condense_question_llm=ChatOpenAI(
+                    model_name=_self.chat_model_name,
+                    openai_api_key=_self.credentials["openai_api_key"],
+                    async_client=_self._async_openai().chat.completions,
+                    max_retries=0,
                 ),
                 retriever=compression_retriever,
-                memory=memory,
                 verbose=True,
                 chain_type="stuff",
                 return_source_documents=True,
             )
-            return chat_model, memory
+            return chat_model
         except Exception as e:
             raise Exception(f"Error loading chat model: {str(e)}")
 
+    def _build_retriever(self, collection: Collection) -> BaseRetriever:
+        if collection.local_index is not None:
+            retriever = LocalIndexRetriever(
+                index=collection.local_index, embeddings=collection.db.embeddings
+            )
+        else:
+            retriever = collection.db.as_retriever()
+        if collection.lexical_index is None:
+            return retriever
+        # Reciprocal rank fusion of the dense and BM25 results, reranked below
+        return EnsembleRetriever(
+            retrievers=[
+                retriever,
+                LexicalIndexRetriever(index=collection.lexical_index, k=LEXICAL_TOP_K),
+            ],
+            weights=[0.5, 0.5],
+        )
+
+    def _load_reranker(self, top_n: int) -> BaseDocumentCompressor:
+        if RERANKER == "lexical":
+            return LexicalReranker(top_n=top_n)
+        if RERANKER == "onnx":
+            return OnnxCrossEncoderReranker(
+                model_path=RERANKER_ONNX_MODEL_PATH, top_n=top_n
+            )
+        if RERANKER != "cohere":
+            raise ValueError(f"Unknown reranker: {RERANKER}")
+
+        reranker = AsyncCohereRerank(
+            model=self.cohere_rerank_model_name,
+            top_n=top_n,
+            cohere_api_key=self.credentials["cohere_api_key"],
+            async_client=cohere.AsyncClient(
+                self.credentials["cohere_api_key"],
+                httpx_client=self.async_runner.http_client,
+            ),
+        )
+        if not RERANK_LATENCY_BUDGET:
+            return reranker
+        return FallbackReranker(
+            primary=reranker,
+            fallback=LexicalReranker(top_n=top_n),
+            latency_budget=RERANK_LATENCY_BUDGET,
+        )
+
+    def _async_openai(self) -> openai.AsyncOpenAI:
+        return openai.AsyncOpenAI(
+            api_key=self.credentials["openai_api_key"],
+            http_client=self.async_runner.http_client,
+            # Retries are left to the request scheduler behind the HTTP client
+            max_retries=0,
+        )
+
+    @st.cache_resource
+    def _load_session_pool(_self) -> SessionPool:
+        return SessionPool(
+            lambda: make_window_memory(CHAT_HISTORY_WINDOW),
+            max_sessions=SESSION_POOL_MAX_SESSIONS,
+            idle_ttl=SESSION_IDLE_TTL,
+        )
+
+    @st.cache_resource
+    def _load_transcription_cache(_self) -> TranscriptionCache:
+        return TranscriptionCache(TRANSCRIPTION_CACHE_MAX_ENTRIES)
+
+    @st.cache_resource
+    def _load_answer_cache(_self) -> SemanticAnswerCache:
+        return SemanticAnswerCache(
+            threshold=ANSWER_CACHE_THRESHOLD,
+            ttl=ANSWER_CACHE_TTL,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        )
+
     def search_db(self, user_input: str) -> dict[str, any]:
         """
         Invoke the chat model to search the database using retrieval-based QA model.
@@ -94,31 +435,311 @@ class Generator:
             The response from the chat model.
         """
         try:
-            return self.chat_model(
+            return self.async_runner.run(self.asearch_db(user_input))
+        except Exception as e:
+            raise Exception(f"Error searching database: {str(e)}")
+
+    def stream_search_db(self, user_input: str) -> Iterator[tuple[str, Any]]:
+        """
+        Invoke the chat model like `search_db`, but yield the answer as it is generated.
+
+        Args:
+            user_input: The user's input to search the database with.
+
+        Yields:
+            ("sources", documents) once retrieval and reranking finish, then ("token", text) for
+            every answer token, and finally ("answer", response) with the full chat model response.
+        """
+        events = queue.Queue()
+
+        def on_done(future):
+            if future.exception() is not None:
+                events.put(("error", future.exception()))
+                return
+            response = future.result()
+            if response["cached"]:
+                events.put(("token", response["answer"]))
+            events.put(("answer", response))
+
+        self.async_runner.submit(
+            self.asearch_db(
+                user_input,
+                callbacks=[_StreamingHandler(events)],
+                on_sources=lambda docs: events.put(("sources", docs)),
+            )
+        ).add_done_callback(on_done)
+
+        while True:
+            kind, payload = events.get()
+            if kind == "error":
+                raise Exception(f"Error searching database: {str(payload)}")
+            yield kind, payload
+            if kind == "answer":
+                return
+
+    async def asearch_db(
+        self,
+        user_input: str,
+        callbacks: Optional[list[BaseCallbackHandler]] = None,
+        on_sources: Optional[Callable[[list[Document]], None]] = None,
+    ) -> dict[str, Any]:
+        """
+        Search the database asynchronously, answering from the semantic answer cache when possible.
+
+        Without chat history the question is used as is and condensation is skipped. Otherwise,
+        documents are retrieved speculatively for the raw question while the question is being
+        condensed, and kept when the condensed question is close enough to the raw one. Reranking
+        waits for the answer cache lookup, and the speculative retrieval is cancelled on a hit.
+
+        Args:
+            user_input: The user's input to search the database with.
+            callbacks: Optional callback handlers for the chain runs.
+            on_sources: Optional callback receiving the source documents once retrieval finishes.
+
+        Returns:
+            The response, with the answer, the source documents and whether it was cached.
+        """
+        config = {"callbacks": callbacks}
+        with tracer.trace("search", session=self.session_id) as trace:
+            # Requests all run on the async runner loop, so memories are never accessed in parallel
+            memory = self.memory
+            chat_history = memory.load_memory_variables({})["chat_history"]
+
+            documents = None
+            if chat_history:
+                speculative = asyncio.ensure_future(self._aretrieve(user_input))
+                try:
+                    question = await self._acondense_question(
+                        user_input, chat_history, config
+                    )
+                    embedding = await self._aembed_question(question)
+                    cached = self._lookup_answer(embedding)
+                    if cached is None:
+                        (
+                            raw_embedding,
+                            speculative_collections,
+                            speculative_documents,
+                        ) = await speculative
+                        if (
+                            self._cosine_similarity(embedding, raw_embedding)
+                            >= SPECULATIVE_RETRIEVAL_THRESHOLD
+                        ):
+                            collections = speculative_collections
+                            documents = speculative_documents
+                finally:
+                    speculative.cancel()
+            else:
+                question = user_input
+                embedding = await self._aembed_question(question)
+                cached = self._lookup_answer(embedding)
+
+            if cached:
+                answer, source_documents = cached["answer"], cached["source_documents"]
+                if on_sources:
+                    on_sources(source_documents)
+            else:
+                if documents is None:
+                    _, collections, documents = await self._aretrieve(question)
+                source_documents = await self._arerank(question, documents)
+                if on_sources:
+                    on_sources(source_documents)
+                with tracer.span("search.generate") as span:
+                    response = await self.chat_model.combine_docs_chain.ainvoke(
+                        {"input_documents": source_documents, "question": question},
+                        config,
+                    )
+                    answer = response["output_text"]
+                    span.set(
+                        items=len(source_documents),
+                        context_tokens=sum(
+                            self.context_assembler.count_tokens(doc.page_content)
+                            for doc in source_documents
+                        ),
+                        completion_tokens=self.context_assembler.count_tokens(answer),
+                    )
+                self.answer_cache.store(
+                    embedding, answer, source_documents, collections
+                )
+
+            memory.save_context({"question": user_input}, {"answer": answer})
+            trace.set(cached=cached is not None, condensed=bool(chat_history))
+        return {
+            "question": user_input,
+            "generated_question": question,
+            "answer": answer,
+            "source_documents": source_documents,
+            "cached": cached is not None,
+        }
+
+    def _search_scope(self, embedding: list[float]) -> list[str]:
+        """
+        Collections a question is searched in: the selected ones, or those it is routed to.
+
+        Args:
+            embedding: Embedding of the question.
+
+        Returns:
+            Names of the collections, closest first when routed.
+        """
+        retriever = self.chat_model.retriever.base_retriever
+        if isinstance(retriever, MultiCollectionRetriever):
+            return retriever.resolve(embedding, self.search_collections)
+        return []
+
+    def _lookup_answer(self, embedding: list[float]) -> Optional[dict[str, Any]]:
+        """
+        Look up the answer to a standalone question in the answer cache.
+
+        Args:
+            embedding: Embedding of the standalone question.
+
+        Returns:
+            The cached answer and source documents, or None on a miss.
+        """
+        with tracer.span("search.cache_lookup") as span:
+            # Answers are only reused for questions searched in the same collections
+            cached = self.answer_cache.lookup(
+                embedding, frozenset(self._search_scope(embedding))
+            )
+            span.set(hit=cached is not None)
+        return cached
+
+    async def _aretrieve(
+        self, question: str
+    ) -> tuple[list[float], frozenset[str], list[Document]]:
+        """
+        Retrieve the documents relevant to a question.
+
+        Args:
+            question: The question to retrieve documents for.
+
+        Returns:
+            The question's embedding, the searched collections and the retrieved documents.
+        """
+        # Embedding through the pooled async client fills the query cache the retriever reads from
+        embedding = await self._aembed_question(question)
+        names = self._search_scope(embedding)
+        retriever = self.chat_model.retriever
+        with tracer.span("search.retrieve") as span:
+            if isinstance(retriever.base_retriever, MultiCollectionRetriever):
+                documents = await retriever.base_retriever.aretrieve(
+                    question, embedding, names
+                )
+            else:
+                documents = await retriever.base_retriever.ainvoke(question)
+            span.set(
+                items=len(documents),
+                collections=sorted(
+                    {str(doc.metadata.get("collection")) for doc in documents}
+                ),
+            )
+        return embedding, frozenset(names), list(documents)
+
+    async def _arerank(
+        self, question: str, documents: list[Document]
+    ) -> list[Document]:
+        """
+        Rerank retrieved documents and assemble them into the context of a question.
+
+        Args:
+            question: The question the documents were retrieved for.
+            documents: The retrieved documents.
+
+        Returns:
+            The reranked documents that fit in the context.
+        """
+        # The compressor pipeline is run stage by stage, so each stage gets its own span
+        for transformer in self.chat_model.retriever.base_compressor.transformers:
+            stage = (
+                "assemble" if isinstance(transformer, ContextAssembler) else "rerank"
+            )
+            with tracer.span(f"search.{stage}", items_in=len(documents)) as span:
+                if isinstance(transformer, BaseDocumentCompressor):
+                    documents = await transformer.acompress_documents(
+                        documents, question
+                    )
+                else:
+                    documents = await transformer.atransform_documents(documents)
+                span.set(items=len(documents))
+        return list(documents)
+
+    async def _aembed_question(self, question: str) -> list[float]:
+        with tracer.span("search.embed", items=1) as span:
+            embedding = await self.db.embeddings.aembed_query(question)
+            span.set(tokens=self.context_assembler.count_tokens(question))
+        return embedding
+
+    async def _acondense_question(
+        self, user_input: str, chat_history: list, config: dict
+    ) -> str:
+        """
+        Rephrase the user's input as a standalone question using the chat history.
+
+        Args:
+            user_input: The user's input.
+            chat_history: Messages of the conversation so far.
+            config: Runnable config for the condensation run.
+
+        Returns:
+            The standalone question.
+        """
+        get_chat_history = self.chat_model.get_chat_history or _get_chat_history
+        with tracer.span("search.condense", items=len(chat_history)) as span:
+            response = await self.chat_model.question_generator.ainvoke(
                 {
                     "question": user_input,
-                    "chat_history": self.memory.load_memory_variables({}),
-                }
+                    "chat_history": get_chat_history(chat_history),
+                },
+                config,
             )
-        except Exception as e:
-            raise Exception(f"Error searching database: {str(e)}")
+            span.set(tokens=self.context_assembler.count_tokens(response["text"]))
+        return response["text"]
+
+    @staticmethod
+    def _cosine_similarity(a: list[float], b: list[float]) -> float:
+        a, b = np.asarray(a), np.asarray(b)
+        return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) or 1.0))
 
-    def transcribe_audio(self, audio_file_path: str) -> str:
+    def transcribe_audio(self, audio_bytes: bytes) -> str:
         """
-        Transcribe the audio file using the Whisper API.
+        Transcribe a recording using the Whisper API.
+
+        The recording stays in memory: it is downmixed, resampled and compressed before upload, and
+        transcriptions are cached by audio hash so reruns with the same recording are free.
 
         Args:
-            audio_file_path: The path to the audio file to transcribe.
+            audio_bytes: The WAV recording to transcribe.
 
         Returns:
-            The transcription of the audio file.
+            The transcription of the recording.
         """
         try:
-            with open(audio_file_path, "rb") as audio_file:
-                response = openai.audio.transcriptions.create(
-                    model=self.transcription_model_name,
-                    file=audio_file,
-                )
-            return response.text
+            with tracer.trace(
+                "transcribe", session=self.session_id, input_bytes=len(audio_bytes)
+            ) as trace:
+                key = audio_hash(audio_bytes)
+                transcription = self.transcription_cache.get(key)
+                trace.set(cached=transcription is not None)
+                if transcription is None:
+                    with tracer.span("transcribe.prepare") as span:
+                        payload, file_name = prepare_audio(
+                            audio_bytes, AUDIO_SAMPLE_RATE, AUDIO_COMPRESSION or None
+                        )
+                        span.set(
+                            input_bytes=len(audio_bytes), output_bytes=len(payload)
+                        )
+                    with tracer.span("transcribe.whisper", items=1) as span:
+                        response = self.async_runner.run(
+                            self._async_openai().audio.transcriptions.create(
+                                model=self.transcription_model_name,
+                                file=(file_name, payload),
+                            )
+                        )
+                        transcription = response.text
+                        span.set(
+                            tokens=self.context_assembler.count_tokens(transcription)
+                        )
+                    self.transcription_cache.put(key, transcription)
+            return transcription
         except Exception as e:
             raise Exception(f"Error calling Whisper API: {str(e)}")
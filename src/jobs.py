@@ -0,0 +1,246 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+JOB_FIELDS = (
+    "id",
+    "url",
+    "status",
+    "pages_crawled",
+    "chunks_embedded",
+    "chunks_written",
+    "error",
+    "created_at",
+    "updated_at",
+)
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a running job once its cancellation has been requested.
+    """
+
+
+class Job:
+    """
+    Handle given to a running ingestion job to report progress and check for cancellation.
+    """
+
+    def __init__(self, queue: "JobQueue", job_id: int, url: str):
+        self.queue = queue
+        self.id = job_id
+        self.url = url
+        self.cancel_event = threading.Event()
+
+    def advance(self, field: str, count: int = 1) -> None:
+        """
+        Increment one of the progress counters of the job.
+
+        Args:
+            field: One of pages_crawled, chunks_embedded or chunks_written.
+            count: Increment.
+        """
+        self.queue._increment(self.id, field, count)
+
+    def raise_if_cancelled(self) -> None:
+        """
+        Stop the job at a safe point if its cancellation has been requested.
+        """
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+
+class JobQueue:
+    """
+    Background ingestion job scheduler backed by a persistent SQLite job table.
+
+    Several queues can share the table, each seeing and running only the jobs of its owner. Jobs
+    left over by a previous process are recovered once per process and owner, so a queue created
+    later in the same process does not take over the jobs of a running one.
+    """
+
+    _recovered: set[tuple[str, str]] = set()
+    _recovery_lock = threading.Lock()
+
+    def __init__(
+        self,
+        path: str,
+        run_job: Callable[[Job], None],
+        max_workers: int = 2,
+        owner: str = "",
+    ):
+        self.path = path
+        self.run_job = run_job
+        self.owner = owner
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingest-job"
+        )
+        self._active: dict[str, Job] = {}
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, status TEXT NOT NULL, "
+                "pages_crawled INTEGER DEFAULT 0, chunks_embedded INTEGER DEFAULT 0, "
+                "chunks_written INTEGER DEFAULT 0, error TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+                "owner TEXT NOT NULL DEFAULT '')"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+            if "owner" not in columns:
+                self._conn.execute(
+                    "ALTER TABLE jobs ADD COLUMN owner TEXT NOT NULL DEFAULT ''"
+                )
+
+        with self._recovery_lock:
+            key = (os.path.abspath(path), owner)
+            if key not in self._recovered:
+                self._recovered.add(key)
+                self._recover()
+
+    def submit(self, url: str) -> int:
+        """
+        Queue an ingestion job for a URL, reusing the in-flight job if the URL is already being ingested.
+
+        Args:
+            url: URL of the document to add, or URLs of the documents to add one per line.
+
+        Returns:
+            ID of the queued (or already in-flight) job.
+        """
+        with self._lock:
+            if url in self._active:
+                return self._active[url].id
+            now = time.time()
+            with self._conn:
+                job_id = self._conn.execute(
+                    "INSERT INTO jobs (url, status, created_at, updated_at, owner) "
+                    "VALUES (?, 'queued', ?, ?, ?)",
+                    (url, now, now, self.owner),
+                ).lastrowid
+            # Registered with the insert, so a concurrent submit of the URL reuses the job
+            job = self._active[url] = Job(self, job_id, url)
+        self._executor.submit(self._run, job)
+        return job_id
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Request the cancellation of a queued or running job.
+
+        Args:
+            job_id: ID of the job to cancel.
+
+        Returns:
+            True if the job was in flight, False otherwise.
+        """
+        with self._lock:
+            for job in self._active.values():
+                if job.id == job_id:
+                    job.cancel_event.set()
+                    return True
+        return False
+
+    def get(self, job_id: int) -> Optional[dict]:
+        """
+        Get the status and progress of a job.
+
+        Args:
+            job_id: ID of the job.
+
+        Returns:
+            The job record, or None if it does not exist.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ? AND owner = ?",
+                (job_id, self.owner),
+            ).fetchone()
+        return dict(zip(JOB_FIELDS, row)) if row else None
+
+    def list_jobs(self, limit: int = 20) -> list[dict]:
+        """
+        List the most recent jobs of the owner.
+
+        Args:
+            limit: Maximum number of jobs to return.
+
+        Returns:
+            Job records, newest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE owner = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (self.owner, limit),
+            ).fetchall()
+        return [dict(zip(JOB_FIELDS, row)) for row in rows]
+
+    def _recover(self) -> None:
+        """
+        Fail the jobs of the owner that were running when the previous process stopped, and
+        schedule its queued ones again.
+        """
+        duplicates, scheduled = [], []
+        with self._lock, self._conn:
+            # Jobs running when the previous process stopped cannot be resumed safely
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Interrupted by restart', "
+                "updated_at = ? WHERE status = 'running' AND owner = ?",
+                (time.time(), self.owner),
+            )
+            queued = self._conn.execute(
+                "SELECT id, url FROM jobs WHERE status = 'queued' AND owner = ? ORDER BY id",
+                (self.owner,),
+            ).fetchall()
+            for job_id, url in queued:
+                if url in self._active:
+                    duplicates.append(job_id)
+                    continue
+                job = self._active[url] = Job(self, job_id, url)
+                scheduled.append(job)
+        for job_id in duplicates:
+            self._set_status(job_id, "cancelled", "Duplicate of an in-flight job")
+        for job in scheduled:
+            self._executor.submit(self._run, job)
+
+    def _run(self, job: Job) -> None:
+        try:
+            job.raise_if_cancelled()
+            self._set_status(job.id, "running")
+            self.run_job(job)
+            self._set_status(job.id, "succeeded")
+        except JobCancelled:
+            self._set_status(job.id, "cancelled")
+        except Exception as e:
+            logging.exception(f"Ingestion job {job.id} for {job.url} failed")
+            self._set_status(job.id, "failed", str(e))
+        finally:
+            with self._lock:
+                self._active.pop(job.url, None)
+
+    def _set_status(
+        self, job_id: int, status: str, error: Optional[str] = None
+    ) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def _increment(self, job_id: int, field: str, count: int) -> None:
+        if field not in ("pages_crawled", "chunks_embedded", "chunks_written"):
+            raise ValueError(f"Unknown job progress field: {field}")
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {field} = {field} + ?, updated_at = ? WHERE id = ?",
+                (count, time.time(), job_id),
+            )
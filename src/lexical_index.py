@@ -0,0 +1,411 @@
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+from array import array
+from collections import Counter
+from typing import Iterator, Optional
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.retrievers import BaseRetriever
+
+from src.listeners import DocumentListener
+
+# Keeps product names, error codes and part numbers such as "ERR-404" or "v2.1" in one token
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split a text into lowercase lexical tokens.
+
+    Args:
+        text: Text to tokenize.
+
+    Returns:
+        The tokens, in order.
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index(DocumentListener):
+    """
+    In-memory BM25 inverted index over the chunk texts, kept in sync through the DBRouter hooks.
+
+    Postings are stored per term as two typed arrays (rows and term frequencies) rather than lists of
+    Python objects, and are scored with vectorized NumPy views over them. Deleted rows are masked and
+    the postings are compacted once enough of them accumulate.
+
+    With a path, the index is persisted there, so it is loaded instead of scanning the dataset. The
+    postings are saved with their rows after a rebuild or a compaction. Flushing, on every
+    `flush_every` added rows and once an ingestion completes, appends the new rows to the rows file;
+    their postings are rebuilt from the text on load, and only saved again once the tail is large
+    enough (at least `flush_every` rows and `compact_ratio` of the saved postings).
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        k1: float = 1.5,
+        b: float = 0.75,
+        compact_ratio: float = 0.25,
+        flush_every: int = 4096,
+    ):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self.flush_every = flush_every
+
+        self._lock = threading.RLock()
+        self._reset()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._row_of)
+
+    def load(self) -> bool:
+        """
+        Load the index persisted at the path.
+
+        Returns:
+            True if a complete index was found on disk, False otherwise.
+        """
+        if self.path is None:
+            return False
+        postings_path = os.path.join(self.path, "postings.npz")
+        rows_path = os.path.join(self.path, "rows.jsonl")
+        if not os.path.exists(postings_path) or not os.path.exists(rows_path):
+            return False
+
+        with np.load(postings_path) as stored:
+            terms = json.loads(str(stored["terms"]))
+            offsets, rows, tfs = stored["offsets"], stored["rows"], stored["tfs"]
+            doc_lengths = stored["doc_lengths"]
+            deleted = stored["deleted"]
+        records, size = [], 0
+        with open(rows_path, "rb") as f:
+            for line in f:
+                # The last line of an interrupted append is dropped
+                if not line.endswith(b"\n"):
+                    break
+                records.append(json.loads(line))
+                size += len(line)
+        if len(records) < len(doc_lengths) or len(deleted) != len(doc_lengths):
+            return False
+        tombstones_path = os.path.join(self.path, "deleted.npy")
+        tombstones = (
+            np.load(tombstones_path)
+            if os.path.exists(tombstones_path)
+            else np.zeros(0, dtype=bool)
+        )
+
+        with self._lock:
+            os.truncate(rows_path, size)
+            self._reset()
+            for i, term in enumerate(terms):
+                start, end = offsets[i], offsets[i + 1]
+                self._postings[term] = (
+                    array("I", rows[start:end].astype(np.uint32).tobytes()),
+                    array("H", tfs[start:end].astype(np.uint16).tobytes()),
+                )
+            deleted = deleted.astype(bool)
+            indexed = tombstones[: len(deleted)]
+            deleted[: len(indexed)] |= indexed
+            for row, record in enumerate(records[: len(doc_lengths)]):
+                self._ids.append(record["id"])
+                self._texts.append(record["text"])
+                self._metadata.append(record["metadata"])
+                if not deleted[row]:
+                    self._row_of[record["id"]] = row
+            self._doc_lengths = array("I", doc_lengths.astype(np.uint32).tobytes())
+            self._deleted = bytearray(deleted.astype(np.uint8).tobytes())
+            self._total_length = int(doc_lengths[~deleted].sum())
+            self._n_deleted = int(deleted.sum())
+
+            # Rows appended since the postings were saved are indexed again from their text
+            tail = records[len(doc_lengths) :]
+            self._add(
+                [record["id"] for record in tail],
+                [record["text"] for record in tail],
+                [record["metadata"] for record in tail],
+            )
+            for row in np.flatnonzero(tombstones[len(doc_lengths) : len(records)]):
+                self._delete_row(len(doc_lengths) + int(row))
+            self._indexed_rows = len(doc_lengths)
+            self._saved_rows = len(records)
+        return True
+
+    def save(self) -> None:
+        """
+        Persist the postings and rows of the index at the path, if it has one.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            # The new files are written next to the old ones and swapped in, so a crash never
+            # leaves a mix of both
+            staging_path = self.path + ".tmp"
+            shutil.rmtree(staging_path, ignore_errors=True)
+            os.makedirs(staging_path)
+            terms = list(self._postings)
+            lengths = [len(self._postings[term][0]) for term in terms]
+            offsets = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+            np.savez(
+                os.path.join(staging_path, "postings.npz"),
+                terms=np.array(json.dumps(terms)),
+                offsets=offsets,
+                rows=np.concatenate(
+                    [
+                        np.frombuffer(self._postings[t][0], dtype=np.uint32)
+                        for t in terms
+                    ]
+                    or [np.zeros(0, dtype=np.uint32)]
+                ),
+                tfs=np.concatenate(
+                    [
+                        np.frombuffer(self._postings[t][1], dtype=np.uint16)
+                        for t in terms
+                    ]
+                    or [np.zeros(0, dtype=np.uint16)]
+                ),
+                doc_lengths=np.frombuffer(self._doc_lengths, dtype=np.uint32),
+                deleted=np.frombuffer(self._deleted, dtype=np.bool_),
+            )
+            with open(
+                os.path.join(staging_path, "rows.jsonl"), "w", encoding="utf-8"
+            ) as f:
+                f.writelines(self._row_lines(0))
+            old_path = self.path + ".old"
+            shutil.rmtree(old_path, ignore_errors=True)
+            if os.path.exists(self.path):
+                os.replace(self.path, old_path)
+            os.replace(staging_path, self.path)
+            shutil.rmtree(old_path, ignore_errors=True)
+            self._indexed_rows = self._saved_rows = len(self._ids)
+
+    def flush(self) -> None:
+        """
+        Append the rows added since the last flush to the rows file at the path, if it has one.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            if len(self._ids) == self._saved_rows:
+                return
+            tail = len(self._ids) - (self._indexed_rows or 0)
+            if self._indexed_rows is None or tail >= max(
+                self.flush_every, self.compact_ratio * self._indexed_rows
+            ):
+                self.save()
+                return
+            start = self._saved_rows
+            with open(
+                os.path.join(self.path, "rows.jsonl"), "a", encoding="utf-8"
+            ) as f:
+                f.writelines(self._row_lines(start))
+            self._saved_rows = len(self._ids)
+            if any(self._deleted[start:]):
+                self._save_tombstones()
+
+    def rebuild(self, ds) -> None:
+        """
+        Rebuild the index from a full scan of the dataset.
+
+        Args:
+            ds: DeepLake dataset to index.
+        """
+        logging.info("Building lexical index from a full dataset scan")
+
+        with self._lock:
+            self._reset()
+            if len(ds):
+                self._add(
+                    ds.id.data(aslist=True)["value"],
+                    ds.text.data(aslist=True)["value"],
+                    ds.metadata.data()["value"],
+                )
+            self.save()
+
+    def search(self, query: str, k: int = 4) -> list[tuple[Document, float]]:
+        """
+        Find the chunks best matching a query by BM25 score.
+
+        Args:
+            query: Query text.
+            k: Number of results.
+
+        Returns:
+            List of (chunk, score) pairs, best match first.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._row_of)
+            if not n_docs or not terms:
+                return []
+
+            doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.uint32)
+            deleted = np.frombuffer(self._deleted, dtype=np.bool_)
+            avg_length = self._total_length / n_docs
+
+            rows, contributions = [], []
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                term_rows = np.frombuffer(postings[0], dtype=np.uint32)
+                tfs = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+                live = ~deleted[term_rows]
+                term_rows, tfs = term_rows[live], tfs[live]
+                if not len(term_rows):
+                    continue
+
+                idf = math.log(
+                    1 + (n_docs - len(term_rows) + 0.5) / (len(term_rows) + 0.5)
+                )
+                norm = self.k1 * (
+                    1 - self.b + self.b * doc_lengths[term_rows] / avg_length
+                )
+                rows.append(term_rows)
+                contributions.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+            if not rows:
+                return []
+
+            unique_rows, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(contributions))
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                (
+                    Document(
+                        page_content=self._texts[unique_rows[i]],
+                        metadata=self._metadata[unique_rows[i]],
+                    ),
+                    float(scores[i]),
+                )
+                for i in top
+            ]
+
+    def on_documents_added(
+        self, docs: list[Document], ids: list[str], embeddings: list[list[float]]
+    ) -> None:
+        with self._lock:
+            self._add(
+                ids,
+                [doc.page_content for doc in docs],
+                [doc.metadata for doc in docs],
+            )
+            if len(self._ids) - self._saved_rows >= self.flush_every:
+                self.flush()
+
+    def on_documents_deleted(self, ids_by_source: dict[str, list[str]]) -> None:
+        with self._lock:
+            deleted = 0
+            for source_ids in ids_by_source.values():
+                for doc_id in source_ids:
+                    row = self._row_of.get(doc_id)
+                    if row is not None:
+                        self._delete_row(row)
+                        deleted += 1
+            if not deleted:
+                return
+            if self._n_deleted > self.compact_ratio * len(self._ids):
+                self._compact()
+                self.save()
+            elif self.path is not None and self._saved_rows:
+                self._save_tombstones()
+
+    def _reset(self) -> None:
+        self._postings: dict[str, tuple[array, array]] = {}
+        self._ids: list[str] = []
+        self._texts: list[str] = []
+        self._metadata: list[dict] = []
+        self._doc_lengths = array("I")
+        self._deleted = bytearray()
+        self._row_of: dict[str, int] = {}
+        self._total_length = 0
+        self._n_deleted = 0
+        # Rows in the rows file, and the first of them covered by the saved postings
+        self._saved_rows = 0
+        self._indexed_rows: Optional[int] = None
+
+    def _delete_row(self, row: int) -> None:
+        del self._row_of[self._ids[row]]
+        self._deleted[row] = 1
+        self._total_length -= self._doc_lengths[row]
+        self._n_deleted += 1
+
+    def _save_tombstones(self) -> None:
+        # Only the tombstones of the rows on disk are persisted
+        tombstones_path = os.path.join(self.path, "deleted.npy")
+        np.save(
+            tombstones_path + ".tmp.npy",
+            np.frombuffer(self._deleted, dtype=np.bool_)[: self._saved_rows],
+        )
+        os.replace(tombstones_path + ".tmp.npy", tombstones_path)
+
+    def _row_lines(self, start: int) -> Iterator[str]:
+        for doc_id, text, metadata in zip(
+            self._ids[start:], self._texts[start:], self._metadata[start:]
+        ):
+            yield json.dumps({"id": doc_id, "text": text, "metadata": metadata}) + "\n"
+
+    def _add(self, ids: list[str], texts: list[str], metadata: list[dict]) -> None:
+        for doc_id, text, doc_metadata in zip(ids, texts, metadata):
+            row = len(self._ids)
+            tokens = tokenize(text)
+            for term, tf in Counter(tokens).items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array("I"), array("H"))
+                postings[0].append(row)
+                postings[1].append(min(tf, 0xFFFF))
+
+            self._row_of[doc_id] = row
+            self._ids.append(doc_id)
+            self._texts.append(text)
+            self._metadata.append(doc_metadata)
+            self._doc_lengths.append(len(tokens))
+            self._deleted.append(0)
+            self._total_length += len(tokens)
+
+    def _compact(self) -> None:
+        live = [row for row in range(len(self._ids)) if not self._deleted[row]]
+        ids = [self._ids[row] for row in live]
+        texts = [self._texts[row] for row in live]
+        metadata = [self._metadata[row] for row in live]
+        self._reset()
+        self._add(ids, texts, metadata)
+
+
+class LexicalIndexRetriever(BaseRetriever):
+    """
+    LangChain retriever searching the BM25 index.
+    """
+
+    index: BM25Index
+    """BM25 index to search."""
+    k: int = 4
+    """Number of documents to return."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return [doc for doc, _ in self.index.search(query, self.k)]
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return self._get_relevant_documents(query, run_manager=run_manager)
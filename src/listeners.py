@@ -0,0 +1,44 @@
+from langchain.docstore.document import Document
+
+
+class DocumentListener:
+    """
+    Base class for components that mirror or depend on the content of the vector database.
+
+    Listeners registered on the DBRouter are notified after every write and delete, and before
+    every delete for the ones that need the stored data of the deleted chunks. Once an ingestion
+    or a delete completes they are flushed, so the ones that buffer changes can persist them.
+    """
+
+    def on_documents_added(
+        self, docs: list[Document], ids: list[str], embeddings: list[list[float]]
+    ) -> None:
+        """
+        Called after chunks have been written to the vector database.
+
+        Args:
+            docs: Written chunks.
+            ids: Row IDs of the written chunks, aligned with docs.
+            embeddings: Embeddings of the written chunks, aligned with docs.
+        """
+
+    def on_documents_deleting(self, rows: list[int]) -> None:
+        """
+        Called before chunks are deleted from the vector database, with the write lock held.
+
+        Args:
+            rows: Dataset row positions of the chunks about to be deleted.
+        """
+
+    def on_documents_deleted(self, ids_by_source: dict[str, list[str]]) -> None:
+        """
+        Called after chunks have been deleted from the vector database.
+
+        Args:
+            ids_by_source: Row IDs of the deleted chunks, grouped by source.
+        """
+
+    def flush(self) -> None:
+        """
+        Called once an ingestion, a refresh, a snapshot import or a delete has completed.
+        """
@@ -0,0 +1,517 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Any, Optional
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from src.listeners import DocumentListener
+
+
+class LocalVectorIndex(DocumentListener):
+    """
+    In-process mirror of the vector database for similarity search without touching remote storage.
+
+    Normalized embeddings are kept in a memory-mapped float32 (or float16) matrix next to the row IDs,
+    texts and metadata. Search is an exact vectorized top-k, optionally pruned to the closest clusters
+    of an IVF (inverted file) partition for large corpora. The mirror is kept in sync with the dataset
+    through the DBRouter add/delete hooks; deleted rows are tombstoned and only compacted out of the
+    matrix once they exceed `compact_ratio` of it.
+
+    On disk, the matrix is a raw row-major file and the rows a JSON lines file. Added rows are
+    appended to both when the index is flushed, so persisting them costs their own size only; the
+    files are only rewritten in full on compaction.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dtype: str = "float32",
+        n_probe: int = 8,
+        flush_every: int = 4096,
+        compact_ratio: float = 0.25,
+    ):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.n_probe = n_probe
+        self.flush_every = flush_every
+        self.compact_ratio = compact_ratio
+
+        self._lock = threading.RLock()
+        # Serializes the writers of the files, which append outside of the state lock
+        self._flush_lock = threading.RLock()
+        self._matrix = None
+        self._ids: list[str] = []
+        self._texts: list[str] = []
+        self._metadata: list[dict] = []
+        self._deleted = np.zeros(0, dtype=bool)
+        self._row_of: dict[str, int] = {}
+        self._pending: list[np.ndarray] = []
+
+        self._centroids = None
+        self._assignments = None
+        self._list_order = None
+        self._list_offsets = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._ids) - int(self._deleted.sum())
+
+    @property
+    def has_ivf(self) -> bool:
+        """
+        Whether searches are pruned to the closest IVF clusters.
+        """
+        return self._centroids is not None
+
+    def load(self) -> bool:
+        """
+        Load the mirror from disk, memory-mapping the embedding matrix.
+
+        Rows of an append interrupted by a crash are dropped, so the files stay aligned.
+
+        Returns:
+            True if a mirror was found on disk, False otherwise.
+        """
+        meta_path = os.path.join(self.path, "index.json")
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+
+        with self._flush_lock, self._lock:
+            # Rows are appended in the type of the matrix on disk
+            self.dtype = np.dtype(meta["dtype"])
+            ids, texts, metadata, ends = [], [], [], []
+            with open(os.path.join(self.path, "rows.jsonl"), "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    row = json.loads(line)
+                    ids.append(row["id"])
+                    texts.append(row["text"])
+                    metadata.append(row["metadata"])
+                    ends.append((ends[-1] if ends else 0) + len(line))
+
+            dim = meta["dim"]
+            matrix_path = os.path.join(self.path, "embeddings.bin")
+            n_rows = min(
+                len(ids),
+                (
+                    os.path.getsize(matrix_path) // (dim * self.dtype.itemsize)
+                    if dim
+                    else 0
+                ),
+            )
+            centroids_path = os.path.join(self.path, "centroids.npy")
+            assignments_path = os.path.join(self.path, "assignments.bin")
+            has_ivf = os.path.exists(centroids_path)
+            if has_ivf:
+                assignments = np.fromfile(assignments_path, dtype=np.int32)
+                n_rows = min(n_rows, len(assignments))
+            os.truncate(matrix_path, n_rows * dim * self.dtype.itemsize)
+            os.truncate(
+                os.path.join(self.path, "rows.jsonl"), ends[n_rows - 1] if n_rows else 0
+            )
+
+            self._ids, self._texts = ids[:n_rows], texts[:n_rows]
+            self._metadata = metadata[:n_rows]
+            self._matrix = self._map(n_rows, dim)
+            self._deleted = np.zeros(n_rows, dtype=bool)
+            tombstones_path = os.path.join(self.path, "deleted.npy")
+            if os.path.exists(tombstones_path):
+                tombstones = np.load(tombstones_path)[:n_rows]
+                self._deleted[: len(tombstones)] = tombstones
+            self._row_of = {
+                doc_id: row
+                for row, doc_id in enumerate(self._ids)
+                if not self._deleted[row]
+            }
+            self._pending = []
+
+            if has_ivf:
+                os.truncate(assignments_path, n_rows * 4)
+                self._centroids = np.load(centroids_path)
+                self._set_lists(assignments[:n_rows])
+            else:
+                self._centroids = None
+        return True
+
+    def sync_from_dataset(self, ds) -> None:
+        """
+        Rebuild the mirror from a full scan of the dataset and persist it.
+
+        Args:
+            ds: DeepLake dataset to mirror.
+        """
+        logging.info("Building local vector index from a full dataset scan")
+
+        with self._flush_lock, self._lock:
+            if len(ds):
+                embeddings = ds.embedding.numpy()
+                self._ids = ds.id.data(aslist=True)["value"]
+                self._texts = ds.text.data(aslist=True)["value"]
+                self._metadata = ds.metadata.data()["value"]
+            else:
+                embeddings = np.zeros((0, 0), dtype=np.float32)
+                self._ids, self._texts, self._metadata = [], [], []
+            self._matrix = self._normalize(embeddings).astype(self.dtype)
+            self._deleted = np.zeros(len(self._ids), dtype=bool)
+            self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids)}
+            self._pending = []
+            self._centroids = None
+            self.save()
+
+    def build_ivf(self, n_lists: int, iterations: int = 10, sample_size: int = 50_000):
+        """
+        Partition the rows into clusters (k-means) so searches only scan the closest ones.
+
+        Args:
+            n_lists: Number of clusters.
+            iterations: Number of k-means iterations.
+            sample_size: Number of rows the centroids are trained on.
+        """
+        with self._flush_lock, self._lock:
+            self._compact()
+            matrix = self._matrix
+            if len(matrix) < n_lists:
+                return
+
+            rng = np.random.default_rng(0)
+            sample = matrix[
+                rng.choice(len(matrix), min(sample_size, len(matrix)), replace=False)
+            ].astype(np.float32)
+            centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+            for _ in range(iterations):
+                assignments = np.argmax(sample @ centroids.T, axis=1)
+                for i in range(n_lists):
+                    members = sample[assignments == i]
+                    if len(members):
+                        centroids[i] = members.mean(axis=0)
+                centroids = self._normalize(centroids)
+
+            self._centroids = centroids
+            self._set_lists(self._assign(matrix))
+            self.save()
+
+    def search(
+        self, embedding: list[float], k: int = 4
+    ) -> list[tuple[Document, float]]:
+        """
+        Find the chunks most similar to a query embedding.
+
+        Scoring runs outside the lock on the arrays and row lists current when the search started;
+        compaction replaces them instead of changing them, so the rows found still point to the
+        right chunks.
+
+        Args:
+            embedding: Query embedding.
+            k: Number of results.
+
+        Returns:
+            List of (chunk with its row ID in the metadata, cosine similarity) pairs, most similar
+            first.
+        """
+        query = self._normalize(np.asarray(embedding, dtype=np.float32))
+        with self._lock:
+            matrix, deleted = self._matrix, self._deleted
+            ids, texts, metadata = self._ids, self._texts, self._metadata
+            base_rows = 0 if matrix is None else len(matrix)
+            pending = np.stack(self._pending) if self._pending else None
+            candidates = self._probe(query) if self._centroids is not None else None
+
+        rows, scores = [], []
+        if base_rows:
+            if candidates is None:
+                base_scores = self._scores(matrix, query)
+                base_index = np.arange(base_rows)
+            else:
+                base_scores = self._scores(matrix[candidates], query)
+                base_index = candidates
+            base_scores[deleted[base_index]] = -np.inf
+            rows.append(base_index)
+            scores.append(base_scores)
+        if pending is not None:
+            pending_scores = pending.astype(np.float32) @ query
+            pending_index = np.arange(base_rows, base_rows + len(pending))
+            pending_scores[deleted[pending_index]] = -np.inf
+            rows.append(pending_index)
+            scores.append(pending_scores)
+        if not rows:
+            return []
+
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (
+                Document(
+                    page_content=texts[rows[i]],
+                    metadata={**metadata[rows[i]], "id": ids[rows[i]]},
+                ),
+                float(scores[i]),
+            )
+            for i in top
+            if scores[i] > -np.inf
+        ]
+
+    def on_documents_added(
+        self, docs: list[Document], ids: list[str], embeddings: list[list[float]]
+    ) -> None:
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            for doc, doc_id, vector in zip(docs, ids, vectors):
+                self._row_of[doc_id] = len(self._ids)
+                self._ids.append(doc_id)
+                self._texts.append(doc.page_content)
+                self._metadata.append(doc.metadata)
+                self._pending.append(vector.astype(self.dtype))
+            self._deleted = np.concatenate(
+                [self._deleted, np.zeros(len(ids), dtype=bool)]
+            )
+            full = len(self._pending) >= self.flush_every
+        if full:
+            self.flush()
+
+    def on_documents_deleted(self, ids_by_source: dict[str, list[str]]) -> None:
+        with self._lock:
+            rows = [
+                self._row_of.pop(doc_id)
+                for source_ids in ids_by_source.values()
+                for doc_id in source_ids
+                if doc_id in self._row_of
+            ]
+            if not rows:
+                return
+            self._deleted[rows] = True
+            compact = self._deleted.sum() > self.compact_ratio * len(self._ids)
+            if not compact and self._matrix is not None and os.path.isdir(self.path):
+                self._save_tombstones()
+        if compact:
+            self.save()
+
+    def flush(self) -> None:
+        """
+        Append the rows added since the last flush or save to the files on disk.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                if self._matrix is None or not len(self._matrix):
+                    # Nothing to append to, the pending rows are the whole mirror
+                    self.save()
+                    return
+                start = len(self._matrix)
+                end = start + len(self._pending)
+                vectors = np.stack(self._pending)
+                rows = zip(
+                    self._ids[start:end],
+                    self._texts[start:end],
+                    self._metadata[start:end],
+                )
+                lines = "".join(
+                    json.dumps({"id": doc_id, "text": text, "metadata": metadata})
+                    + "\n"
+                    for doc_id, text, metadata in rows
+                )
+                assignments = (
+                    self._assign(vectors) if self._centroids is not None else None
+                )
+
+            # Searches and writes go on while the rows are appended, the matrix is written first
+            # so rows are never loaded without their embeddings
+            with open(os.path.join(self.path, "embeddings.bin"), "ab") as f:
+                f.write(np.ascontiguousarray(vectors).tobytes())
+            if assignments is not None:
+                with open(os.path.join(self.path, "assignments.bin"), "ab") as f:
+                    f.write(assignments.tobytes())
+            with open(os.path.join(self.path, "rows.jsonl"), "ab") as f:
+                f.write(lines.encode("utf-8"))
+
+            with self._lock:
+                self._matrix = self._map(end, vectors.shape[1])
+                del self._pending[: end - start]
+                if assignments is not None:
+                    self._set_lists(np.concatenate([self._assignments, assignments]))
+                if self._deleted[start:end].any():
+                    self._save_tombstones()
+
+    def save(self) -> None:
+        """
+        Compact deleted and pending rows into the matrix and rewrite the mirror on disk.
+        """
+        with self._flush_lock, self._lock:
+            self._compact()
+            # The new files are written next to the old ones and swapped in, so a crash never
+            # leaves a mix of both
+            staging_path = self.path + ".tmp"
+            shutil.rmtree(staging_path, ignore_errors=True)
+            os.makedirs(staging_path)
+            matrix = (
+                np.zeros((0, 0), dtype=self.dtype)
+                if self._matrix is None
+                else np.ascontiguousarray(self._matrix)
+            )
+            self._save_meta(matrix.shape[1], staging_path)
+            matrix.tofile(os.path.join(staging_path, "embeddings.bin"))
+            with open(
+                os.path.join(staging_path, "rows.jsonl"), "w", encoding="utf-8"
+            ) as f:
+                for doc_id, text, metadata in zip(
+                    self._ids, self._texts, self._metadata
+                ):
+                    f.write(
+                        json.dumps({"id": doc_id, "text": text, "metadata": metadata})
+                        + "\n"
+                    )
+            if self._centroids is not None:
+                np.save(os.path.join(staging_path, "centroids.npy"), self._centroids)
+                self._assignments.tofile(os.path.join(staging_path, "assignments.bin"))
+            old_path = self.path + ".old"
+            shutil.rmtree(old_path, ignore_errors=True)
+            if os.path.exists(self.path):
+                os.replace(self.path, old_path)
+            os.replace(staging_path, self.path)
+            shutil.rmtree(old_path, ignore_errors=True)
+            self._matrix = self._map(len(matrix), matrix.shape[1])
+
+    def _save_meta(self, dim: int, path: Optional[str] = None) -> None:
+        with open(
+            os.path.join(path or self.path, "index.json"), "w", encoding="utf-8"
+        ) as f:
+            json.dump({"dtype": self.dtype.name, "dim": int(dim)}, f)
+
+    def _save_tombstones(self) -> None:
+        # Only the tombstones of the rows on disk are persisted, pending rows are not
+        tombstones_path = os.path.join(self.path, "deleted.npy")
+        np.save(tombstones_path + ".tmp.npy", self._deleted[: len(self._matrix)])
+        os.replace(tombstones_path + ".tmp.npy", tombstones_path)
+
+    def _map(self, n_rows: int, dim: int) -> np.ndarray:
+        if not n_rows:
+            return np.zeros((0, dim), dtype=self.dtype)
+        return np.memmap(
+            os.path.join(self.path, "embeddings.bin"),
+            dtype=self.dtype,
+            mode="r",
+            shape=(n_rows, dim),
+        )
+
+    def _compact(self) -> None:
+        keep = ~self._deleted
+        matrix = self._matrix
+        parts = []
+        if matrix is not None and len(matrix):
+            parts.append(np.asarray(matrix))
+        if self._pending:
+            parts.append(np.stack(self._pending))
+        if not parts:
+            return
+        full = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        if self._centroids is not None:
+            base_assignments = self._assignments if matrix is not None else []
+            pending_assignments = (
+                self._assign(np.stack(self._pending))
+                if self._pending
+                else np.zeros(0, dtype=np.int32)
+            )
+            assignments = np.concatenate([base_assignments, pending_assignments])[keep]
+        self._matrix = full[keep]
+        self._ids = [doc_id for doc_id, k in zip(self._ids, keep) if k]
+        self._texts = [text for text, k in zip(self._texts, keep) if k]
+        self._metadata = [metadata for metadata, k in zip(self._metadata, keep) if k]
+        self._deleted = np.zeros(len(self._ids), dtype=bool)
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._pending = []
+        if self._centroids is not None:
+            self._set_lists(assignments)
+
+    def _set_lists(self, assignments: np.ndarray) -> None:
+        self._assignments = assignments.astype(np.int32)
+        self._list_order = np.argsort(self._assignments, kind="stable")
+        self._list_offsets = np.searchsorted(
+            self._assignments[self._list_order], np.arange(len(self._centroids) + 1)
+        )
+
+    def _assign(self, matrix: np.ndarray) -> np.ndarray:
+        return np.concatenate(
+            [
+                np.argmax(self._scores_block(block) @ self._centroids.T, axis=1)
+                for block in self._blocks(matrix)
+            ]
+            or [np.zeros(0, dtype=np.int64)]
+        ).astype(np.int32)
+
+    def _probe(self, query: np.ndarray) -> np.ndarray:
+        n_probe = min(self.n_probe, len(self._centroids))
+        lists = np.argpartition(-(self._centroids @ query), n_probe - 1)[:n_probe]
+        return np.sort(
+            np.concatenate(
+                [
+                    self._list_order[self._list_offsets[i] : self._list_offsets[i + 1]]
+                    for i in lists
+                ]
+            )
+        )
+
+    def _scores(self, matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return np.concatenate(
+            [self._scores_block(block) @ query for block in self._blocks(matrix)]
+            or [np.zeros(0, dtype=np.float32)]
+        )
+
+    @staticmethod
+    def _blocks(matrix: np.ndarray, block_size: int = 65_536):
+        for start in range(0, len(matrix), block_size):
+            yield matrix[start : start + block_size]
+
+    @staticmethod
+    def _scores_block(block: np.ndarray) -> np.ndarray:
+        # float16 matrices are upcast block by block, BLAS has no fast float16 path on CPU
+        return np.asarray(block, dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class LocalIndexRetriever(BaseRetriever):
+    """
+    LangChain retriever searching the local vector index instead of the remote dataset.
+    """
+
+    index: Any
+    """Local vector index to search."""
+    embeddings: Embeddings
+    """Embeddings used to embed the queries."""
+    k: int = 4
+    """Number of documents to return."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return self._to_documents(self.embeddings.embed_query(query))
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        return self._to_documents(await self.embeddings.aembed_query(query))
+
+    def _to_documents(self, embedding: list[float]) -> list[Document]:
+        return [doc for doc, _ in self.index.search(embedding, self.k)]
@@ -0,0 +1,527 @@
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+import httpx
+from langchain_core.embeddings import Embeddings
+
+from src.tracing import tracer
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+# Statuses worth retrying: rate limited, or a transient server error
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "request_priority", default=INTERACTIVE
+)
+
+
+@contextmanager
+def priority(value: str) -> Iterator[None]:
+    """
+    Run the provider calls made in the block at the given priority.
+
+    Calls are interactive unless made in a background block, like ingestion.
+
+    Args:
+        value: INTERACTIVE or BACKGROUND.
+    """
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """
+    Parse a rate limit reset duration like "1s", "20ms" or "6m0s".
+
+    Args:
+        value: Duration header value.
+
+    Returns:
+        The duration in seconds, or None if it cannot be parsed.
+    """
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value or "")
+    if not parts:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def estimate_tokens(request: httpx.Request) -> int:
+    """
+    Estimate the tokens a request to the OpenAI API counts against the tokens-per-minute limit.
+
+    Embedding inputs sent as token arrays are counted exactly, texts at about four characters per
+    token. Chat completions also count their completion budget.
+
+    Args:
+        request: Outgoing request.
+
+    Returns:
+        The estimated number of tokens, 0 for requests not limited by tokens.
+    """
+    path = request.url.path
+    if not path.endswith(("/embeddings", "/chat/completions")):
+        return 0
+    try:
+        body = json.loads(request.content)
+    except (ValueError, httpx.RequestNotRead):
+        return 0
+
+    def count(value) -> int:
+        if isinstance(value, str):
+            return len(value) // 4 + 1
+        if isinstance(value, int):
+            return 1
+        if isinstance(value, list):
+            return sum(count(item) for item in value)
+        if isinstance(value, dict):
+            return count(value.get("content") or "")
+        return 0
+
+    if path.endswith("/embeddings"):
+        return count(body.get("input", ""))
+    return count(body.get("messages", [])) + (body.get("max_tokens") or 256)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a per-minute rate, holding at most one minute of it.
+
+    Not thread-safe on its own, the limiter holding it synchronizes the accesses.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def set_rate(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.level = min(self.level, self.capacity)
+
+    def refill(self, now: float) -> None:
+        self.level = min(
+            self.capacity, self.level + (now - self._updated) * self.capacity / 60
+        )
+        self._updated = now
+
+    def available(self, reserve: float = 0.0) -> float:
+        """
+        Amount that can be taken while keeping a fraction of the capacity in reserve.
+        """
+        return self.level - reserve * self.capacity
+
+    def wait_time(self, amount: float, reserve: float = 0.0) -> float:
+        """
+        Seconds until `amount` can be taken while keeping a fraction of the capacity in reserve.
+
+        Amounts larger than what the bucket can ever hold are capped, so they go through once the
+        bucket is full.
+        """
+        amount = min(amount, self.capacity * (1 - reserve))
+        missing = amount - self.available(reserve)
+        return max(missing, 0.0) * 60 / self.capacity if self.capacity else 0.0
+
+    def take(self, amount: float) -> None:
+        # The level may go negative on capped amounts, delaying the next callers accordingly
+        self.level -= amount
+
+
+class ProviderLimiter:
+    """
+    Client-side rate limiter of one API provider, shared by all the calls of the process.
+
+    Requests and tokens per minute are paced with token buckets, synced with the rate limit
+    headers of the responses when the provider sends them. Interactive calls may use the whole
+    quota, while background calls leave `interactive_reserve` of it untouched and give way to any
+    waiting interactive call, so ingestion goes as fast as the remaining quota allows.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: float = 0,
+        interactive_reserve: float = 0.2,
+        max_retries: int = 6,
+        base_delay: float = 0.5,
+        max_delay: float = 30,
+        min_batch_fraction: float = 0.02,
+        max_batch_fraction: float = 0.1,
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.interactive_reserve = interactive_reserve
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_batch_fraction = min_batch_fraction
+        self.max_batch_fraction = max_batch_fraction
+
+        self._lock = threading.Lock()
+        self._interactive_waiting = 0
+        self._paused_until = 0.0
+
+        self.throttled = 0
+        self.retries = 0
+
+    def acquire(self, tokens: int = 0, request_priority: Optional[str] = None) -> float:
+        """
+        Wait until a request of `tokens` tokens fits in the quota and take it.
+
+        Args:
+            tokens: Tokens of the request.
+            request_priority: INTERACTIVE or BACKGROUND, defaults to the current priority.
+
+        Returns:
+            Seconds waited.
+        """
+        request_priority = request_priority or _priority.get()
+        start = time.monotonic()
+        with self._waiting(request_priority):
+            while (wait := self._try_acquire(tokens, request_priority)) > 0:
+                time.sleep(min(wait, 1.0))
+        return time.monotonic() - start
+
+    async def aacquire(
+        self, tokens: int = 0, request_priority: Optional[str] = None
+    ) -> float:
+        """
+        Wait until a request of `tokens` tokens fits in the quota and take it, without blocking
+        the event loop.
+
+        Args:
+            tokens: Tokens of the request.
+            request_priority: INTERACTIVE or BACKGROUND, defaults to the current priority.
+
+        Returns:
+            Seconds waited.
+        """
+        request_priority = request_priority or _priority.get()
+        start = time.monotonic()
+        with self._waiting(request_priority):
+            while (wait := self._try_acquire(tokens, request_priority)) > 0:
+                await asyncio.sleep(min(wait, 1.0))
+        return time.monotonic() - start
+
+    def observe(self, response: httpx.Response) -> None:
+        """
+        Sync the buckets with the rate limit headers of a response, and pause every caller when it
+        was rate limited.
+
+        Args:
+            response: Response of the provider.
+        """
+        headers = response.headers
+        with self._lock:
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                if bucket is None:
+                    continue
+                if limit := headers.get(f"x-ratelimit-limit-{kind}"):
+                    bucket.set_rate(float(limit))
+                if (
+                    remaining := headers.get(f"x-ratelimit-remaining-{kind}")
+                ) is not None:
+                    bucket.level = min(bucket.level, float(remaining))
+            if response.status_code == 429:
+                self.throttled += 1
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + self.retry_delay(0, response)
+                )
+
+    def retry_delay(
+        self, attempt: int, response: Optional[httpx.Response] = None
+    ) -> float:
+        """
+        Delay before retrying a request: the one the provider asks for, the reset time of its
+        exhausted quota, or an exponential backoff with full jitter, so concurrent callers do not
+        retry in lockstep.
+
+        Args:
+            attempt: Number of the failed attempt, from 0.
+            response: Failed response, if any.
+
+        Returns:
+            The delay in seconds.
+        """
+        if response is not None:
+            headers = response.headers
+            for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+                try:
+                    if header in headers:
+                        return float(headers[header]) * scale + random.uniform(0, 0.1)
+                except ValueError:
+                    pass
+            # Otherwise wait for the exhausted quota to reset, when the provider tells when
+            resets = [
+                parse_duration(headers[f"x-ratelimit-reset-{kind}"])
+                for kind in ("requests", "tokens")
+                if response.status_code == 429
+                and f"x-ratelimit-reset-{kind}" in headers
+                and headers.get(f"x-ratelimit-remaining-{kind}") == "0"
+            ]
+            if resets := [reset for reset in resets if reset is not None]:
+                return min(max(resets), self.max_delay) + random.uniform(0, 0.1)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def batch_budget(self) -> int:
+        """
+        Tokens the next background batch should carry, from the current tokens-per-minute headroom.
+
+        Returns:
+            The budget, between `min_batch_fraction` and `max_batch_fraction` of the per-minute limit.
+        """
+        if self.tokens is None:
+            return 0
+        with self._lock:
+            self.tokens.refill(time.monotonic())
+            headroom = self.tokens.available(self.interactive_reserve)
+            capacity = self.tokens.capacity
+        return int(
+            min(
+                max(headroom, capacity * self.min_batch_fraction),
+                capacity * self.max_batch_fraction,
+            )
+        )
+
+    def iter_batches(
+        self, texts: list[str], count_tokens: Callable[[str], int]
+    ) -> Iterator[list[str]]:
+        """
+        Split texts into batches sized from the headroom at the time each batch is sent.
+
+        Args:
+            texts: Texts to split.
+            count_tokens: Token counter of a text.
+
+        Yields:
+            Consecutive batches of texts.
+        """
+        start = 0
+        while start < len(texts):
+            budget = self.batch_budget()
+            end, cost = start, 0
+            while end < len(texts):
+                cost += count_tokens(texts[end])
+                if end > start and budget and cost > budget:
+                    break
+                end += 1
+            yield texts[start:end]
+            start = end
+
+    def _try_acquire(self, tokens: int, request_priority: str) -> float:
+        with self._lock:
+            now = time.monotonic()
+            if request_priority == BACKGROUND and self._interactive_waiting:
+                return 0.05
+            reserve = (
+                self.interactive_reserve if request_priority == BACKGROUND else 0.0
+            )
+            buckets = [(self.requests, 1)]
+            if self.tokens is not None and tokens:
+                buckets.append((self.tokens, tokens))
+            for bucket, _ in buckets:
+                bucket.refill(now)
+            wait = max(
+                self._paused_until - now,
+                *(bucket.wait_time(amount, reserve) for bucket, amount in buckets),
+            )
+            if wait > 0:
+                return wait
+            for bucket, amount in buckets:
+                bucket.take(amount)
+            return 0.0
+
+    @contextmanager
+    def _waiting(self, request_priority: str) -> Iterator[None]:
+        if request_priority != INTERACTIVE:
+            yield
+            return
+        with self._lock:
+            self._interactive_waiting += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._interactive_waiting -= 1
+
+
+class RequestScheduler:
+    """
+    Routes the HTTP requests of the API clients to the limiter of their provider.
+    """
+
+    def __init__(self, limiters: dict[str, ProviderLimiter]):
+        """
+        Args:
+            limiters: Limiters by API host name; subdomains of a host share its limiter.
+        """
+        self.limiters = limiters
+
+    def for_host(self, host: str) -> Optional[ProviderLimiter]:
+        for name, limiter in self.limiters.items():
+            if host == name or host.endswith("." + name):
+                return limiter
+        return None
+
+    def sync_client(self, timeout: float = 60) -> httpx.Client:
+        """
+        HTTP client for synchronous API clients, going through the limiters.
+        """
+        return httpx.Client(
+            transport=RateLimitedTransport(self, httpx.HTTPTransport()),
+            timeout=timeout,
+        )
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """
+    HTTP transport pacing the requests to rate-limited providers and retrying the throttled ones.
+    """
+
+    def __init__(self, scheduler: RequestScheduler, transport: httpx.BaseTransport):
+        self.scheduler = scheduler
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        limiter = self.scheduler.for_host(request.url.host)
+        if limiter is None:
+            return self.transport.handle_request(request)
+
+        tokens = estimate_tokens(request)
+        waited = 0.0
+        for attempt in range(limiter.max_retries + 1):
+            waited += limiter.acquire(tokens)
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError:
+                if attempt == limiter.max_retries:
+                    raise
+                response = None
+            else:
+                limiter.observe(response)
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt == limiter.max_retries
+                ):
+                    _record(limiter, waited, attempt)
+                    return response
+                response.close()
+            limiter.retries += 1
+            delay = limiter.retry_delay(attempt, response)
+            time.sleep(delay)
+            waited += delay
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class RateLimitedAsyncTransport(httpx.AsyncBaseTransport):
+    """
+    Async counterpart of `RateLimitedTransport`.
+    """
+
+    def __init__(
+        self, scheduler: RequestScheduler, transport: httpx.AsyncBaseTransport
+    ):
+        self.scheduler = scheduler
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        limiter = self.scheduler.for_host(request.url.host)
+        if limiter is None:
+            return await self.transport.handle_async_request(request)
+
+        tokens = estimate_tokens(request)
+        waited = 0.0
+        for attempt in range(limiter.max_retries + 1):
+            waited += await limiter.aacquire(tokens)
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError:
+                if attempt == limiter.max_retries:
+                    raise
+                response = None
+            else:
+                limiter.observe(response)
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt == limiter.max_retries
+                ):
+                    _record(limiter, waited, attempt)
+                    return response
+                await response.aclose()
+            limiter.retries += 1
+            delay = limiter.retry_delay(attempt, response)
+            await asyncio.sleep(delay)
+            waited += delay
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def _record(limiter: ProviderLimiter, waited: float, retries: int) -> None:
+    # Only throttled calls are recorded, as a stage of the trace they belong to
+    if waited < 0.001 and not retries:
+        return
+    if waited > 1:
+        logging.info(
+            f"{limiter.name} call waited {waited:.1f} s for its quota ({retries} retries)"
+        )
+    span = tracer.start_span(f"ratelimit.{limiter.name}", priority=_priority.get())
+    span.add(waited, items=1, retries=retries)
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper sending documents in batches sized from the provider's headroom, at
+    background priority, so bulk embedding never crowds out interactive calls.
+
+    The requests themselves are paced and retried by the HTTP transport of the wrapped client.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        limiter: ProviderLimiter,
+        count_tokens: Callable[[str], int] = lambda text: len(text) // 4 + 1,
+    ):
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.count_tokens = count_tokens
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        with priority(BACKGROUND):
+            for batch in self.limiter.iter_batches(texts, self.count_tokens):
+                vectors.extend(self.embeddings.embed_documents(batch))
+        return vectors
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        with priority(BACKGROUND):
+            for batch in self.limiter.iter_batches(texts, self.count_tokens):
+                vectors.extend(await self.embeddings.aembed_documents(batch))
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
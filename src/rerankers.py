@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import os
+import threading
+from abc import abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from copy import deepcopy
+from typing import Any, Optional, Sequence
+
+import numpy as np
+from langchain.retrievers.document_compressors import CohereRerank
+from langchain_core.callbacks.manager import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+
+from src.lexical_index import tokenize
+
+
+class AsyncCohereRerank(CohereRerank):
+    """
+    Cohere reranker whose async path goes through a pooled `cohere.AsyncClient`.
+    """
+
+    async_client: Any = None
+    """Async Cohere client, sharing the process-wide HTTP connection pool."""
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        """
+        Compress documents using Cohere's rerank API without blocking the event loop.
+
+        Args:
+            documents: A sequence of documents to compress.
+            query: The query to use for compressing the documents.
+            callbacks: Callbacks to run during the compression process.
+
+        Returns:
+            A sequence of compressed documents.
+        """
+        if self.async_client is None:
+            return await super().acompress_documents(documents, query, callbacks)
+        if not documents:
+            return []
+
+        response = await self.async_client.rerank(
+            query=query,
+            documents=[doc.page_content for doc in documents],
+            model=self.model,
+            top_n=self.top_n,
+        )
+        compressed = []
+        for res in response.results:
+            doc = documents[res.index]
+            doc_copy = Document(doc.page_content, metadata=deepcopy(doc.metadata))
+            doc_copy.metadata["relevance_score"] = res.relevance_score
+            compressed.append(doc_copy)
+        return compressed
+
+
+class LocalReranker(BaseDocumentCompressor):
+    """
+    Base class of the rerankers scoring every candidate in one batch on the local CPU.
+    """
+
+    top_n: int = 3
+    """Number of documents to return."""
+
+    @abstractmethod
+    def score(self, query: str, texts: list[str]) -> np.ndarray:
+        """
+        Score the relevance of texts to a query.
+
+        Args:
+            query: The query.
+            texts: Candidate texts.
+
+        Returns:
+            Relevance scores between 0 and 1, one per text.
+        """
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        """
+        Keep the top documents by local relevance score.
+
+        Args:
+            documents: A sequence of documents to compress.
+            query: The query to use for compressing the documents.
+            callbacks: Callbacks to run during the compression process.
+
+        Returns:
+            A sequence of compressed documents.
+        """
+        if not documents:
+            return []
+
+        scores = self.score(query, [doc.page_content for doc in documents])
+        compressed = []
+        for index in np.argsort(-scores, kind="stable")[: self.top_n]:
+            doc = documents[index]
+            doc_copy = Document(doc.page_content, metadata=deepcopy(doc.metadata))
+            doc_copy.metadata["relevance_score"] = float(scores[index])
+            compressed.append(doc_copy)
+        return compressed
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        # Scoring a handful of candidates is faster than a hop to the thread pool
+        return self.compress_documents(documents, query, callbacks)
+
+
+class LexicalReranker(LocalReranker):
+    """
+    Feature-based reranker combining BM25 term weights, query coverage and bigram matches.
+    """
+
+    k1: float = 1.2
+    b: float = 0.75
+    coverage_weight: float = 1.0
+    bigram_weight: float = 1.0
+
+    def score(self, query: str, texts: list[str]) -> np.ndarray:
+        query_tokens = tokenize(query)
+        terms = list(dict.fromkeys(query_tokens))
+        if not terms or not texts:
+            return np.zeros(len(texts))
+
+        doc_tokens = [tokenize(text) for text in texts]
+        counts = [Counter(tokens) for tokens in doc_tokens]
+        tf = np.array(
+            [[count[term] for term in terms] for count in counts], dtype=np.float32
+        )
+        lengths = np.array([len(tokens) for tokens in doc_tokens], dtype=np.float32)
+
+        # Term weights are estimated over the candidate set itself
+        df = (tf > 0).sum(axis=0)
+        idf = np.log(1 + (len(texts) - df + 0.5) / (df + 0.5))
+        norm = self.k1 * (
+            1 - self.b + self.b * lengths[:, None] / max(lengths.mean(), 1)
+        )
+        bm25 = (tf * (self.k1 + 1) / (tf + norm)) @ idf / max(idf.sum(), 1e-6)
+        coverage = (tf > 0).mean(axis=1)
+
+        query_bigrams = set(zip(query_tokens, query_tokens[1:]))
+        if query_bigrams:
+            bigrams = np.array(
+                [
+                    len(query_bigrams & set(zip(tokens, tokens[1:])))
+                    for tokens in doc_tokens
+                ],
+                dtype=np.float32,
+            ) / len(query_bigrams)
+        else:
+            bigrams = np.zeros(len(texts), dtype=np.float32)
+
+        raw = bm25 + self.coverage_weight * coverage + self.bigram_weight * bigrams
+        return raw / (self.k1 + 1 + self.coverage_weight + self.bigram_weight)
+
+
+class OnnxCrossEncoderReranker(LocalReranker):
+    """
+    Cross-encoder reranker running a small ONNX model exported with its `tokenizer.json`.
+    """
+
+    model_path: str
+    """Directory holding `model.onnx` and `tokenizer.json`."""
+    max_length: int = 512
+    session: Any = None
+    tokenizer: Any = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError(
+                "Could not import onnxruntime or tokenizers. "
+                "Please install them with `pip install onnxruntime tokenizers`."
+            )
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(self.model_path, "model.onnx"),
+            providers=["CPUExecutionProvider"],
+        )
+        self.tokenizer = Tokenizer.from_file(
+            os.path.join(self.model_path, "tokenizer.json")
+        )
+        self.tokenizer.enable_truncation(self.max_length)
+        self.tokenizer.enable_padding()
+
+    def score(self, query: str, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros(0)
+
+        encodings = self.tokenizer.encode_batch([(query, text) for text in texts])
+        features = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            ),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        input_names = {i.name for i in self.session.get_inputs()}
+        logits = self.session.run(
+            None,
+            {name: value for name, value in features.items() if name in input_names},
+        )[0]
+        return 1 / (1 + np.exp(-logits.reshape(len(texts), -1)[:, -1]))
+
+
+class FallbackReranker(BaseDocumentCompressor):
+    """
+    Reranker calling a remote reranker, and a local one when it fails or exceeds its latency budget.
+    """
+
+    primary: BaseDocumentCompressor
+    """Remote reranker."""
+    fallback: BaseDocumentCompressor
+    """Local reranker used when the remote one is slow or failing."""
+    latency_budget: float = 1.5
+    """Seconds to wait for the remote reranker."""
+    fallbacks: int = 0
+    """Number of queries answered by the fallback reranker."""
+
+    _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rerank")
+    _lock = threading.Lock()
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        future = self._executor.submit(
+            self.primary.compress_documents, documents, query, callbacks
+        )
+        try:
+            return future.result(timeout=self.latency_budget)
+        except FutureTimeoutError:
+            self._record_fallback("timed out")
+        except Exception as e:
+            self._record_fallback(str(e))
+        return self.fallback.compress_documents(documents, query, callbacks)
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        try:
+            return await asyncio.wait_for(
+                self.primary.acompress_documents(documents, query, callbacks),
+                self.latency_budget,
+            )
+        except asyncio.TimeoutError:
+            self._record_fallback("timed out")
+        except Exception as e:
+            self._record_fallback(str(e))
+        return await self.fallback.acompress_documents(documents, query, callbacks)
+
+    def _record_fallback(self, reason: str) -> None:
+        logging.warning(f"Remote reranker {reason}, falling back to the local reranker")
+        with self._lock:
+            self.fallbacks += 1
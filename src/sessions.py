@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+from langchain.memory import ConversationBufferWindowMemory
+
+
+def make_window_memory(k_history: int = 3) -> ConversationBufferWindowMemory:
+    """
+    Create the conversation memory of a chat session.
+
+    Args:
+        k_history: Number of previous exchanges kept in the memory.
+
+    Returns:
+        An empty conversation memory.
+    """
+    return ConversationBufferWindowMemory(
+        k=k_history,
+        memory_key="chat_history",
+        return_messages=True,
+        output_key="answer",
+    )
+
+
+class SessionPool:
+    """
+    Bounded pool of per-session conversation memories, shared by the sessions of the process.
+
+    Memories are created on first use, evicted in LRU order above `max_sessions` and dropped after
+    `idle_ttl` seconds without use, so abandoned browser sessions do not leak memory. A session
+    coming back after its memory was evicted gets it rebuilt from the history it passes in.
+    """
+
+    def __init__(
+        self,
+        memory_factory: Callable[
+            [], ConversationBufferWindowMemory
+        ] = make_window_memory,
+        max_sessions: int = 256,
+        idle_ttl: float = 1800,
+    ):
+        self.memory_factory = memory_factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict[
+            str, tuple[ConversationBufferWindowMemory, float]
+        ] = OrderedDict()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def get(
+        self,
+        session_id: str,
+        history: Optional[Iterable[tuple[str, str]]] = None,
+    ) -> ConversationBufferWindowMemory:
+        """
+        Get the conversation memory of a session, creating it if needed.
+
+        Args:
+            session_id: ID of the session.
+            history: Optional (question, answer) exchanges of the session so far, oldest first,
+                replayed into the memory when it has to be created.
+
+        Returns:
+            The conversation memory of the session.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+            if session_id in self._sessions:
+                memory, _ = self._sessions.pop(session_id)
+            else:
+                memory = self.memory_factory()
+                exchanges = list(history or [])
+                # Only the exchanges the memory window keeps are replayed
+                window = getattr(memory, "k", len(exchanges))
+                for question, answer in exchanges[max(len(exchanges) - window, 0) :]:
+                    memory.save_context({"question": question}, {"answer": answer})
+            self._sessions[session_id] = (memory, now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return memory
+
+    def drop(self, session_id: str) -> None:
+        """
+        Forget the conversation memory of a session.
+
+        Args:
+            session_id: ID of the session.
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict_idle(self, now: float) -> None:
+        # Sessions are ordered by last use, so the idle ones are at the front
+        while self._sessions:
+            _, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
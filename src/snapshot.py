@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Iterator
+
+import numpy as np
+import pyarrow as pa
+from langchain.docstore.document import Document
+
+SNAPSHOT_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.arrow"
+
+
+def snapshot_path(root: str, name: str) -> str:
+    """
+    Resolve the directory of a named snapshot, which must stay under the snapshot root.
+
+    Args:
+        root: Directory holding the snapshots.
+        name: Name of the snapshot.
+
+    Returns:
+        The resolved directory of the snapshot.
+    """
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, name))
+    if path == root or os.path.commonpath([root, path]) != root:
+        raise ValueError(f"Invalid snapshot name {name!r}")
+    return path
+
+
+def export_snapshot(ds, path: str, block_size: int = 8192, **info) -> dict:
+    """
+    Export a dataset to a local snapshot directory, streaming it block by block.
+
+    The chunks go to an Arrow IPC file of record batches of `block_size` rows, with the IDs, texts,
+    metadata (as JSON) and embeddings (as fixed-size float32 lists, contiguous per batch), so the
+    snapshot can be memory-mapped and read without decoding. The snapshot is written to a
+    temporary directory next to the path and moved there once complete, with its manifest.
+
+    Args:
+        ds: DeepLake dataset (or version of it) to export.
+        path: Directory of the snapshot; an existing snapshot there is replaced, any other
+            existing directory is refused.
+        block_size: Number of rows read from the dataset and written per batch.
+        info: Extra fields recorded in the manifest.
+
+    Returns:
+        The manifest of the snapshot.
+    """
+    if os.path.exists(path) and not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        raise ValueError(f"{path} exists and is not a snapshot")
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f".{os.path.basename(path)}.", dir=parent)
+
+    try:
+        count = len(ds)
+        dim = ds.embedding[0:1].numpy().shape[-1] if count else 0
+        schema = pa.schema(
+            [
+                ("id", pa.string()),
+                ("text", pa.string()),
+                ("metadata", pa.string()),
+                ("embedding", pa.list_(pa.float32(), dim)),
+            ]
+        )
+        batches = []
+        with pa.OSFile(os.path.join(staging, CHUNKS_FILE), "wb") as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                for start in range(0, count, block_size):
+                    end = min(start + block_size, count)
+                    rows = ds[start:end]
+                    metadata = [json.dumps(m) for m in rows.metadata.data()["value"]]
+                    embeddings = rows.embedding.numpy().astype(np.float32).reshape(-1)
+                    writer.write_batch(
+                        pa.record_batch(
+                            [
+                                pa.array(
+                                    rows.id.data(aslist=True)["value"], pa.string()
+                                ),
+                                pa.array(
+                                    rows.text.data(aslist=True)["value"], pa.string()
+                                ),
+                                pa.array(metadata, pa.string()),
+                                pa.FixedSizeListArray.from_arrays(
+                                    pa.array(embeddings), dim
+                                ),
+                            ],
+                            schema=schema,
+                        )
+                    )
+                    batches.append(end - start)
+
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "count": count,
+            "dim": dim,
+            "dtype": "float32",
+            "batches": batches,
+            "created_at": time.time(),
+            **info,
+        }
+        with open(os.path.join(staging, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        # A directory cannot be replaced by a rename, so the previous snapshot is moved aside first
+        previous = staging + ".previous"
+        if os.path.exists(path):
+            os.replace(path, previous)
+        os.replace(staging, path)
+        shutil.rmtree(previous, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    logging.info(f"Exported {count} chunks to snapshot {path}")
+    return manifest
+
+
+def read_manifest(path: str) -> dict:
+    """
+    Read and check the manifest of a snapshot.
+
+    Args:
+        path: Directory of the snapshot.
+
+    Returns:
+        The manifest.
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise ValueError(f"No complete snapshot in {path}")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {manifest.get('version')}")
+    return manifest
+
+
+def iter_snapshot(
+    path: str, batch_size: int = 8192
+) -> Iterator[tuple[list[Document], np.ndarray, list[str]]]:
+    """
+    Stream a snapshot in batches, without loading it into memory at once.
+
+    The chunks file is memory-mapped, so each batch of embeddings is read straight from disk.
+
+    Args:
+        path: Directory of the snapshot.
+        batch_size: Number of rows per batch.
+
+    Yields:
+        Batches of chunks, their embeddings and their row IDs.
+    """
+    manifest = read_manifest(path)
+    with pa.memory_map(os.path.join(path, CHUNKS_FILE)) as source:
+        table = pa.ipc.open_file(source).read_all()
+        if (
+            table.num_rows != manifest["count"]
+            or table.schema.field("embedding").type.list_size != manifest["dim"]
+        ):
+            raise ValueError(f"Chunks of snapshot {path} do not match its manifest")
+
+        for start in range(0, table.num_rows, batch_size):
+            batch = table.slice(start, batch_size)
+            embeddings = (
+                batch.column("embedding")
+                .combine_chunks()
+                .flatten()
+                .to_numpy()
+                .reshape(-1, manifest["dim"])
+            )
+            docs = [
+                Document(text, metadata=json.loads(metadata))
+                for text, metadata in zip(
+                    batch.column("text").to_pylist(),
+                    batch.column("metadata").to_pylist(),
+                )
+            ]
+            yield docs, embeddings, batch.column("id").to_pylist()
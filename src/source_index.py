@@ -0,0 +1,298 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+from langchain.docstore.document import Document
+
+
+def chunk_hash(text: str) -> str:
+    """
+    Content hash of a chunk, used to diff stored chunks against a fresh crawl.
+
+    Args:
+        text: Chunk text.
+
+    Returns:
+        Short hex digest of the text.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class SourceIndex:
+    """
+    Per-source index of the chunks stored in the vector database.
+
+    The per-source aggregates are kept in the dataset's info (next to the data itself) and updated
+    on every write, so listing the knowledge base costs O(number of sources) instead of
+    O(number of chunks). The row IDs and content hashes of the chunks are not part of it: every
+    chunk is written with its hash in its metadata, so they are read from the dataset's ID and
+    metadata tensors the first time a source's chunks are needed, and then kept up to date in
+    memory.
+    """
+
+    INFO_KEY = "source_index"
+    VERSION = 1
+    # Metadata key holding the content hash of a chunk
+    HASH_KEY = "chunk_hash"
+
+    def __init__(
+        self,
+        entries: Optional[dict[str, dict]] = None,
+        chunks: Optional[dict[str, dict[str, str]]] = None,
+        ds=None,
+    ):
+        self.entries = entries if entries is not None else {}
+        # Chunk hash by row ID, per source; read from the dataset when first needed
+        self._chunks = chunks
+        self._ds = ds
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, ds) -> "SourceIndex":
+        """
+        Load the index stored next to the dataset, rebuilding it from a full scan if it is
+        missing, outdated or out of sync with the dataset.
+
+        Args:
+            ds: DeepLake dataset the index belongs to.
+
+        Returns:
+            The loaded source index.
+        """
+        stored = ds.info.get(cls.INFO_KEY)
+        if stored and stored.get("version") == cls.VERSION:
+            index = cls(stored["entries"], ds=ds)
+            if index.total_count == len(ds):
+                return index
+            logging.info("Source index out of sync with the dataset")
+
+        index = cls(ds=ds)
+        index.rebuild(ds)
+        return index
+
+    @property
+    def total_count(self) -> int:
+        """
+        Total number of chunks covered by the index.
+        """
+        with self._lock:
+            return sum(entry["count"] for entry in self.entries.values())
+
+    def list_sources(self) -> list[dict]:
+        """
+        List the per-source aggregates.
+
+        Returns:
+            List of documents metadata (source, title, count, added_at).
+        """
+        with self._lock:
+            return [dict(entry) for entry in self.entries.values()]
+
+    def get_sources_under(self, url: str) -> list[str]:
+        """
+        Get the sources of a crawl: the URL itself and the pages below it.
+
+        Args:
+            url: URL of the crawl.
+
+        Returns:
+            List of source URLs.
+        """
+        prefix = url.rstrip("/") + "/"
+        with self._lock:
+            return [
+                source
+                for source in self.entries
+                if source == url or source.startswith(prefix)
+            ]
+
+    def get_ids(self, source: str) -> list[str]:
+        """
+        Get the row IDs of all chunks of a given source.
+
+        Args:
+            source: Source URL.
+
+        Returns:
+            List of row IDs (empty if the source is unknown).
+        """
+        with self._lock:
+            if source not in self.entries:
+                return []
+            return list(self._chunk_hashes().get(source, {}))
+
+    def get_chunks(self, source: str) -> list[tuple[str, str]]:
+        """
+        Get the row IDs and content hashes of all chunks of a given source.
+
+        Args:
+            source: Source URL.
+
+        Returns:
+            List of (row ID, chunk hash) pairs (empty if the source is unknown).
+        """
+        with self._lock:
+            if source not in self.entries:
+                return []
+            return list(self._chunk_hashes().get(source, {}).items())
+
+    def add(self, docs: list[Document], ids: list[str]) -> None:
+        """
+        Register newly written chunks; chunks already registered are skipped.
+
+        Args:
+            docs: Written chunks.
+            ids: Row IDs returned by the vector store, aligned with docs.
+        """
+        added_at = time.time()
+        with self._lock:
+            for doc, doc_id in zip(docs, ids):
+                source = doc.metadata["source"]
+                if self._chunks is not None:
+                    hashes = self._chunks.setdefault(source, {})
+                    if doc_id in hashes:
+                        continue
+                    hashes[doc_id] = doc.metadata.get(self.HASH_KEY) or chunk_hash(
+                        doc.page_content
+                    )
+                entry = self.entries.setdefault(
+                    source,
+                    {
+                        "source": source,
+                        "title": doc.metadata.get("title"),
+                        "count": 0,
+                        "added_at": added_at,
+                    },
+                )
+                entry["title"] = doc.metadata.get("title", entry["title"])
+                entry["count"] += 1
+
+    def remove(self, source: str) -> list[str]:
+        """
+        Drop a source from the index.
+
+        Args:
+            source: Source URL.
+
+        Returns:
+            Row IDs the source used to hold.
+        """
+        with self._lock:
+            ids = self.get_ids(source)
+            self.entries.pop(source, None)
+            if self._chunks is not None:
+                self._chunks.pop(source, None)
+            return ids
+
+    def remove_ids(self, source: str, ids: list[str]) -> None:
+        """
+        Drop some of the chunks of a source from the index.
+
+        Args:
+            source: Source URL.
+            ids: Row IDs of the removed chunks.
+        """
+        with self._lock:
+            entry = self.entries.get(source)
+            if not entry:
+                return
+            hashes = self._chunk_hashes().get(source, {})
+            for doc_id in ids:
+                hashes.pop(doc_id, None)
+            if not hashes:
+                del self.entries[source]
+                self._chunks.pop(source, None)
+                return
+            entry["count"] = len(hashes)
+
+    def rebuild(self, ds) -> None:
+        """
+        Rebuild the index from a full scan of the dataset.
+
+        Args:
+            ds: DeepLake dataset to scan.
+        """
+        logging.info("Rebuilding source index from a full dataset scan")
+
+        chunks, titles = self._scan(ds)
+        entries = {
+            source: {
+                "source": source,
+                "title": titles[source],
+                "count": len(hashes),
+                "added_at": None,
+            }
+            for source, hashes in chunks.items()
+        }
+
+        with self._lock:
+            self.entries = entries
+            self._chunks = chunks
+            self._ds = ds
+        self.save(ds)
+
+    def save(self, ds) -> None:
+        """
+        Persist the per-source aggregates next to the dataset.
+
+        Args:
+            ds: DeepLake dataset the index belongs to.
+        """
+        with self._lock:
+            ds.info.update(
+                {self.INFO_KEY: {"version": self.VERSION, "entries": self.entries}}
+            )
+
+    def _chunk_hashes(self) -> dict[str, dict[str, str]]:
+        """
+        Chunk hashes by row ID per source, read from the dataset on first use; callers hold the lock.
+        """
+        if self._chunks is None:
+            self._chunks, titles = self._scan(self._ds)
+            # Chunks written while the dataset was read are registered twice or not at all, the
+            # dataset is authoritative
+            for source in self.entries.keys() - self._chunks.keys():
+                del self.entries[source]
+            for source, hashes in self._chunks.items():
+                entry = self.entries.setdefault(
+                    source,
+                    {
+                        "source": source,
+                        "title": titles[source],
+                        "added_at": time.time(),
+                    },
+                )
+                entry["count"] = len(hashes)
+        return self._chunks
+
+    @classmethod
+    def _scan(cls, ds) -> tuple[dict[str, dict[str, str]], dict[str, Optional[str]]]:
+        """
+        Read the row IDs and content hashes of all chunks of the dataset, grouped by source.
+
+        The hash of chunks written without one in their metadata is computed from their text.
+
+        Returns:
+            Chunk hashes by row ID per source, and the title of each source.
+        """
+        chunks, titles = defaultdict(dict), {}
+        if not len(ds):
+            return {}, {}
+        raw_metadata = ds.metadata.data()["value"]
+        raw_ids = ds.id.data(aslist=True)["value"]
+        unhashed = [
+            row
+            for row, metadata in enumerate(raw_metadata)
+            if cls.HASH_KEY not in metadata
+        ]
+        texts = ds.text[unhashed].data(aslist=True)["value"] if unhashed else []
+        text_of = dict(zip(unhashed, texts))
+        for row, (metadata, doc_id) in enumerate(zip(raw_metadata, raw_ids)):
+            source = metadata.get("source")
+            doc_hash = metadata.get(cls.HASH_KEY) or chunk_hash(text_of[row])
+            chunks[source][doc_id] = doc_hash
+            titles[source] = metadata.get("title")
+        return dict(chunks), titles
@@ -0,0 +1,394 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+from typing import Any, Iterable, Iterator, Optional
+
+from src.consts import (
+    METRICS_PATH,
+    METRICS_WRITE_INTERVAL,
+    TRACE_LOG_MAX_BYTES,
+    TRACE_LOG_PATH,
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+_active_iterators = threading.local()
+
+
+class Span:
+    """
+    Timed stage of a trace with its attributes (token counts, item counts, ...).
+
+    A span is either timed as a block with `Tracer.span`, or accumulates the time of many small
+    steps (e.g. one per batch) through `add`, which is safe to call from several threads.
+    """
+
+    def __init__(self, name: str, start: float, **attributes):
+        self.name = name
+        self.start = start
+        self.duration = 0.0
+        self.attributes: dict[str, Any] = dict(attributes)
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def set(self, **attributes) -> None:
+        """
+        Set attributes of the span.
+        """
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, duration: float = 0.0, **counts) -> None:
+        """
+        Add the duration and counts of one more step to the span.
+
+        Args:
+            duration: Seconds spent in the step.
+            counts: Counts to add to the attributes of the same name.
+        """
+        with self._lock:
+            self.duration += duration
+            for key, value in counts.items():
+                self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def to_dict(self, trace_start: float) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "start_ms": round((self.start - trace_start) * 1000, 3),
+                "duration_ms": round(self.duration * 1000, 3),
+                "attributes": dict(self.attributes),
+                "error": self.error,
+            }
+
+
+class Trace:
+    """
+    Spans of one operation (a search, a transcription, an ingestion).
+    """
+
+    def __init__(self, name: str, **attributes):
+        self.id = uuid.uuid4().hex[:16]
+        self.root = Span(name, time.perf_counter(), **attributes)
+        self.timestamp = time.time()
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            spans = list(self.spans)
+        root = self.root.to_dict(self.root.start)
+        return {
+            "trace_id": self.id,
+            "name": root["name"],
+            "timestamp": self.timestamp,
+            "duration_ms": root["duration_ms"],
+            "attributes": root["attributes"],
+            "error": root["error"],
+            "spans": [span.to_dict(self.root.start) for span in spans],
+        }
+
+
+class Tracer:
+    """
+    Lightweight in-process tracer of the query, transcription and ingestion pipelines.
+
+    Finished traces are kept in memory for the UI, appended to a size-rotated JSONL log, and
+    aggregated into per-stage duration histograms and count totals exported in the Prometheus text
+    format, to a file and optionally over HTTP. The current trace follows the code through
+    `contextvars`, so spans opened in coroutines and copied contexts join it.
+    """
+
+    def __init__(
+        self,
+        log_path: Optional[str] = None,
+        metrics_path: Optional[str] = None,
+        max_log_bytes: int = 10_000_000,
+        log_backups: int = 3,
+        metrics_interval: float = 15,
+        max_traces: int = 50,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.log_path = log_path
+        self.metrics_path = metrics_path
+        self.max_log_bytes = max_log_bytes
+        self.log_backups = log_backups
+        self.metrics_interval = metrics_interval
+        self.buckets = tuple(sorted(buckets))
+
+        self._lock = threading.Lock()
+        self._traces: deque[dict] = deque(maxlen=max_traces)
+        self._histograms: dict[str, list] = {}
+        self._totals: defaultdict[tuple[str, str], float] = defaultdict(float)
+        self._log: Optional[logging.Logger] = None
+        self._metrics_written = 0.0
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @contextmanager
+    def trace(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Trace an operation; spans opened inside it are recorded with it.
+
+        Args:
+            name: Name of the operation.
+            attributes: Initial attributes of the operation.
+
+        Yields:
+            The root span of the trace.
+        """
+        trace = Trace(name, **attributes)
+        token = _current_trace.set(trace)
+        try:
+            yield trace.root
+        except BaseException as e:
+            trace.root.error = repr(e)
+            raise
+        finally:
+            _current_trace.reset(token)
+            trace.root.add(time.perf_counter() - trace.root.start)
+            self._finish(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Time a stage of the current trace.
+
+        Args:
+            name: Name of the stage.
+            attributes: Initial attributes of the stage.
+
+        Yields:
+            The span, to set attributes on.
+        """
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.add(time.perf_counter() - span.start)
+            if _current_trace.get() is None:
+                self._observe(span)
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """
+        Open a span of the current trace accumulating the steps passed to `Span.add`.
+
+        Args:
+            name: Name of the stage.
+            attributes: Initial attributes of the stage.
+
+        Returns:
+            The span.
+        """
+        span = Span(name, time.perf_counter(), **attributes)
+        if (trace := _current_trace.get()) is not None:
+            trace.add_span(span)
+        return span
+
+    def iter_span(
+        self, name: str, iterable: Iterable, count: str = "items"
+    ) -> Iterator:
+        """
+        Time the production of a lazy iterable as a stage of the current trace.
+
+        Only the time spent producing its own items is counted: the time spent in a traced
+        iterable it pulls from is attributed to that one instead.
+
+        Args:
+            name: Name of the stage.
+            iterable: Iterable to trace.
+            count: Attribute counting the produced items.
+
+        Yields:
+            The items of the iterable.
+        """
+        span = self.start_span(name, **{count: 0})
+        stack = _active_iterators.__dict__.setdefault("stack", [])
+        iterator = iter(iterable)
+        while True:
+            frame = [0.0]
+            stack.append(frame)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                if stack:
+                    stack[-1][0] += elapsed
+                span.add(elapsed - frame[0])
+            span.add(**{count: 1})
+            yield item
+
+    def recent_traces(self, limit: int = 20, **attributes) -> list[dict]:
+        """
+        Get the most recent finished traces.
+
+        Args:
+            limit: Maximum number of traces to return.
+            **attributes: Only return the traces with these root attributes (e.g. session).
+
+        Returns:
+            List of traces, newest first.
+        """
+        with self._lock:
+            traces = list(self._traces)[::-1]
+        return [
+            trace
+            for trace in traces
+            if all(trace["attributes"].get(k) == v for k, v in attributes.items())
+        ][:limit]
+
+    def prometheus_text(self) -> str:
+        """
+        Render the stage histograms and count totals in the Prometheus text format.
+
+        Returns:
+            The metrics exposition.
+        """
+        lines = [
+            "# HELP rag_stage_duration_seconds Duration of the pipeline stages.",
+            "# TYPE rag_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage, (counts, total, n) in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {n}'
+                )
+                lines.append(
+                    f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {total}'
+                )
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {n}')
+            lines += [
+                "# HELP rag_stage_count_total Counts (tokens, items, ...) reported by the pipeline stages.",
+                "# TYPE rag_stage_count_total counter",
+            ]
+            for (stage, key), value in sorted(self._totals.items()):
+                lines.append(
+                    f'rag_stage_count_total{{stage="{stage}",name="{key}"}} {value:g}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self) -> None:
+        """
+        Atomically write the metrics exposition to the metrics file, e.g. for a textfile collector.
+        """
+        if not self.metrics_path:
+            return
+        os.makedirs(os.path.dirname(self.metrics_path) or ".", exist_ok=True)
+        temp_path = f"{self.metrics_path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, self.metrics_path)
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> None:
+        """
+        Serve the metrics exposition over HTTP on a background thread.
+
+        Args:
+            port: Port to listen on.
+            host: Interface to listen on.
+        """
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = tracer.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(
+            target=self._server.serve_forever, name="metrics-server", daemon=True
+        ).start()
+
+    def _finish(self, trace: Trace) -> None:
+        record = trace.to_dict()
+        self._observe(trace.root)
+        for span in list(trace.spans):
+            self._observe(span)
+        with self._lock:
+            self._traces.append(record)
+            write_metrics = time.monotonic() - self._metrics_written >= (
+                self.metrics_interval
+            )
+            if write_metrics:
+                self._metrics_written = time.monotonic()
+        try:
+            if self.log_path:
+                self._get_log().info(json.dumps(record, default=str))
+            if write_metrics:
+                self.write_metrics()
+        except Exception as e:
+            logging.warning(f"Error exporting trace: {str(e)}")
+
+    def _observe(self, span: Span) -> None:
+        with span._lock:
+            duration, attributes = span.duration, dict(span.attributes)
+        with self._lock:
+            counts, total, n = self._histograms.get(
+                span.name, ([0] * len(self.buckets), 0.0, 0)
+            )
+            index = bisect.bisect_left(self.buckets, duration)
+            if index < len(counts):
+                counts[index] += 1
+            self._histograms[span.name] = [counts, total + duration, n + 1]
+            for key, value in attributes.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self._totals[(span.name, key)] += value
+
+    def _get_log(self) -> logging.Logger:
+        if self._log is None:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(
+                self.log_path,
+                maxBytes=self.max_log_bytes,
+                backupCount=self.log_backups,
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            log = logging.getLogger(f"{__name__}.{id(self)}")
+            log.setLevel(logging.INFO)
+            log.propagate = False
+            log.addHandler(handler)
+            self._log = log
+        return self._log
+
+
+tracer = Tracer(
+    TRACE_LOG_PATH,
+    METRICS_PATH,
+    max_log_bytes=TRACE_LOG_MAX_BYTES,
+    metrics_interval=METRICS_WRITE_INTERVAL,
+)
@@ -0,0 +1,64 @@
+import logging
+import os
+import threading
+from typing import Optional
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from src.tracing import tracer
+
+# Environment variables the credentials fall back to, as in the authentication form
+CREDENTIAL_ENV_VARS = {
+    "openai_api_key": "OPENAI_API_KEY",
+    "activeloop_token": "ACTIVELOOP_TOKEN",
+    "activeloop_org_id": "ACTIVELOOP_ORG_ID",
+    "cohere_api_key": "COHERE_API_KEY",
+    "apify_api_token": "APIFY_API_TOKEN",
+}
+
+
+def env_credentials() -> Optional[dict[str, str]]:
+    """
+    Read the credentials from the environment.
+
+    Returns:
+        The credentials, or None if any of them is missing.
+    """
+    credentials = {key: os.environ.get(var) for key, var in CREDENTIAL_ENV_VARS.items()}
+    return credentials if all(credentials.values()) else None
+
+
+def start_warmup(credentials: Optional[dict[str, str]] = None) -> threading.Thread:
+    """
+    Warm the process up on a background thread while the first page is being served.
+
+    The heavy modules (LangChain, DeepLake, the API clients) are imported, and with credentials
+    the shared resources (embeddings client, dataset handle, chain) are built through the same
+    cached loaders the sessions use, so the first authenticated run finds them ready or waits for
+    the build in progress instead of starting another one. Call it from a script run, whose
+    context the thread needs to use the cache.
+
+    Args:
+        credentials: Credentials to build the shared resources with, or None to only import.
+
+    Returns:
+        The warm-up thread.
+    """
+
+    def warm_up():
+        try:
+            with tracer.trace("warmup", resources=credentials is not None):
+                with tracer.span("warmup.import"):
+                    from src.db_router import DBRouter  # noqa: F401
+                    from src.generator import Generator
+                if credentials is not None:
+                    with tracer.span("warmup.resources"):
+                        Generator(credentials)
+        except Exception as e:
+            logging.warning(f"Error warming up: {str(e)}")
+
+    thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+    # Streamlit only reads and writes its resource cache from threads with a script run context
+    add_script_run_ctx(thread, get_script_run_ctx())
+    thread.start()
+    return thread
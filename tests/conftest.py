@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+import src.consts
+from src.tracing import tracer
+
+
+def _cache_paths(cache_dir):
+    """Map the path constants under the cache directory to the same paths under `cache_dir`."""
+    root = src.consts.CACHE_DIR
+    paths = {"CACHE_DIR": str(cache_dir)}
+    for name, value in vars(src.consts).items():
+        if name.endswith("_PATH") and isinstance(value, str):
+            if os.path.commonpath([root, value]) == os.path.normpath(root):
+                paths[name] = str(cache_dir / os.path.relpath(value, root))
+    return paths
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """
+    Keep the caches, job and refresh databases, traces and metrics of every test in its own
+    temporary directory instead of the working tree.
+
+    The constants are imported by value, so they are replaced in every loaded module of the app,
+    and the process-wide tracer opens its log again under the temporary directory.
+    """
+    cache_dir = tmp_path / "cache"
+    paths = _cache_paths(cache_dir)
+    for module_name, module in list(sys.modules.items()):
+        if module_name == "src" or module_name.startswith("src."):
+            for name, path in paths.items():
+                if hasattr(module, name):
+                    monkeypatch.setattr(module, name, path)
+    monkeypatch.setattr(tracer, "log_path", paths["TRACE_LOG_PATH"])
+    monkeypatch.setattr(tracer, "metrics_path", paths["METRICS_PATH"])
+    monkeypatch.setattr(tracer, "_log", None)
+
+    yield cache_dir
+
+    if tracer._log is not None:
+        for handler in list(tracer._log.handlers):
+            tracer._log.removeHandler(handler)
+            handler.close()
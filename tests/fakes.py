@@ -0,0 +1,432 @@
+"""
+Local stand-ins for the external services, so DBRouter and Generator can run offline.
+"""
+
+import asyncio
+import hashlib
+import random
+import re
+import time
+import uuid
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+import deeplake
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.callbacks.manager import Callbacks
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.vectorstores import VectorStore
+
+import src.consts
+from src.chunker import TokenChunker
+from src.collection_router import collection_path
+from src.db_router import DBRouter
+from src.freshness import PageCheck, RefreshScheduler
+from src.rerankers import LexicalReranker
+from src.source_index import chunk_hash
+
+WORDS = (
+    "pump valve sensor pressure flow firmware calibration controller gateway network "
+    "temperature threshold warning operator manual schedule maintenance reset install "
+    "configure update release version error timeout latency throughput battery motor "
+    "bearing filter cartridge seal gasket torque voltage current relay fuse cable"
+).split()
+
+
+# Prefix of the fake dataset IDs of page crawls
+PAGES_PREFIX = "pages:"
+
+
+class WordEncoding:
+    """
+    Whitespace tokenizer standing in for tiktoken on machines without its cached encodings.
+    """
+
+    def encode(self, text: str) -> list[str]:
+        return text.split(" ")
+
+    def decode(self, tokens: list[str]) -> str:
+        return " ".join(tokens)
+
+
+def page_source(url: str, index: int) -> str:
+    """
+    Source URL of a page of a crawl; the first page is the URL itself.
+    """
+    return url if index == 0 else f"{url.rstrip('/')}/page-{index}"
+
+
+def make_page(
+    url: str,
+    index: int,
+    sections: int = 4,
+    words: Sequence[str] = WORDS,
+    revision: int = 0,
+) -> Document:
+    """
+    Deterministic page of markdown-like text.
+
+    Args:
+        url: URL of the crawl.
+        index: Index of the page in the crawl; the first page is the URL itself.
+        sections: Number of sections of the page.
+        words: Vocabulary of the page.
+        revision: Revision of the page; only the last section changes between revisions.
+
+    Returns:
+        The page.
+    """
+    source = page_source(url, index)
+    rng = random.Random(source)
+    text = "\n\n".join(
+        f"## Section {s}\n\n"
+        + "\n\n".join(
+            " ".join(rng.choices(words, k=rng.randint(20, 120))) + "."
+            for _ in range(rng.randint(1, 4))
+        )
+        for s in range(sections)
+    )
+    if revision:
+        rng = random.Random(f"{source}#{revision}")
+        text += f"\n\n## Revision {revision}\n\n" + " ".join(
+            rng.choices(words, k=rng.randint(20, 120))
+        )
+    return Document(page_content=text, metadata={"source": source, "title": source})
+
+
+class FakeCrawlerDBRouter(DBRouter):
+    """
+    DBRouter whose crawler returns deterministic pages after a configurable latency.
+
+    Pages are edited by bumping their revision in `revisions`, removed by adding them to `gone`,
+    crawls of the URLs in `unreachable` fail, and `fetch_page` stands in for the conditional
+    requests of the refresh scheduler attached to the router, with the revision as ETag.
+    `pages_crawled` counts the pages returned by the crawler.
+    """
+
+    def __init__(
+        self,
+        *args,
+        pages_per_url: int = 10,
+        crawl_latency: float = 0.0,
+        encoding: Any = None,
+        words: Sequence[str] = WORDS,
+        freshness_path: Optional[str] = None,
+        gone_checks: int = 3,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.pages_per_url = pages_per_url
+        self.crawl_latency = crawl_latency
+        self.words = words
+        self.revisions: dict[str, int] = {}
+        self.gone: set[str] = set()
+        self.unreachable: set[str] = set()
+        self.pages_crawled = 0
+        self.attach_refresh_scheduler(
+            RefreshScheduler(
+                self,
+                freshness_path
+                or collection_path(src.consts.FRESHNESS_DB_PATH, self.collection),
+                {},
+                gone_checks=gone_checks,
+                fetch=self.fetch_page,
+            )
+        )
+        if encoding is not None:
+            self.chunker = TokenChunker(
+                chunk_tokens=self.chunker.chunk_tokens,
+                overlap_tokens=self.chunker.overlap_tokens,
+                encoding=encoding,
+                max_workers=self.chunker.max_workers,
+            )
+
+    def fetch_page(
+        self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None
+    ) -> PageCheck:
+        if url in self.gone:
+            return PageCheck("gone", error="HTTP 404")
+        revision = f'"{self.revisions.get(url, 0)}"'
+        if etag == revision:
+            return PageCheck("not_modified", etag=revision)
+        content = make_page(
+            url, 0, words=self.words, revision=self.revisions.get(url, 0)
+        )
+        return PageCheck(
+            "fetched", etag=revision, content_hash=chunk_hash(content.page_content)
+        )
+
+    def _run_crawler(self, url: str, credentials: dict[str, str]) -> str:
+        time.sleep(self.crawl_latency)
+        if url in self.unreachable:
+            raise ConnectionError(f"{url} is unreachable")
+        return url
+
+    def _run_page_crawler(self, urls: list[str], credentials: dict[str, str]) -> str:
+        time.sleep(self.crawl_latency)
+        return "\n".join(PAGES_PREFIX + url for url in urls)
+
+    def _iter_dataset_pages(
+        self, dataset_id: str, credentials: dict[str, str]
+    ) -> Iterator[Document]:
+        if dataset_id.startswith(PAGES_PREFIX):
+            sources = [url[len(PAGES_PREFIX) :] for url in dataset_id.split("\n")]
+        else:
+            sources = [page_source(dataset_id, i) for i in range(self.pages_per_url)]
+        for source in sources:
+            if source in self.gone:
+                continue
+            self.pages_crawled += 1
+            yield make_page(
+                source, 0, words=self.words, revision=self.revisions.get(source, 0)
+            )
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic embeddings hashing the words of a text into a fixed number of signed buckets.
+
+    Texts sharing words get similar vectors, so retrieval and the caches behave realistically.
+    """
+
+    def __init__(self, size: int = 256, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.latency)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+    def _embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = int.from_bytes(
+                hashlib.blake2b(word.encode()).digest()[:8], "little"
+            )
+            vector[digest % self.size] += 1 if digest >> 63 else -1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+class FakeReranker(LexicalReranker):
+    """
+    Lexical reranker with the latency of a remote reranking API.
+    """
+
+    latency: float = 0.0
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        time.sleep(self.latency)
+        return super().compress_documents(documents, query, callbacks)
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        await asyncio.sleep(self.latency)
+        return super().compress_documents(documents, query, callbacks)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering with the last words of the prompt, streamed token by token.
+    """
+
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+    answer_tokens: int = 20
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _tokens(self, messages: list[BaseMessage]) -> list[str]:
+        words = messages[-1].content.split()[-self.answer_tokens :]
+        return [f"{word} " for word in words]
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.first_token_latency)
+        tokens = self._tokens(messages)
+        for token in tokens:
+            time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))]
+        )
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.first_token_latency)
+        tokens = self._tokens(messages)
+        for token in tokens:
+            await asyncio.sleep(self.token_latency)
+            if run_manager:
+                await run_manager.on_llm_new_token(token)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))]
+        )
+
+
+class LocalVectorStore:
+    """
+    The subset of DeepLake's `VectorStore` used by the app, over a local dataset without the
+    managed-service lookups the real one does on load.
+    """
+
+    def __init__(self, path: str):
+        self.dataset = deeplake.empty(path, overwrite=True, verbose=False)
+        with self.dataset:
+            self.dataset.create_tensor("text", htype="text")
+            self.dataset.create_tensor("metadata", htype="json")
+            self.dataset.create_tensor("embedding", htype="embedding", dtype=np.float32)
+            self.dataset.create_tensor("id", htype="text")
+
+    def add(
+        self,
+        text: list[str],
+        metadata: list[dict],
+        embedding: list[list[float]],
+        return_ids: bool = False,
+        id: Optional[list[str]] = None,
+    ) -> Optional[list[str]]:
+        ids = id if id is not None else [str(uuid.uuid4()) for _ in text]
+        with self.dataset:
+            self.dataset.text.extend(text)
+            self.dataset.metadata.extend(metadata)
+            self.dataset.embedding.extend(np.asarray(embedding, dtype=np.float32))
+            self.dataset.id.extend(ids)
+        return ids if return_ids else None
+
+    def delete(
+        self,
+        row_ids: Optional[list[int]] = None,
+        ids: Optional[list[str]] = None,
+        filter: Optional[dict] = None,
+        delete_all: Optional[bool] = None,
+    ) -> bool:
+        if not (row_ids or ids or filter or delete_all):
+            # As DeepLake's VectorStore does, an empty selection is an error
+            raise ValueError(
+                "Either ids, row_ids, filter, query, or select_all must be specified."
+            )
+        if delete_all:
+            row_ids = list(range(len(self.dataset)))
+        elif not row_ids:
+            wanted = set(ids or [])
+            source = (filter or {}).get("metadata", {}).get("source")
+            row_ids = [
+                row
+                for row, (doc_id, metadata) in enumerate(
+                    zip(
+                        self.dataset.id.data(aslist=True)["value"],
+                        self.dataset.metadata.data()["value"],
+                    )
+                )
+                if doc_id in wanted or (source and metadata.get("source") == source)
+            ]
+        if row_ids:
+            self.dataset.pop(sorted(row_ids))
+        return True
+
+    def search(self, embedding: list[float], k: int = 4) -> list[int]:
+        if not len(self.dataset):
+            return []
+        scores = self.dataset.embedding.numpy() @ np.asarray(embedding, np.float32)
+        return [int(row) for row in np.argsort(-scores)[:k]]
+
+
+class LocalDeepLake(VectorStore):
+    """
+    Stand-in for the LangChain DeepLake vector store over a local dataset.
+    """
+
+    def __init__(self, path: str, embedding_function: Embeddings):
+        self.vectorstore = LocalVectorStore(path)
+        self._embedding_function = embedding_function
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    def ds(self):
+        return self.vectorstore.dataset
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[list[dict]] = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts = list(texts)
+        return self.vectorstore.add(
+            text=texts,
+            metadata=metadatas or [{} for _ in texts],
+            embedding=self.embeddings.embed_documents(texts),
+            return_ids=True,
+        )
+
+    def delete(self, ids: Optional[list[str]] = None, **kwargs: Any) -> bool:
+        return self.vectorstore.delete(ids=ids, filter=kwargs.get("filter"))
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        rows = self.vectorstore.search(self.embeddings.embed_query(query), k)
+        dataset = self.vectorstore.dataset
+        return [
+            Document(
+                page_content=dataset.text[row].data()["value"],
+                metadata=dataset.metadata[row].data()["value"],
+            )
+            for row in rows
+        ]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: Optional[list[dict]] = None,
+        **kwargs: Any,
+    ) -> "LocalDeepLake":
+        db = cls(kwargs.get("dataset_path", "mem://local"), embedding)
+        db.add_texts(texts, metadatas)
+        return db
@@ -0,0 +1,48 @@
+import time
+
+from langchain.docstore.document import Document
+
+from src.answer_cache import SemanticAnswerCache
+
+docs = [Document(page_content="content", metadata={"source": "https://a"})]
+
+
+def test_lookup_hits_similar_questions_only():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store([1.0, 0.0], "answer", docs)
+
+    assert cache.lookup([0.99, 0.05])["answer"] == "answer"
+    assert cache.lookup([0.0, 1.0]) is None
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_entries_expire_and_are_evicted_in_lru_order():
+    cache = SemanticAnswerCache(ttl=0.01, max_entries=1)
+    cache.store([1.0, 0.0], "first", docs)
+    cache.store([0.0, 1.0], "second", docs)
+    assert cache.lookup([1.0, 0.0]) is None
+    assert cache.lookup([0.0, 1.0])["answer"] == "second"
+
+    time.sleep(0.02)
+    assert cache.lookup([0.0, 1.0]) is None
+
+
+def test_entries_are_invalidated_per_source():
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], "answer", docs)
+
+    cache.on_documents_deleted({"https://b": ["1"]})
+    assert cache.stats["size"] == 1
+
+    cache.on_documents_added(docs, ["2"], [[0.0, 1.0]])
+    assert cache.stats["size"] == 0
+
+
+def test_answers_are_only_reused_for_the_same_collections():
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], "from a", docs, frozenset({"a"}))
+    cache.store([1.0, 0.0], "from a and b", docs, frozenset({"a", "b"}))
+
+    assert cache.lookup([1.0, 0.0], frozenset({"a"}))["answer"] == "from a"
+    assert cache.lookup([1.0, 0.0], frozenset({"b", "a"}))["answer"] == "from a and b"
+    assert cache.lookup([1.0, 0.0], frozenset({"b"})) is None
@@ -0,0 +1,68 @@
+import io
+import sys
+import wave
+
+import numpy as np
+
+from src.audio import TranscriptionCache, _can_compress, audio_hash, prepare_audio
+
+
+def _stereo_wav(seconds: float = 2, rate: int = 44100, frequency: float = 440) -> bytes:
+    t = np.arange(int(seconds * rate)) / rate
+    tone = (np.sin(2 * np.pi * frequency * t) * 0.5 * 32767).astype(np.int16)
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.repeat(tone, 2).tobytes())
+    return output.getvalue()
+
+
+def test_prepare_audio_downmixes_and_resamples():
+    original = _stereo_wav()
+
+    payload, file_name = prepare_audio(original, 16000, compression=None)
+
+    assert file_name == "audio.wav"
+    assert len(payload) < len(original) / 5
+    with wave.open(io.BytesIO(payload), "rb") as wav:
+        assert (wav.getnchannels(), wav.getframerate()) == (1, 16000)
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+    spectrum = np.abs(np.fft.rfft(samples))
+    assert abs(np.argmax(spectrum) * 16000 / len(samples) - 440) < 2
+
+
+def test_transcription_cache_is_lru():
+    cache = TranscriptionCache(max_entries=1)
+    first, second = audio_hash(b"a"), audio_hash(b"b")
+
+    cache.put(first, "hello")
+    assert cache.get(first) == "hello"
+    cache.put(second, "world")
+    assert cache.get(first) is None
+    assert cache.get(second) == "world"
+
+
+def test_unreadable_recordings_are_sent_as_they_are():
+    for payload in (b"", b"RIFF", b"not a wav recording"):
+        assert prepare_audio(payload, compression=None) == (payload, "audio.wav")
+
+    # A recording cut off mid-frame still converts
+    payload, _ = prepare_audio(_stereo_wav()[:1001], compression=None)
+    with wave.open(io.BytesIO(payload), "rb") as wav:
+        assert wav.getnchannels() == 1
+
+
+def test_missing_codec_falls_back_to_wav_with_one_warning(monkeypatch, caplog):
+    # Importing a module set to None in sys.modules raises ImportError
+    monkeypatch.setitem(sys.modules, "soundfile", None)
+    _can_compress.cache_clear()
+    try:
+        for _ in range(2):
+            _, file_name = prepare_audio(_stereo_wav(0.1), compression="flac")
+            assert file_name == "audio.wav"
+    finally:
+        _can_compress.cache_clear()
+
+    assert len([r for r in caplog.records if "soundfile" in r.getMessage()]) == 1
@@ -0,0 +1,59 @@
+from langchain.docstore.document import Document
+
+from src.chunker import TokenChunker
+
+
+class _WordEncoding:
+    def encode(self, text):
+        return text.split(" ")
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+def _chunker(**kwargs):
+    return TokenChunker(encoding=_WordEncoding(), **kwargs)
+
+
+def test_chunks_respect_token_budget_and_overlap():
+    chunker = _chunker(chunk_tokens=10, overlap_tokens=2, min_tokens=0)
+    text = "\n\n".join(f"p{i} a b c d" for i in range(6))
+
+    chunks = chunker.split_text(text)
+
+    assert all(len(chunk.split(" ")) <= 10 for chunk in chunks)
+    assert len(chunks) > 1
+    for first, second in zip(chunks, chunks[1:]):
+        assert first.endswith(second.split("\n\n")[0])
+
+
+def test_headings_start_new_chunks():
+    chunker = _chunker(chunk_tokens=50, overlap_tokens=0, min_tokens=3)
+    text = "# Intro\n\nhello there friend\n\n# Details\n\nmore words here\n\n# End"
+
+    assert chunker.split_text(text) == [
+        "# Intro\n\nhello there friend",
+        "# Details\n\nmore words here\n\n# End",
+    ]
+
+
+def test_long_paragraphs_are_split_by_sentences_and_tokens():
+    chunker = _chunker(chunk_tokens=6, overlap_tokens=1, min_tokens=0)
+    chunks = chunker.split_text("one two three. " + " ".join(["w"] * 20))
+
+    assert chunks[0].startswith("one two three.")
+    assert all(len(chunk.split(" ")) <= 6 for chunk in chunks)
+
+
+def test_iter_chunks_in_process_pool_keeps_order():
+    chunker = _chunker(
+        chunk_tokens=4, max_workers=2, parallel_threshold=2, pages_per_task=3
+    )
+    pages = [
+        Document(page_content=f"page {i} words here", metadata={"source": str(i)})
+        for i in range(20)
+    ]
+
+    chunks = list(chunker.iter_chunks(iter(pages)))
+
+    assert [chunk.metadata["source"] for chunk in chunks] == [str(i) for i in range(20)]
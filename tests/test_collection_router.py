@@ -0,0 +1,130 @@
+import asyncio
+
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+from langchain_core.retrievers import BaseRetriever
+
+from tests.fakes import (
+    WORDS,
+    FakeCrawlerDBRouter,
+    HashEmbeddings,
+    LocalDeepLake,
+    WordEncoding,
+)
+from src.collection_router import (
+    CollectionCentroid,
+    CollectionRouter,
+    MultiCollectionRetriever,
+    collection_path,
+)
+
+
+class ListRetriever(BaseRetriever):
+    docs: list[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.docs
+
+
+def _docs(prefix, n):
+    return [Document(f"{prefix}{i}", metadata={"source": prefix}) for i in range(n)]
+
+
+def test_collection_path():
+    assert collection_path("/data/jobs.sqlite3", "default") == "/data/jobs.sqlite3"
+    assert collection_path("/data/jobs.sqlite3", "hr") == "/data/jobs_hr.sqlite3"
+    assert collection_path("docs", "hr") == "docs_hr"
+
+
+def test_centroid_incremental_matches_rebuild(tmp_path):
+    embeddings = HashEmbeddings()
+    db = LocalDeepLake(str(tmp_path), embeddings)
+    centroid = CollectionCentroid(db.ds(), block_size=2)
+    assert centroid.vector is None
+
+    texts = [" ".join(WORDS[i : i + 5]) for i in range(5)]
+    vectors = embeddings.embed_documents(texts)
+    db.vectorstore.add(
+        text=texts,
+        metadata=[{}] * len(texts),
+        embedding=vectors,
+    )
+    centroid.on_documents_added([], [], vectors)
+    incremental = centroid.vector
+
+    centroid.rebuild()
+    assert len(centroid) == 5
+    assert np.allclose(centroid.vector, incremental, atol=1e-5)
+
+
+def test_router_picks_closest_collections():
+    embeddings = HashEmbeddings()
+    centroids = {}
+    for i, name in enumerate(["a", "b", "c"]):
+        centroid = CollectionCentroid(ds=[])
+        centroid.on_documents_added(
+            [], [], embeddings.embed_documents([" ".join(WORDS[i::3])])
+        )
+        centroids[name] = centroid
+    centroids["empty"] = CollectionCentroid(ds=[])
+
+    query = embeddings.embed_query(" ".join(WORDS[1::3][:6]))
+    assert CollectionRouter(centroids, max_collections=2, margin=0.0).route(query) == [
+        "b"
+    ]
+    assert len(CollectionRouter(centroids, margin=1.0).route(query)) == 2
+    assert CollectionRouter({"empty": centroids["empty"]}).route(query) == []
+
+
+def test_retriever_merges_selected_collections():
+    retriever = MultiCollectionRetriever(
+        retrievers={
+            "a": ListRetriever(docs=_docs("a", 3)),
+            "b": ListRetriever(docs=_docs("b", 1)),
+            "c": ListRetriever(docs=_docs("c", 2)),
+        },
+        router=CollectionRouter({}),
+        embeddings=HashEmbeddings(),
+    )
+
+    docs = asyncio.run(retriever.aretrieve("q", collections=["a", "b", "missing"]))
+
+    assert [doc.page_content for doc in docs] == ["a0", "b0", "a1", "a2"]
+    assert [doc.metadata["collection"] for doc in docs] == ["a", "b", "a", "a"]
+    # The retrievers' documents are left untagged
+    assert "collection" not in retriever.retrievers["a"].docs[0].metadata
+
+
+def test_centroid_follows_deletes_and_is_persisted(tmp_path, monkeypatch):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    path = str(tmp_path / "centroid.npz")
+    centroid = CollectionCentroid(db.ds(), path)
+    assert not centroid.load()
+    router = FakeCrawlerDBRouter(db, pages_per_url=1, encoding=WordEncoding())
+    router.add_listener(centroid)
+    router.add_document_by_url("https://a", {})
+    router.add_document_by_url("https://b", {})
+
+    ds = db.ds()
+    with monkeypatch.context() as patch:
+        # Deletes do not rescan the dataset
+        patch.setattr(centroid, "rebuild", lambda: pytest.fail("rescanned"))
+        router.delete_documents_by_urls(["https://a"])
+
+    expected = CollectionCentroid(ds)
+    expected.rebuild()
+    assert len(centroid) == len(expected) == len(ds) > 0
+    assert np.allclose(centroid.vector, expected.vector, atol=1e-5)
+
+    reloaded = CollectionCentroid(ds, path)
+    assert reloaded.load()
+    assert np.allclose(reloaded.vector, expected.vector, atol=1e-5)
+
+    router.delete_documents_by_urls(["https://b"])
+    assert centroid.vector is None
+    # A saved centroid that does not match the dataset is not loaded
+    db.vectorstore.add(
+        text=["x"], metadata=[{}], embedding=HashEmbeddings().embed_documents(["x"])
+    )
+    assert not CollectionCentroid(ds, path).load()
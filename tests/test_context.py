@@ -0,0 +1,70 @@
+from langchain.retrievers import ContextualCompressionRetriever
+from langchain.retrievers.document_compressors import DocumentCompressorPipeline
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from src.context import ContextAssembler
+from src.source_index import chunk_hash
+
+
+class _WordEncoding:
+    def encode(self, text):
+        return text.split(" ")
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+class _StaticRetriever(BaseRetriever):
+    documents: list[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return [
+            Document(doc.page_content, metadata=dict(doc.metadata))
+            for doc in self.documents
+        ]
+
+
+def _doc(text, source="a", score=0.5):
+    return Document(text, metadata={"source": source, "relevance_score": score})
+
+
+def test_merges_overlapping_chunks_of_same_source():
+    assembler = ContextAssembler(encoding=_WordEncoding())
+    first, second = "one two three four five", "four five six seven"
+
+    [merged, other] = assembler.compress_documents(
+        [_doc(second, score=0.9), _doc("four five six", source="b"), _doc(first)], "q"
+    )
+
+    assert merged.page_content == "one two three four five six seven"
+    assert merged.metadata["relevance_score"] == 0.9
+    assert merged.metadata["chunk_hashes"] == [chunk_hash(first), chunk_hash(second)]
+    assert other.metadata["source"] == "b"
+
+
+def test_dedups_and_packs_to_budget():
+    assembler = ContextAssembler(max_tokens=6, encoding=_WordEncoding())
+    text = "alpha beta gamma delta"
+
+    assembled = assembler.compress_documents(
+        [_doc(text, "a"), _doc(text + "!", "b"), _doc("epsilon zeta eta theta", "c")],
+        "q",
+    )
+
+    assert [doc.page_content for doc in assembled] == [text, "epsilon zeta"]
+    assert assembler.stats == {"tokens_in": 12, "tokens_out": 6, "tokens_saved": 6}
+
+
+def test_stats_follow_copies_in_a_pipeline():
+    assembler = ContextAssembler(max_tokens=3, encoding=_WordEncoding())
+    retriever = ContextualCompressionRetriever(
+        base_compressor=DocumentCompressorPipeline(transformers=[assembler]),
+        base_retriever=_StaticRetriever(documents=[_doc("one two three four")]),
+    )
+
+    assert [doc.page_content for doc in retriever.invoke("q")] == ["one two three"]
+    # Deep copies, as made when a chain is configured, count into the same statistics
+    retriever.copy(deep=True).invoke("q")
+
+    assert assembler.stats == {"tokens_in": 8, "tokens_out": 6, "tokens_saved": 2}
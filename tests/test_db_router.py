@@ -1,30 +1,439 @@
-from src.generator import Generator
+import threading
+import time
+from collections import Counter
+
+import pytest
+from langchain.docstore.document import Document
+
+from tests.fakes import (
+    FakeCrawlerDBRouter,
+    HashEmbeddings,
+    LocalDeepLake,
+    WordEncoding,
+    make_page,
+)
+import src.db_router
 from src.db_router import DBRouter
+from src.listeners import DocumentListener
+from src.source_index import chunk_hash
+
 
+url = "https://docs.example.com/guide"
 
-db_router = DBRouter(Generator().db)
-url = "https://www.espn.com/soccer/report/_/gameId/690575"
 
+@pytest.fixture(scope="module")
+def db_router(tmp_path_factory):
+    path = tmp_path_factory.mktemp("db_router")
+    db = LocalDeepLake(str(path / "ds"), HashEmbeddings())
+    # Built before the per-test cache directory, so the router gets its own paths
+    return FakeCrawlerDBRouter(
+        db,
+        pages_per_url=3,
+        encoding=WordEncoding(),
+        jobs_path=str(path / "jobs.sqlite3"),
+        freshness_path=str(path / "freshness.sqlite3"),
+    )
 
-def test_get_all_documents_metadata():
+
+def test_get_all_documents_metadata(db_router):
     metadata = db_router.get_all_documents_metadata
     assert len(metadata) >= 0
 
 
-def test_add_document_by_url():
-    ids = db_router.add_document_by_url(url)
-    assert len(ids) >= 0
+def test_add_document_by_url(db_router):
+    ids = db_router.add_document_by_url(url, {})
+    assert len(ids) == len(db_router.ds)
 
     metadata = db_router.get_all_documents_metadata
     added_docs = [doc for doc in metadata if doc["source"] == url]
 
     assert len(added_docs) == 1
-    assert added_docs[0]["count"] == 3
+    assert added_docs[0]["count"] == len(
+        db_router.chunker.split_document(make_page(url, 0))
+    )
 
 
-def test_delete_documents_by_url():
+def test_delete_documents_by_url(db_router):
     assert db_router.delete_documents_by_url(url) == True
 
     metadata = db_router.get_all_documents_metadata
     deleted_docs = [doc for doc in metadata if doc["source"] == url]
     assert len(deleted_docs) == 0
+    assert len(db_router.ds) == sum(doc["count"] for doc in metadata)
+
+
+class EventListener(DocumentListener):
+    def __init__(self):
+        self.events = []
+
+    def on_documents_added(self, docs, ids, embeddings):
+        self.events.append("added")
+
+    def on_documents_deleted(self, ids_by_source):
+        self.events.append("deleted")
+
+    def flush(self):
+        self.events.append("flushed")
+
+
+def _hashes(router, page):
+    return Counter(
+        chunk_hash(doc.page_content) for doc in router.chunker.split_document(page)
+    )
+
+
+def test_refresh_diffs_every_stored_page_under_the_url(tmp_path):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(db, pages_per_url=3, encoding=WordEncoding())
+    router.add_document_by_url(url, {})
+    listener = EventListener()
+    router.add_listener(listener)
+
+    router.revisions[f"{url}/page-1"] = 1
+    router.gone.add(f"{url}/page-2")
+    counts = router.refresh_document_by_url(url, {})
+
+    old = _hashes(router, make_page(url, 1))
+    new = _hashes(router, make_page(url, 1, revision=1))
+    unchanged = sum(_hashes(router, make_page(url, 0)).values())
+    kept = sum((old & new).values())
+    assert counts == {
+        "kept": unchanged + kept,
+        "added": sum(new.values()) - kept,
+        # The page the crawl no longer returns is removed along with the changed chunks
+        "removed": sum((old - new).values())
+        + sum(_hashes(router, make_page(url, 2)).values()),
+    }
+    assert [doc["source"] for doc in router.get_all_documents_metadata] == [
+        url,
+        f"{url}/page-1",
+    ]
+    assert len(router.ds) == unchanged + sum(new.values())
+    # New chunks are written before the stale ones are deleted, each step is flushed
+    assert listener.events == ["added", "flushed", "deleted", "flushed"]
+
+
+def test_refresh_keeps_unchanged_pages_and_other_urls(tmp_path):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(db, pages_per_url=2, encoding=WordEncoding())
+    other = f"{url}-v2"
+    router.add_document_by_url(url, {})
+    router.add_document_by_url(other, {})
+    stored = len(router.ds)
+
+    counts = router.refresh_document_by_url(url, {})
+
+    kept = sum(sum(_hashes(router, make_page(url, i)).values()) for i in range(2))
+    assert counts == {"kept": kept, "added": 0, "removed": 0}
+    assert len(router.ds) == stored
+    assert other in router.source_index.entries
+
+
+def test_add_documents_by_urls_reports_each_url(tmp_path):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(
+        db, pages_per_url=2, encoding=WordEncoding(), batch_size=16
+    )
+    urls = [f"https://site-{i}.example.com" for i in range(4)]
+    router.unreachable.add(urls[1])
+
+    results = router.add_documents_by_urls(urls, {}, max_workers=2)
+
+    assert "unreachable" in results[urls[1]]["error"]
+    assert results[urls[1]]["ids"] == []
+    for url in urls[:1] + urls[2:]:
+        assert results[url]["error"] is None
+        # The IDs of the chunks of each URL are attributed to it across shared batches
+        assert set(results[url]["ids"]) == {
+            doc_id
+            for source in router.source_index.get_sources_under(url)
+            for doc_id in router.source_index.get_ids(source)
+        }
+    assert sum(len(result["ids"]) for result in results.values()) == len(router.ds)
+
+
+def test_submit_documents_by_urls_runs_one_bulk_job(tmp_path, monkeypatch):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(
+        db, pages_per_url=2, encoding=WordEncoding(), batch_size=64
+    )
+    urls = [f"https://site-{i}.example.com" for i in range(3)]
+    router.unreachable.add(urls[0])
+    writes = []
+    write_batch = router._write_batch
+
+    def record_writes(batch, *args):
+        writes.append(len(batch))
+        return write_batch(batch, *args)
+
+    monkeypatch.setattr(router, "_write_batch", record_writes)
+
+    job_id = router.submit_documents_by_urls(urls + urls[:1], {})
+
+    for _ in range(500):
+        (job,) = router.get_jobs({})
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.01)
+    assert job["id"] == job_id
+    assert job["url"].splitlines() == urls
+    # The URL that failed fails the job, once the chunks of the others are written
+    assert job["status"] == "failed"
+    assert urls[0] in job["error"] and "unreachable" in job["error"]
+    assert job["pages_crawled"] == 4
+    assert job["chunks_written"] == len(router.ds) == sum(writes)
+    # The chunks of both URLs share batches
+    assert len(writes) < len(router.get_all_documents_metadata)
+
+
+def test_jobs_are_scoped_to_their_credentials(tmp_path, monkeypatch):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(db, pages_per_url=1, encoding=WordEncoding())
+    crawled_with = []
+    run_crawler = router._run_crawler
+
+    def record_credentials(url, credentials):
+        crawled_with.append(credentials)
+        return run_crawler(url, credentials)
+
+    monkeypatch.setattr(router, "_run_crawler", record_credentials)
+    first, second = {"apify_api_token": "a"}, {"apify_api_token": "b"}
+
+    job_id = router.submit_document_by_url("https://a.example.com", first)
+    for _ in range(500):
+        if router.get_jobs(first)[0]["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.01)
+
+    assert router.get_jobs(first)[0]["id"] == job_id
+    assert router.get_jobs(second) == []
+    assert not router.cancel_job(job_id, second)
+    assert crawled_with == [first]
+
+
+class ConcurrencyEmbeddings(HashEmbeddings):
+    def __init__(self):
+        super().__init__(latency=0.02)
+        self.lock = threading.Lock()
+        self.running = self.max_running = 0
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            return super().embed_documents(texts)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def _docs(count, source="https://docs.example.com/batch"):
+    return [
+        Document(
+            page_content=f"chunk {i} of the batch test", metadata={"source": source}
+        )
+        for i in range(count)
+    ]
+
+
+class BatchListener(DocumentListener):
+    def __init__(self, pulled):
+        self.pulled = pulled
+        self.sizes = []
+        self.pulled_at_first_write = None
+
+    def on_documents_added(self, docs, ids, embeddings):
+        if self.pulled_at_first_write is None:
+            self.pulled_at_first_write = len(self.pulled)
+        self.sizes.append(len(docs))
+
+
+def test_ingest_batches_and_bounds_in_flight_batches(tmp_path):
+    embeddings = ConcurrencyEmbeddings()
+    db = LocalDeepLake(str(tmp_path / "ds"), embeddings)
+    router = FakeCrawlerDBRouter(
+        db, encoding=WordEncoding(), batch_size=4, max_in_flight=2
+    )
+    pulled = []
+    listener = BatchListener(pulled)
+    router.add_listener(listener)
+
+    def chunks():
+        for doc in _docs(22):
+            pulled.append(doc)
+            yield doc
+
+    ids = router._ingest(chunks())
+
+    assert listener.sizes == [4, 4, 4, 4, 4, 2]
+    assert len(ids) == len(router.ds) == 22
+    assert embeddings.max_running == 2
+    # The input is not read ahead of the batches being embedded
+    assert listener.pulled_at_first_write <= 4 * 2
+
+
+def test_ingest_write_errors(tmp_path):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(
+        db, encoding=WordEncoding(), batch_size=4, max_in_flight=2
+    )
+    add = db.vectorstore.add
+    calls = []
+
+    def failing_add(**kwargs):
+        calls.append(len(kwargs["text"]))
+        if len(calls) == 2:
+            raise IOError("storage unavailable")
+        return add(**kwargs)
+
+    db.vectorstore.add = failing_add
+    with pytest.raises(IOError, match="storage unavailable"):
+        router._ingest(_docs(12))
+    # The batch written before the error is durable and indexed
+    assert len(router.ds) == router.source_index.total_count == 4
+
+    calls.clear()
+    reported = []
+    ids = router._ingest(
+        _docs(12, source="https://docs.example.com/other"),
+        on_batch=lambda batch, batch_ids, error: reported.append(
+            (len(batch), len(batch_ids), error)
+        ),
+    )
+    # With a callback, the failed batch is reported and ingestion goes on
+    assert [(size, count) for size, count, _ in reported] == [(4, 4), (4, 0), (4, 4)]
+    assert isinstance(reported[1][2], IOError)
+    assert len(ids) == 8
+    assert len(router.ds) == router.source_index.total_count == 12
+
+
+def test_deleting_stale_ids_only_updates_the_index(tmp_path):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(db, pages_per_url=1, encoding=WordEncoding())
+    router.add_document_by_url(url, {})
+    stale_ids = router.source_index.get_ids(url)
+    # The rows are gone from the dataset, e.g. deleted by another process
+    db.vectorstore.delete(ids=stale_ids)
+    listener = EventListener()
+    router.add_listener(listener)
+
+    assert router.delete_documents_by_urls([url]) == 0
+    assert router.get_all_documents_metadata == []
+    assert len(router.ds) == 0
+    assert listener.events == ["deleted", "flushed"]
+
+    with pytest.raises(ValueError):
+        db.vectorstore.delete(row_ids=[])
+
+
+def test_chunk_texts_follow_writes_and_deletes(tmp_path):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(db, encoding=WordEncoding())
+    first, second = _docs(3), _docs(3, source="https://docs.example.com/other")
+    router._ingest(first)
+    hashes = [chunk_hash(doc.page_content) for doc in first]
+    texts = [doc.page_content for doc in first]
+    assert router.get_chunk_texts(first[0].metadata["source"], hashes) == texts
+
+    # The ID map is extended by writes rather than re-read from the dataset
+    row_ids, row_of = router._rows
+    router._ingest(second)
+    assert router._rows[1] is row_of and len(row_ids) == 6
+    other = second[0].metadata["source"]
+    assert router.get_chunk_texts(other, [chunk_hash(second[1].page_content)]) == [
+        second[1].page_content
+    ]
+
+    router.delete_documents_by_urls([first[0].metadata["source"]])
+    assert router.get_chunk_texts(other, [chunk_hash(second[2].page_content)]) == [
+        second[2].page_content
+    ]
+    assert router.get_chunk_texts(first[0].metadata["source"], hashes) == [None] * 3
+
+
+def test_chunk_texts_are_read_while_a_write_is_in_progress(tmp_path):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(db, encoding=WordEncoding())
+    docs = _docs(3)
+    router._ingest(docs)
+    source, hashes = docs[0].metadata["source"], [chunk_hash(docs[1].page_content)]
+    router.get_chunk_texts(source, hashes)
+
+    locked, release = threading.Event(), threading.Event()
+
+    def write():
+        with router._write_lock:
+            locked.set()
+            release.wait(5)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    locked.wait(1)
+    try:
+        assert router.get_chunk_texts(source, hashes) == [docs[1].page_content]
+    finally:
+        release.set()
+        writer.join()
+
+
+def test_chunk_texts_are_reread_under_the_lock_when_rows_moved(tmp_path):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(db, encoding=WordEncoding())
+    docs = _docs(3)
+    ids = router._ingest(docs)
+    source, hashes = docs[0].metadata["source"], [chunk_hash(docs[2].page_content)]
+    router.get_chunk_texts(source, hashes)
+
+    # Rows deleted behind the map's back leave it pointing past the moved chunks
+    db.vectorstore.delete(ids=ids[:1])
+    assert router._read_texts(ids[2:]) is None
+    assert router.get_chunk_texts(source, hashes) == [docs[2].page_content]
+
+
+class FakeApifyClient:
+    run_inputs = []
+    items = [
+        {
+            "url": "https://a",
+            "metadata": {"title": "A"},
+            "text": "Install\nRun the installer.",
+            "markdown": "# Install\n\nRun the installer.",
+        },
+        {"url": "https://b", "metadata": {"title": "B"}, "text": "Plain text."},
+    ]
+
+    def __init__(self, token):
+        pass
+
+    def actor(self, name):
+        return self
+
+    def call(self, run_input):
+        self.run_inputs.append(run_input)
+        return {"defaultDatasetId": "dataset"}
+
+    def dataset(self, dataset_id):
+        return self
+
+    def iterate_items(self):
+        return iter(self.items)
+
+
+def test_crawled_pages_are_read_as_markdown(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.db_router, "ApifyClient", FakeApifyClient)
+    router = FakeCrawlerDBRouter(
+        LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings()), encoding=WordEncoding()
+    )
+    credentials = {"apify_api_token": "token"}
+
+    dataset_id = DBRouter._run_crawler(router, url, credentials)
+    DBRouter._run_page_crawler(router, [url], credentials)
+    pages = list(DBRouter._iter_dataset_pages(router, dataset_id, credentials))
+
+    assert all(run_input["saveMarkdown"] for run_input in FakeApifyClient.run_inputs)
+    # Pages without Markdown fall back to their text
+    assert [page.page_content for page in pages] == [
+        "# Install\n\nRun the installer.",
+        "Plain text.",
+    ]
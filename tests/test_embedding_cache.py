@@ -0,0 +1,47 @@
+from langchain_community.embeddings import FakeEmbeddings
+
+from src.embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    calls: list = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def test_cached_embeddings_only_embed_new_texts(tmp_path):
+    embeddings = CountingEmbeddings(size=4, calls=[])
+    cached = CachedEmbeddings(
+        embeddings, EmbeddingCache(str(tmp_path / "cache.sqlite3")), "fake"
+    )
+
+    first = cached.embed_documents(["navbar", "page one", "navbar"])
+    second = cached.embed_documents(["navbar", "page two"])
+
+    assert embeddings.calls == [["navbar", "page one"], ["page two"]]
+    assert first[0] == first[2] == second[0]
+    assert cached.hits == 1 and cached.misses == 4
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    cache.put_many({"a": [1.0], "b": [2.0]})
+    cache.get_many(["a"])
+    cache.put_many({"c": [3.0]})
+
+    assert len(cache) == 2
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+
+
+def test_cache_keeps_its_row_count(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path, max_entries=3)
+    cache.put_many({"a": [1.0], "b": [2.0]})
+    cache.put_many({"b": [2.5], "c": [3.0]})
+    assert len(cache) == 3
+
+    cache.put_many({"d": [4.0], "e": [5.0]})
+    assert len(cache) == 3
+    assert len(EmbeddingCache(path, max_entries=3)) == 3
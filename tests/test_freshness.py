@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tests.fakes import (
+    FakeCrawlerDBRouter,
+    HashEmbeddings,
+    LocalDeepLake,
+    WordEncoding,
+)
+from src.freshness import FreshnessStore, fetch_page
+
+url = "https://docs.example.com/manual"
+
+
+@pytest.fixture
+def db_router(tmp_path):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    return FakeCrawlerDBRouter(
+        db, pages_per_url=3, encoding=WordEncoding(), gone_checks=1
+    )
+
+
+def test_only_changed_pages_are_recrawled(db_router):
+    db_router.add_document_by_url(url, {})
+    scheduler = db_router.freshness
+
+    assert scheduler.run_once() == {"checked": 3, "baseline": 3}
+    assert scheduler.run_once() == {"checked": 0}
+
+    db_router.revisions[f"{url}/page-1"] = 1
+    db_router.gone.add(f"{url}/page-2")
+    crawled = db_router.pages_crawled
+    result = scheduler.refresh_now()
+
+    assert db_router.pages_crawled == crawled + 1
+    assert (result["unchanged"], result["changed"], result["gone"]) == (1, 1, 1)
+    assert result["added"] >= 1 and result["removed"] >= 1
+    sources = {metadata["source"] for metadata in db_router.get_all_documents_metadata}
+    assert sources == {url, f"{url}/page-1"}
+    assert scheduler.store.sources() == sources
+    assert scheduler.store.get(f"{url}/page-1")["etag"] == '"1"'
+
+    # The new validators make the next check conditional
+    assert scheduler.refresh_now() == {"checked": 2, "unchanged": 2}
+
+
+def test_set_interval_covers_pages_under_source(db_router):
+    db_router.add_document_by_url(url, {})
+    scheduler = db_router.freshness
+    now = time.time()
+    assert scheduler.run_once(now)["checked"] == 3
+
+    assert scheduler.set_interval(url, 60) == 3
+    assert scheduler.store.summary(now + 59)["due"] == 0
+    assert scheduler.run_once(now + 60)["checked"] == 3
+
+
+def test_pages_are_deleted_once_gone_on_consecutive_checks(tmp_path):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    db_router = FakeCrawlerDBRouter(db, pages_per_url=2, encoding=WordEncoding())
+    db_router.add_document_by_url(url, {})
+    scheduler = db_router.freshness
+    scheduler.run_once()
+    page = f"{url}/page-1"
+
+    db_router.gone.add(page)
+    assert scheduler.refresh_now()["missing"] == 1
+    # A page back in between starts the count over
+    db_router.gone.discard(page)
+    assert scheduler.refresh_now() == {"checked": 2, "unchanged": 2}
+    assert scheduler.store.get(page)["gone_checks"] == 0
+
+    db_router.gone.add(page)
+    assert scheduler.refresh_now()["missing"] == 1
+    assert scheduler.refresh_now()["missing"] == 1
+    assert scheduler.store.get(page)["gone_checks"] == 2
+    assert page in db_router.source_index.get_sources_under(url)
+
+    result = scheduler.refresh_now()
+    assert (result["gone"], result.get("missing", 0)) == (1, 0)
+    assert result["removed"] >= 1
+    assert db_router.source_index.get_sources_under(url) == [url]
+    assert scheduler.store.sources() == {url}
+
+
+def _wait_for_refresh(scheduler):
+    for _ in range(500):
+        if not scheduler.refresh_pending:
+            return scheduler.last_result
+        time.sleep(0.01)
+    raise TimeoutError("Refresh still pending")
+
+
+def test_requested_refresh_runs_in_the_background(db_router):
+    db_router.add_document_by_url(url, {})
+    scheduler = db_router.freshness
+    scheduler.run_once()
+
+    # Without the scheduler thread, the check runs on a thread of its own
+    db_router.revisions[url] = 1
+    scheduler.request_refresh()
+    assert _wait_for_refresh(scheduler)["changed"] == 1
+
+    # With it, the thread is woken up rather than waiting for the poll interval
+    scheduler.start()
+    try:
+        db_router.revisions[url] = 2
+        scheduler.request_refresh([url])
+        result = _wait_for_refresh(scheduler)
+        assert (result["checked"], result["changed"]) == (1, 1)
+    finally:
+        scheduler.stop()
+
+
+def test_pages_tables_of_earlier_versions_are_migrated(tmp_path):
+    path = str(tmp_path / "freshness.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE pages (source TEXT PRIMARY KEY, interval REAL NOT NULL, etag TEXT, "
+            "last_modified TEXT, content_hash TEXT, status TEXT, error TEXT, "
+            "checked_at REAL, changed_at REAL, next_check_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "INSERT INTO pages (source, interval, next_check_at) VALUES (?, 60, 0)",
+            (url,),
+        )
+
+    assert FreshnessStore(path).get(url)["gone_checks"] == 0
+
+
+class ConditionalHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/gone":
+            self.send_response(410)
+            self.end_headers()
+        elif self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            self.wfile.write(b"hello")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_fetch_page_is_conditional():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ConditionalHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        fetched = fetch_page(f"{base}/page")
+        assert (fetched.status, fetched.etag) == ("fetched", '"v1"')
+        assert fetched.content_hash
+
+        assert fetch_page(f"{base}/page", etag='"v1"').status == "not_modified"
+        assert fetch_page(f"{base}/gone").status == "gone"
+    finally:
+        server.shutdown()
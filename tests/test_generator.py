@@ -0,0 +1,95 @@
+import asyncio
+
+from langchain.chains.conversational_retrieval.base import (
+    ConversationalRetrievalChain,
+)
+from langchain.docstore.document import Document
+from langchain.retrievers import ContextualCompressionRetriever
+from langchain.retrievers.document_compressors import DocumentCompressorPipeline
+
+from tests.fakes import (
+    FakeChatModel,
+    FakeReranker,
+    HashEmbeddings,
+    LocalDeepLake,
+    WordEncoding,
+)
+from src.aio import AsyncRunner
+from src.answer_cache import SemanticAnswerCache
+from src.context import ContextAssembler
+from src.generator import Generator, Resources
+from src.sessions import SessionPool
+
+
+def _make_generator(tmp_path, chat_history) -> Generator:
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    context_assembler = ContextAssembler(encoding=WordEncoding())
+    resources = Resources(
+        async_runner=AsyncRunner(),
+        db=db,
+        chat_model=ConversationalRetrievalChain.from_llm(
+            llm=FakeChatModel(),
+            retriever=ContextualCompressionRetriever(
+                base_compressor=DocumentCompressorPipeline(
+                    transformers=[FakeReranker(top_n=3), context_assembler]
+                ),
+                base_retriever=db.as_retriever(),
+            ),
+        ),
+        answer_cache=SemanticAnswerCache(),
+        context_assembler=context_assembler,
+        sessions=SessionPool(),
+    )
+    return Generator({}, resources=resources, chat_history=chat_history)
+
+
+def test_cache_hit_skips_retrieval_and_rerank(tmp_path, monkeypatch):
+    generator = _make_generator(tmp_path, [("What is the pump?", "A pump.")])
+    question = "How do I reset the pump?"
+    embedding = generator.db.embeddings.embed_query(question)
+    docs = [Document(page_content="Hold reset", metadata={"source": "https://a"})]
+    generator.answer_cache.store(embedding, "Hold reset.", docs)
+
+    calls = []
+
+    async def condense(user_input, chat_history, config):
+        return question
+
+    async def retrieve(question):
+        calls.append("retrieve")
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            calls.append("cancelled")
+            raise
+
+    async def rerank(question, documents):
+        calls.append("rerank")
+        return documents
+
+    monkeypatch.setattr(generator, "_acondense_question", condense)
+    monkeypatch.setattr(generator, "_aretrieve", retrieve)
+    monkeypatch.setattr(generator, "_arerank", rerank)
+
+    response = generator.search_db("And how do I reset it?")
+    generator.async_runner.run(asyncio.sleep(0))
+
+    assert response["cached"] and response["answer"] == "Hold reset."
+    assert response["generated_question"] == question
+    # The speculative retrieval on the raw question never finishes, nor is it reranked
+    assert "rerank" not in calls and calls in ([], ["retrieve", "cancelled"])
+
+
+def test_conversation_answers_are_cached(tmp_path, monkeypatch):
+    generator = _make_generator(tmp_path, [("What is the pump?", "A pump.")])
+
+    async def condense(user_input, chat_history, config):
+        return "How do I reset the pump?"
+
+    monkeypatch.setattr(generator, "_acondense_question", condense)
+
+    first = generator.search_db("And how do I reset it?")
+    second = generator.search_db("How can I reset it then?")
+
+    assert not first["cached"] and second["cached"]
+    assert second["answer"] == first["answer"]
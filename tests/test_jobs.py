@@ -0,0 +1,135 @@
+import sqlite3
+import threading
+import time
+
+from src.jobs import JobQueue
+
+
+def _wait_for(queue, job_id, statuses=("succeeded", "failed", "cancelled")):
+    for _ in range(200):
+        job = queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(job)
+
+
+def test_jobs_report_progress_and_dedup_in_flight_urls(tmp_path):
+    release = threading.Event()
+
+    def run_job(job):
+        release.wait(1)
+        job.advance("pages_crawled", 2)
+        job.advance("chunks_written", 5)
+
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), run_job)
+    job_id = queue.submit("https://a")
+    assert queue.submit("https://a") == job_id
+    release.set()
+
+    job = _wait_for(queue, job_id)
+    assert job["status"] == "succeeded"
+    assert (job["pages_crawled"], job["chunks_written"]) == (2, 5)
+    assert queue.submit("https://a") != job_id
+
+
+def test_cancel_and_failure(tmp_path):
+    started = threading.Event()
+
+    def run_job(job):
+        if job.url == "bad":
+            raise RuntimeError("boom")
+        started.set()
+        while True:
+            job.raise_if_cancelled()
+            time.sleep(0.01)
+
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), run_job)
+    job_id = queue.submit("https://a")
+    started.wait(1)
+    assert queue.cancel(job_id)
+    assert _wait_for(queue, job_id)["status"] == "cancelled"
+
+    failed = _wait_for(queue, queue.submit("bad"))
+    assert (failed["status"], failed["error"]) == ("failed", "boom")
+    assert [job["url"] for job in queue.list_jobs()] == ["bad", "https://a"]
+
+
+def test_concurrent_submits_of_a_url_share_one_job(tmp_path):
+    release = threading.Event()
+    runs = []
+
+    def run_job(job):
+        runs.append(job.url)
+        release.wait(1)
+
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), run_job, max_workers=4)
+    start = threading.Barrier(8)
+    job_ids = []
+
+    def submit():
+        start.wait()
+        job_ids.append(queue.submit("https://a"))
+
+    threads = [threading.Thread(target=submit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    release.set()
+
+    assert len(set(job_ids)) == 1
+    assert _wait_for(queue, job_ids[0])["status"] == "succeeded"
+    assert runs == ["https://a"]
+    assert len(queue.list_jobs()) == 1
+
+
+def test_queues_of_other_owners_keep_to_their_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    release = threading.Event()
+    alice = JobQueue(path, lambda job: release.wait(1), owner="alice")
+    job_id = alice.submit("https://a")
+    _wait_for(alice, job_id, statuses=("running",))
+
+    ran = []
+    bob = JobQueue(path, lambda job: ran.append(job.url), owner="bob")
+    # Another queue in the same process neither fails the running job nor lists it
+    assert bob.list_jobs() == []
+    assert bob.get(job_id) is None
+    _wait_for(bob, bob.submit("https://b"))
+    release.set()
+
+    assert _wait_for(alice, job_id)["status"] == "succeeded"
+    assert [job["url"] for job in alice.list_jobs()] == ["https://a"]
+    assert ran == ["https://b"]
+
+    # A second queue of the same owner does not recover its jobs again either
+    again = JobQueue(path, lambda job: ran.append(job.url), owner="alice")
+    assert again.list_jobs()[0]["status"] == "succeeded"
+    assert ran == ["https://b"]
+
+
+def test_jobs_left_by_a_previous_process_are_recovered(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, "
+            "status TEXT NOT NULL, pages_crawled INTEGER DEFAULT 0, "
+            "chunks_embedded INTEGER DEFAULT 0, chunks_written INTEGER DEFAULT 0, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.executemany(
+            "INSERT INTO jobs (url, status, created_at, updated_at) VALUES (?, ?, 0, 0)",
+            [("https://a", "running"), ("https://b", "queued")],
+        )
+
+    ran = []
+    queue = JobQueue(path, lambda job: ran.append(job.url))
+
+    interrupted = _wait_for(queue, 1)
+    assert (interrupted["status"], interrupted["error"]) == (
+        "failed",
+        "Interrupted by restart",
+    )
+    assert _wait_for(queue, 2)["status"] == "succeeded"
+    assert ran == ["https://b"]
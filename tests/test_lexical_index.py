@@ -0,0 +1,128 @@
+from langchain.docstore.document import Document
+
+import src.generator
+from tests.fakes import FakeCrawlerDBRouter, HashEmbeddings, LocalDeepLake, WordEncoding
+from src.collection_router import collection_path
+from src.consts import DEFAULT_COLLECTION
+from src.generator import Generator
+from src.lexical_index import BM25Index, tokenize
+
+
+def _docs(*texts):
+    return [Document(page_content=t, metadata={"source": t[:1]}) for t in texts]
+
+
+def test_tokenize_keeps_codes_together():
+    assert tokenize("Error ERR-404 on model X1.2") == [
+        "error",
+        "err-404",
+        "on",
+        "model",
+        "x1.2",
+    ]
+
+
+def test_search_ranks_exact_terms_first():
+    index = BM25Index()
+    index.on_documents_added(
+        _docs("the pump failed", "error ERR-404 in the pump", "unrelated text"),
+        ["1", "2", "3"],
+        [],
+    )
+
+    [(doc, score)] = index.search("what is err-404", k=1)
+    assert doc.page_content == "error ERR-404 in the pump"
+    assert score > 0
+    assert index.search("nothing matches", k=3) == []
+
+
+def test_deleted_rows_are_excluded_and_compacted():
+    index = BM25Index(compact_ratio=0.5)
+    index.on_documents_added(_docs("pump a", "pump b", "pump c"), ["1", "2", "3"], [])
+
+    index.on_documents_deleted({"p": ["1"]})
+    assert {doc.page_content for doc, _ in index.search("pump", k=5)} == {
+        "pump b",
+        "pump c",
+    }
+
+    index.on_documents_deleted({"p": ["2"]})
+    assert len(index) == 1
+    assert [doc.page_content for doc, _ in index.search("pump", k=5)] == ["pump c"]
+
+
+def test_index_is_persisted_and_reloaded(tmp_path):
+    path = str(tmp_path / "lexical_index")
+    index = BM25Index(path, compact_ratio=0.5, flush_every=2)
+    assert not index.load()
+
+    index.on_documents_added(
+        _docs("pump a", "error ERR-404 b", "pump c"), ["1", "2", "3"], []
+    )
+    index.on_documents_deleted({"p": ["1"]})
+
+    reloaded = BM25Index(path)
+    assert reloaded.load()
+    assert len(reloaded) == 2
+    assert reloaded.search("err-404", k=1) == index.search("err-404", k=1)
+    assert [doc.page_content for doc, _ in reloaded.search("pump", k=5)] == ["pump c"]
+
+    # Rows added since the last flush are missing on disk, which callers detect by length
+    index.on_documents_added(_docs("pump d"), ["4"], [])
+    reloaded = BM25Index(path)
+    assert reloaded.load()
+    assert len(reloaded) == 2
+
+
+def test_compaction_is_persisted(tmp_path):
+    path = str(tmp_path / "lexical_index")
+    index = BM25Index(path, compact_ratio=0.5, flush_every=1)
+    index.on_documents_added(_docs("pump a", "pump b", "pump c"), ["1", "2", "3"], [])
+    index.on_documents_deleted({"p": ["1", "2"]})
+
+    reloaded = BM25Index(path)
+    assert reloaded.load()
+    assert reloaded._ids == ["3"]
+    assert [doc.page_content for doc, _ in reloaded.search("pump", k=5)] == ["pump c"]
+
+
+def test_flushed_rows_are_appended_and_reindexed_on_load(tmp_path):
+    path = str(tmp_path / "lexical_index")
+    index = BM25Index(path, compact_ratio=0.5)
+    index.on_documents_added(_docs("pump a", "pump b"), ["1", "2"], [])
+    index.save()
+    postings = (tmp_path / "lexical_index" / "postings.npz").read_bytes()
+
+    index.on_documents_added(_docs("error ERR-404 c", "pump d"), ["3", "4"], [])
+    index.on_documents_deleted({"p": ["4"]})
+    index.flush()
+
+    # Only the rows were appended, the postings of the new rows are rebuilt on load
+    assert (tmp_path / "lexical_index" / "postings.npz").read_bytes() == postings
+    reloaded = BM25Index(path)
+    assert reloaded.load()
+    assert len(reloaded) == 3
+    assert reloaded.search("err-404", k=1) == index.search("err-404", k=1)
+    assert {doc.page_content for doc, _ in reloaded.search("pump", k=5)} == {
+        "pump a",
+        "pump b",
+    }
+
+
+def test_small_ingestion_is_reloaded_without_a_rescan(tmp_path, monkeypatch):
+    db = LocalDeepLake(str(tmp_path / "ds"), HashEmbeddings())
+    router = FakeCrawlerDBRouter(db, pages_per_url=2, encoding=WordEncoding())
+    path = collection_path(src.generator.LEXICAL_INDEX_PATH, DEFAULT_COLLECTION)
+    index = BM25Index(path)
+    index.rebuild(router.ds)
+    router.add_listener(index)
+
+    router.add_document_by_url("https://docs.example.com", {})
+    assert 0 < len(router.ds) < index.flush_every
+
+    def rescan(self, ds):
+        raise AssertionError("the dataset was scanned again")
+
+    monkeypatch.setattr(BM25Index, "rebuild", rescan)
+    reloaded = Generator._load_lexical_index(None, DEFAULT_COLLECTION, router.ds)
+    assert len(reloaded) == len(router.ds)
@@ -0,0 +1,147 @@
+import deeplake
+import numpy as np
+from langchain.docstore.document import Document
+
+from src.local_index import LocalVectorIndex
+
+
+def _make_dataset(path: str):
+    ds = deeplake.empty(path, overwrite=True, verbose=False)
+    ds.create_tensor("metadata", htype="json")
+    ds.create_tensor("id", htype="text")
+    ds.create_tensor("text", htype="text")
+    ds.create_tensor("embedding", htype="embedding", dtype=np.float32)
+    ds.metadata.extend([{"source": "a"}, {"source": "a"}, {"source": "b"}])
+    ds.id.extend(["1", "2", "3"])
+    ds.text.extend(["a1", "a2", "b1"])
+    ds.embedding.extend(np.eye(3, dtype=np.float32))
+    return ds
+
+
+def test_sync_search_and_reload(tmp_path):
+    ds = _make_dataset(str(tmp_path / "ds"))
+    index = LocalVectorIndex(str(tmp_path / "index"), dtype="float16")
+    index.sync_from_dataset(ds)
+
+    [(doc, score)] = index.search([0, 2, 0.1], k=1)
+    assert doc.metadata == {"source": "a", "id": "2"}
+    assert score > 0.99
+
+    reloaded = LocalVectorIndex(str(tmp_path / "index"))
+    assert reloaded.load()
+    assert len(reloaded) == 3
+    assert reloaded.search([1, 0, 0], k=3)[0][0].page_content == "a1"
+
+
+def test_listener_hooks_keep_mirror_in_sync(tmp_path):
+    ds = _make_dataset(str(tmp_path / "ds"))
+    index = LocalVectorIndex(str(tmp_path / "index"), flush_every=10)
+    index.sync_from_dataset(ds)
+
+    index.on_documents_added(
+        [Document(page_content="c1", metadata={"source": "c"})], ["4"], [[1, 1, 0]]
+    )
+    doc, _ = index.search([1, 1, 0], k=1)[0]
+    assert doc.page_content == "c1"
+
+    index.on_documents_deleted({"a": ["1", "2"]})
+    assert len(index) == 2
+    sources = {doc.metadata["source"] for doc, _ in index.search([1, 0, 0], k=4)}
+    assert sources == {"b", "c"}
+
+
+def test_ivf_search_finds_exact_neighbour(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(500, 8)).astype(np.float32)
+    index = LocalVectorIndex(str(tmp_path / "index"), n_probe=4)
+    index.on_documents_added(
+        [Document(page_content=str(i), metadata={}) for i in range(len(vectors))],
+        [str(i) for i in range(len(vectors))],
+        vectors.tolist(),
+    )
+    index.build_ivf(n_lists=8)
+
+    assert index.has_ivf
+    assert index.search(vectors[42], k=1)[0][0].metadata["id"] == "42"
+
+
+def test_deletes_are_tombstoned_until_compaction(tmp_path):
+    ds = _make_dataset(str(tmp_path / "ds"))
+    index = LocalVectorIndex(str(tmp_path / "index"), compact_ratio=0.5)
+    index.sync_from_dataset(ds)
+    matrix = index._matrix
+
+    index.on_documents_deleted({"a": ["1"]})
+    # Below the ratio the matrix is kept and the tombstones persisted
+    assert index._matrix is matrix
+    reloaded = LocalVectorIndex(str(tmp_path / "index"))
+    assert reloaded.load()
+    assert len(reloaded) == 2
+    assert "1" not in {doc.metadata["id"] for doc, _ in reloaded.search([1, 0, 0], k=3)}
+
+    index.on_documents_deleted({"a": ["2"]})
+    assert len(index._matrix) == 1
+    reloaded = LocalVectorIndex(str(tmp_path / "index"))
+    assert reloaded.load()
+    assert [doc.metadata["id"] for doc, _ in reloaded.search([1, 0, 0], k=3)] == ["3"]
+
+
+def test_search_results_survive_a_concurrent_compaction(tmp_path):
+    ds = _make_dataset(str(tmp_path / "ds"))
+    index = LocalVectorIndex(str(tmp_path / "index"))
+    index.sync_from_dataset(ds)
+    scores = index._scores
+
+    def compact_while_scoring(matrix, query):
+        # Rows are renumbered by the compaction while the search is scoring
+        index._scores = scores
+        index.on_documents_deleted({"a": ["1", "2"]})
+        return scores(matrix, query)
+
+    index._scores = compact_while_scoring
+    [(doc, _)] = index.search([0, 0, 1], k=1)
+
+    assert (doc.page_content, doc.metadata["id"]) == ("b1", "3")
+    assert len(index._matrix) == 1
+
+
+def test_flush_appends_new_rows_only(tmp_path):
+    ds = _make_dataset(str(tmp_path / "ds"))
+    index = LocalVectorIndex(str(tmp_path / "index"))
+    index.sync_from_dataset(ds)
+    matrix_path = tmp_path / "index" / "embeddings.bin"
+    saved = matrix_path.read_bytes()
+
+    index.on_documents_added(
+        [Document(page_content="c1", metadata={"source": "c"})], ["4"], [[1, 1, 0]]
+    )
+    index.flush()
+
+    assert matrix_path.read_bytes()[: len(saved)] == saved
+    assert matrix_path.stat().st_size == len(saved) + 3 * 4
+    reloaded = LocalVectorIndex(str(tmp_path / "index"))
+    assert reloaded.load()
+    assert len(reloaded) == 4
+    assert reloaded.search([1, 1, 0], k=1)[0][0].page_content == "c1"
+
+
+def test_load_drops_an_interrupted_append(tmp_path):
+    ds = _make_dataset(str(tmp_path / "ds"))
+    index = LocalVectorIndex(str(tmp_path / "index"))
+    index.sync_from_dataset(ds)
+    # The embeddings of a row were appended, but not the row itself
+    with open(tmp_path / "index" / "embeddings.bin", "ab") as f:
+        f.write(np.ones(3, dtype=np.float32).tobytes())
+
+    reloaded = LocalVectorIndex(str(tmp_path / "index"))
+    assert reloaded.load()
+    assert len(reloaded) == 3
+
+    reloaded.on_documents_added(
+        [Document(page_content="c1", metadata={"source": "c"})], ["4"], [[0, 1, 1]]
+    )
+    reloaded.flush()
+    again = LocalVectorIndex(str(tmp_path / "index"))
+    assert again.load()
+    [(doc, score)] = again.search([0, 1, 1], k=1)
+    assert doc.page_content == "c1" and score > 0.99
@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+import httpx
+import openai
+
+from src.rate_limit import (
+    BACKGROUND,
+    INTERACTIVE,
+    ProviderLimiter,
+    RateLimitedAsyncTransport,
+    RateLimitedTransport,
+    RequestScheduler,
+    estimate_tokens,
+    parse_duration,
+)
+
+
+def _embedding_response(request):
+    inputs = json.loads(request.content)["input"]
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": [0.1, 0.2]}
+            for i in range(len(inputs))
+        ],
+        "model": "text-embedding-ada-002",
+        "usage": {"prompt_tokens": 1, "total_tokens": 1},
+    }
+
+
+def test_throttled_embedding_call_is_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(estimate_tokens(request))
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"retry-after-ms": "10"})
+        return httpx.Response(
+            200,
+            json=_embedding_response(request),
+            headers={"x-ratelimit-remaining-tokens": "500"},
+        )
+
+    limiter = ProviderLimiter("openai", requests_per_minute=600, tokens_per_minute=1000)
+    scheduler = RequestScheduler({"openai.com": limiter})
+    client = openai.OpenAI(
+        api_key="key",
+        max_retries=0,
+        http_client=httpx.Client(
+            transport=RateLimitedTransport(scheduler, httpx.MockTransport(handler))
+        ),
+    )
+
+    response = client.embeddings.create(input=[[1, 2, 3], [4, 5]], model="ada")
+
+    assert len(response.data) == 2
+    assert calls == [5, 5]
+    assert (limiter.throttled, limiter.retries) == (1, 1)
+    # The remaining tokens reported by the provider are taken into account
+    assert limiter.tokens.level <= 500
+
+
+def test_async_transport_retries_server_errors():
+    statuses = [503, 200]
+
+    async def handler(request):
+        return httpx.Response(statuses.pop(0))
+
+    limiter = ProviderLimiter("cohere", requests_per_minute=600, base_delay=0.01)
+    transport = RateLimitedAsyncTransport(
+        RequestScheduler({"cohere.com": limiter}), httpx.MockTransport(handler)
+    )
+
+    async def call():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.post("https://api.cohere.com/v1/rerank", json={})
+
+    assert asyncio.run(call()).status_code == 200
+    assert limiter.retries == 1
+
+
+def test_background_calls_leave_reserve_to_interactive_ones():
+    limiter = ProviderLimiter(
+        "openai",
+        requests_per_minute=10,
+        tokens_per_minute=1000,
+        interactive_reserve=0.5,
+    )
+
+    assert limiter._try_acquire(400, BACKGROUND) == 0
+    # Taking 200 more would dip into the half of the quota kept for interactive calls
+    assert limiter._try_acquire(200, BACKGROUND) > 0
+    assert limiter._try_acquire(200, INTERACTIVE) == 0
+
+    limiter._interactive_waiting = 1
+    assert limiter._try_acquire(0, BACKGROUND) > 0
+
+
+def test_batches_follow_headroom():
+    limiter = ProviderLimiter(
+        "openai", requests_per_minute=100, tokens_per_minute=1000, interactive_reserve=0
+    )
+    texts = ["text"] * 30
+
+    batches = limiter.iter_batches(texts, lambda text: 10)
+    # A tenth of the per-minute tokens while the quota is untouched
+    assert len(next(batches)) == 10
+    limiter.tokens.level = 0
+    # Down to the minimum batch once it is exhausted
+    assert len(next(batches)) == 2
+
+
+def test_parse_duration():
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("1.5") == 1.5
+    assert parse_duration("soon") is None
@@ -0,0 +1,64 @@
+import asyncio
+import time
+from typing import Optional, Sequence
+
+from langchain_core.callbacks.manager import Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+
+from src.rerankers import FallbackReranker, LexicalReranker
+
+
+class _SlowReranker(BaseDocumentCompressor):
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        time.sleep(1)
+        return []
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        await asyncio.sleep(1)
+        return []
+
+
+def _docs(*texts):
+    return [Document(page_content=text, metadata={"source": "s"}) for text in texts]
+
+
+def test_lexical_reranker_orders_by_relevance():
+    reranker = LexicalReranker(top_n=2)
+    compressed = reranker.compress_documents(
+        _docs("cats and dogs", "reset the pump after ERR-404", "the pump"),
+        "how to reset the pump after err-404",
+    )
+
+    assert [doc.page_content for doc in compressed] == [
+        "reset the pump after ERR-404",
+        "the pump",
+    ]
+    assert (
+        0
+        < compressed[1].metadata["relevance_score"]
+        < compressed[0].metadata["relevance_score"]
+        <= 1
+    )
+
+
+def test_fallback_reranker_answers_within_budget():
+    reranker = FallbackReranker(
+        primary=_SlowReranker(), fallback=LexicalReranker(top_n=1), latency_budget=0.05
+    )
+
+    start = time.perf_counter()
+    assert len(reranker.compress_documents(_docs("a b", "c"), "a")) == 1
+    assert len(asyncio.run(reranker.acompress_documents(_docs("a b", "c"), "a"))) == 1
+    assert time.perf_counter() - start < 0.5
+    assert reranker.fallbacks == 2
@@ -0,0 +1,42 @@
+import time
+
+from src.sessions import SessionPool
+
+
+def test_sessions_are_isolated_and_lru_bounded():
+    pool = SessionPool(max_sessions=2)
+
+    pool.get("a").save_context({"question": "hi"}, {"answer": "hello"})
+    assert pool.get("b").load_memory_variables({})["chat_history"] == []
+    assert len(pool.get("a").load_memory_variables({})["chat_history"]) == 2
+
+    pool.get("c")
+    assert len(pool) == 2
+    assert pool.get("b").load_memory_variables({})["chat_history"] == []
+    assert pool.get("a").load_memory_variables({})["chat_history"] == []
+
+
+def test_idle_sessions_are_evicted():
+    pool = SessionPool(idle_ttl=0.01)
+    pool.get("a")
+    time.sleep(0.02)
+
+    pool.get("b")
+    assert len(pool) == 1
+
+
+def test_evicted_session_is_rebuilt_from_its_history():
+    pool = SessionPool(max_sessions=1)
+    history = [(f"question {i}", f"answer {i}") for i in range(5)]
+    pool.get("a", history[:1]).save_context(
+        {"question": "ignored"}, {"answer": "ignored"}
+    )
+    # A live memory is returned as it is
+    assert len(pool.get("a", history).load_memory_variables({})["chat_history"]) == 4
+
+    pool.get("b")
+    messages = pool.get("a", history).load_memory_variables({})["chat_history"]
+    # Only the exchanges of the memory window are replayed
+    assert [message.content for message in messages] == [
+        text for exchange in history[-3:] for text in exchange
+    ]
@@ -0,0 +1,112 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+
+import src.db_router
+from tests.fakes import (
+    FakeCrawlerDBRouter,
+    HashEmbeddings,
+    LocalDeepLake,
+    WordEncoding,
+)
+from src.snapshot import read_manifest, snapshot_path
+
+
+def _router(path, embeddings=None):
+    db = LocalDeepLake(str(path), embeddings or HashEmbeddings())
+    return FakeCrawlerDBRouter(db, pages_per_url=3, encoding=WordEncoding())
+
+
+class CountingEmbeddings(HashEmbeddings):
+    calls = 0
+
+    def embed_documents(self, texts):
+        CountingEmbeddings.calls += 1
+        return super().embed_documents(texts)
+
+
+def test_export_import_round_trip(tmp_path):
+    source = _router(tmp_path / "source")
+    source.add_documents_by_urls(["https://a.example.com", "https://b.example.com"], {})
+
+    manifest = source.export_snapshot("kb", {}, block_size=7)
+    assert manifest["count"] == len(source.ds)
+    assert sum(manifest["batches"]) == manifest["count"]
+    path = snapshot_path(src.db_router.SNAPSHOTS_PATH, "kb")
+    assert read_manifest(path)["collection"] == "default"
+
+    target = _router(tmp_path / "target", CountingEmbeddings())
+    assert target.import_snapshot("kb", batch_size=5) == len(source.ds)
+
+    # No embedding call, and the same IDs, texts, metadata and embeddings in the same order
+    assert CountingEmbeddings.calls == 0
+    for tensor in ("id", "text"):
+        assert (
+            target.ds[tensor].data(aslist=True)["value"]
+            == source.ds[tensor].data(aslist=True)["value"]
+        )
+    assert target.ds.metadata.data()["value"] == source.ds.metadata.data()["value"]
+    assert np.array_equal(target.ds.embedding.numpy(), source.ds.embedding.numpy())
+    assert [(m["source"], m["count"]) for m in target.get_all_documents_metadata] == [
+        (m["source"], m["count"]) for m in source.get_all_documents_metadata
+    ]
+
+    with pytest.raises(Exception, match="not empty"):
+        target.import_snapshot("kb")
+
+
+def test_incomplete_snapshot_is_rejected(tmp_path):
+    target = _router(tmp_path / "target")
+
+    with pytest.raises(Exception, match="No complete snapshot"):
+        target.import_snapshot("missing")
+
+
+def test_snapshots_stay_under_their_directory(tmp_path):
+    router = _router(tmp_path / "source")
+    router.add_document_by_url("https://a.example.com", {})
+    root = src.db_router.SNAPSHOTS_PATH
+
+    for name in ("", ".", "..", "../outside", str(tmp_path)):
+        with pytest.raises(Exception, match="Invalid snapshot name"):
+            router.export_snapshot(name, {})
+
+    # Only a previous snapshot is replaced, never another directory
+    os.makedirs(os.path.join(root, "other"))
+    with open(os.path.join(root, "other", "keep.txt"), "w") as f:
+        f.write("keep")
+    with pytest.raises(Exception, match="not a snapshot"):
+        router.export_snapshot("other", {})
+    assert os.listdir(os.path.join(root, "other")) == ["keep.txt"]
+
+    first = router.export_snapshot("kb", {})
+    router.add_document_by_url("https://b.example.com", {})
+    second = router.export_snapshot("kb", {})
+    assert second["count"] > first["count"]
+    assert read_manifest(os.path.join(root, "kb"))["count"] == second["count"]
+    assert sorted(os.listdir(root)) == ["kb", "other"]
+
+
+def test_export_reads_a_commit_without_holding_off_writes(tmp_path, monkeypatch):
+    router = _router(tmp_path / "source")
+    router.add_document_by_url("https://a.example.com", {})
+    count = len(router.ds)
+    export = src.db_router.export_snapshot
+
+    def export_during_write(ds, *args, **kwargs):
+        writer = threading.Thread(
+            target=router._ingest,
+            args=([Document("written during the export", metadata={"source": "x"})],),
+        )
+        writer.start()
+        writer.join(5)
+        assert not writer.is_alive()
+        return export(ds, *args, **kwargs)
+
+    monkeypatch.setattr(src.db_router, "export_snapshot", export_during_write)
+
+    assert router.export_snapshot("kb", {})["count"] == count
+    assert len(router.ds) == count + 1
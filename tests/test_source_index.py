@@ -0,0 +1,90 @@
+import deeplake
+from langchain.docstore.document import Document
+
+from src.source_index import SourceIndex, chunk_hash
+
+
+def _make_dataset(path: str):
+    ds = deeplake.empty(path, overwrite=True, verbose=False)
+    ds.create_tensor("metadata", htype="json")
+    ds.create_tensor("id", htype="text")
+    ds.create_tensor("text", htype="text")
+    ds.metadata.extend(
+        [{"source": "a", "title": "A"}] * 2 + [{"source": "b", "title": "B"}]
+    )
+    ds.id.extend(["1", "2", "3"])
+    ds.text.extend(["a1", "a2", "b1"])
+    return ds
+
+
+def test_load_rebuilds_missing_index(tmp_path):
+    ds = _make_dataset(str(tmp_path / "ds"))
+    index = SourceIndex.load(ds)
+
+    metadata = index.list_sources()
+    assert [doc["source"] for doc in metadata] == ["a", "b"]
+    assert [doc["count"] for doc in metadata] == [2, 1]
+    assert index.get_ids("a") == ["1", "2"]
+
+
+def test_add_and_remove_are_persisted(tmp_path):
+    ds = _make_dataset(str(tmp_path / "ds"))
+    index = SourceIndex.load(ds)
+
+    index.add(
+        [Document(page_content="c", metadata={"source": "c", "title": "C"})], ["4"]
+    )
+    index.save(ds)
+    ds.metadata.append({"source": "c", "title": "C"})
+    ds.id.append("4")
+    ds.text.append("c")
+
+    reloaded = SourceIndex.load(ds)
+    assert reloaded.get_ids("c") == ["4"]
+    assert reloaded.list_sources()[-1]["added_at"] is not None
+
+    assert reloaded.remove("a") == ["1", "2"]
+    assert reloaded.total_count == 2
+
+
+def test_remove_ids_keeps_hashes_aligned(tmp_path):
+    ds = _make_dataset(str(tmp_path / "ds"))
+    index = SourceIndex.load(ds)
+
+    assert index.get_chunks("a") == [("1", chunk_hash("a1")), ("2", chunk_hash("a2"))]
+
+    index.remove_ids("a", ["1"])
+    assert index.get_chunks("a") == [("2", chunk_hash("a2"))]
+    assert index.list_sources()[0]["count"] == 1
+
+    index.remove_ids("a", ["2"])
+    assert [doc["source"] for doc in index.list_sources()] == ["b"]
+
+
+def test_info_keeps_only_aggregates(tmp_path):
+    ds = _make_dataset(str(tmp_path / "ds"))
+    index = SourceIndex.load(ds)
+    index.add(
+        [Document(page_content="c", metadata={"source": "c", "chunk_hash": "h"})],
+        ["4"],
+    )
+    index.save(ds)
+    ds.metadata.append({"source": "c", "chunk_hash": "h"})
+    ds.id.append("4")
+    ds.text.append("c")
+
+    stored = ds.info[SourceIndex.INFO_KEY]
+    assert stored["version"] == SourceIndex.VERSION
+    assert all(
+        set(entry) == {"source", "title", "count", "added_at"}
+        for entry in stored["entries"].values()
+    )
+
+    # The chunks are read back from the dataset, with the hash written in their metadata
+    reloaded = SourceIndex.load(ds)
+    assert reloaded._chunks is None
+    assert reloaded.get_chunks("c") == [("4", "h")]
+    assert reloaded.get_chunks("a") == [
+        ("1", chunk_hash("a1")),
+        ("2", chunk_hash("a2")),
+    ]
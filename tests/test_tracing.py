@@ -0,0 +1,70 @@
+import json
+import time
+
+from src.tracing import Tracer
+
+
+def _slow(items, delay):
+    for item in items:
+        time.sleep(delay)
+        yield item
+
+
+def test_trace_spans_and_metrics(tmp_path):
+    tracer = Tracer(str(tmp_path / "traces.jsonl"), str(tmp_path / "metrics.prom"))
+
+    with tracer.trace("ingest", url="a") as trace:
+        pages = tracer.iter_span("ingest.fetch", _slow(range(3), 0.01), count="pages")
+        chunks = tracer.iter_span("ingest.split", _slow(pages, 0.001), count="chunks")
+        assert list(chunks) == [0, 1, 2]
+        with tracer.span("ingest.embed", items=3) as span:
+            span.set(tokens=42)
+        trace.set(chunks=3)
+
+    [record] = tracer.recent_traces()
+    spans = {span["name"]: span for span in record["spans"]}
+    assert record["attributes"] == {"url": "a", "chunks": 3}
+    assert spans["ingest.fetch"]["attributes"] == {"pages": 3}
+    # The time spent fetching pages is not counted as splitting time
+    assert spans["ingest.fetch"]["duration_ms"] >= 30
+    assert spans["ingest.split"]["duration_ms"] < 20
+    assert spans["ingest.embed"]["attributes"] == {"items": 3, "tokens": 42}
+
+    [line] = (tmp_path / "traces.jsonl").read_text().splitlines()
+    assert json.loads(line)["trace_id"] == record["trace_id"]
+
+    metrics = (tmp_path / "metrics.prom").read_text()
+    assert 'rag_stage_duration_seconds_count{stage="ingest.fetch"} 1' in metrics
+    assert 'rag_stage_count_total{stage="ingest.embed",name="tokens"} 42' in metrics
+
+
+def test_failed_trace_is_recorded():
+    tracer = Tracer()
+
+    try:
+        with tracer.trace("search"):
+            with tracer.span("search.generate"):
+                raise ValueError("boom")
+    except ValueError:
+        pass
+
+    [record] = tracer.recent_traces()
+    assert "boom" in record["error"]
+    assert "boom" in record["spans"][0]["error"]
+    assert 'le="+Inf"} 1' in tracer.prometheus_text()
+
+
+def test_recent_traces_are_filtered_by_attributes():
+    tracer = Tracer()
+    for session in ("a", "b", "a"):
+        with tracer.trace("search", session=session):
+            pass
+    with tracer.trace("ingest", url="x"):
+        pass
+
+    assert len(tracer.recent_traces()) == 4
+    assert [t["attributes"]["session"] for t in tracer.recent_traces(session="a")] == [
+        "a",
+        "a",
+    ]
+    assert len(tracer.recent_traces(1, session="a")) == 1
@@ -0,0 +1,19 @@
+from src.tracing import tracer
+from src.warmup import CREDENTIAL_ENV_VARS, env_credentials, start_warmup
+
+
+def test_env_credentials(monkeypatch):
+    for var in CREDENTIAL_ENV_VARS.values():
+        monkeypatch.setenv(var, "secret")
+    assert env_credentials() == {key: "secret" for key in CREDENTIAL_ENV_VARS}
+
+    monkeypatch.delenv("COHERE_API_KEY")
+    assert env_credentials() is None
+
+
+def test_warmup_imports_without_credentials():
+    start_warmup(None).join(timeout=60)
+
+    [trace] = [trace for trace in tracer.recent_traces() if trace["name"] == "warmup"]
+    assert trace["error"] is None
+    assert [span["name"] for span in trace["spans"]] == ["warmup.import"]
@@ -1,43 +1,143 @@
-import os
+import time
+import uuid
+from typing import TYPE_CHECKING
+
 import streamlit as st
 from audio_recorder_streamlit import audio_recorder
 from streamlit_chat import message
 
 from src.auth import Auth
-from src.generator import Generator
-from src.db_router import DBRouter
-from src.consts import TEMP_AUDIO_PATH, AUDIO_FORMAT
+from src.consts import (
+    AUDIO_FORMAT,
+    CHAT_HISTORY_PAGE_SIZE,
+    DEBUG_TRACES,
+    FRESHNESS_DB_PATH,
+    JOB_POLL_INTERVAL,
+    METRICS_PORT,
+    REFRESH_ENABLED,
+    REFRESH_GONE_CHECKS,
+    REFRESH_INTERVAL,
+    REFRESH_MAX_CONCURRENCY,
+    REFRESH_MAX_PAGES,
+    REFRESH_POLL_INTERVAL,
+    SNAPSHOTS_PATH,
+    WARMUP_ENABLED,
+)
+from src.jobs import ACTIVE_STATUSES
+from src.tracing import tracer
+from src.warmup import env_credentials, start_warmup
+
+# The generator and router pull in LangChain, DeepLake and the API clients, so they are only
+# imported once authenticated, and the authentication page renders from this light import set
+if TYPE_CHECKING:
+    from src.db_router import DBRouter
+    from src.generator import Generator
 
 st.set_page_config(page_icon="🌐️")
 
 
+@st.cache_resource
+def load_db_router(_generator: "Generator", collection: str) -> "DBRouter":
+    """
+    Load the database router of a collection once per process, so its write lock and per-source
+    index are shared by the sessions of every credentials; the sessions pass their credentials to
+    the calls needing them.
+
+    The refresh scheduler of the collection is attached to it, and re-crawls changed pages with
+    the credentials of the session that loaded the router.
+
+    Args:
+        _generator: The generator holding the vector databases (excluded from the cache key).
+        collection: Name of the collection.
+
+    Returns:
+        The database router.
+    """
+    from src.collection_router import collection_path
+    from src.db_router import DBRouter
+    from src.freshness import RefreshScheduler
+
+    db_router = DBRouter(_generator.collections[collection].db, collection=collection)
+    db_router.add_listener(_generator.answer_cache)
+    for listener in _generator.collections[collection].listeners:
+        db_router.add_listener(listener)
+
+    scheduler = RefreshScheduler(
+        db_router,
+        collection_path(FRESHNESS_DB_PATH, collection),
+        _generator.credentials,
+        default_interval=REFRESH_INTERVAL,
+        max_concurrency=REFRESH_MAX_CONCURRENCY,
+        max_pages=REFRESH_MAX_PAGES,
+        poll_interval=REFRESH_POLL_INTERVAL,
+        gone_checks=REFRESH_GONE_CHECKS,
+    )
+    db_router.attach_refresh_scheduler(scheduler)
+    if REFRESH_ENABLED:
+        scheduler.start()
+    return db_router
+
+
+@st.cache_resource
+def start_metrics_server() -> bool:
+    """
+    Serve the Prometheus metrics once per process, if a metrics port is configured.
+
+    Returns:
+        True if the metrics are served over HTTP.
+    """
+    if not METRICS_PORT:
+        return False
+    tracer.serve(METRICS_PORT)
+    return True
+
+
+@st.cache_resource
+def warm_up() -> bool:
+    """
+    Start warming the process up in the background on its first page load, if enabled.
+
+    Returns:
+        True if the warm-up was started.
+    """
+    if not WARMUP_ENABLED:
+        return False
+    start_warmup(env_credentials())
+    return True
+
+
 class UI:
     """
     A class to handle the Streamlit user interface for the application.
     """
 
-    def __init__(self, generator: Generator, db_router: DBRouter):
+    def __init__(self, generator: "Generator", db_routers: dict[str, "DBRouter"]):
         self.generator = generator
-        self.db_router = db_router
+        self.db_routers = db_routers
+
+    @property
+    def db_router(self) -> "DBRouter":
+        """
+        Database router of the collection selected on the knowledge base page.
+        """
+        collection = st.session_state.get("kb_collection")
+        return self.db_routers.get(collection) or next(iter(self.db_routers.values()))
 
     def _record_and_transcribe_audio(self):
         """
         Record audio from the user and transcribe it using the Whisper API.
 
         Returns:
-            None, saves the audio to a temporary file.
+            None, stores the transcription in the session state.
         """
         audio_bytes = audio_recorder()
         if audio_bytes:
             st.audio(audio_bytes, format=AUDIO_FORMAT)
-            with open(TEMP_AUDIO_PATH, "wb") as f:
-                f.write(audio_bytes)
 
             if st.button("Transcribe"):
                 st.session_state.transcription = self.generator.transcribe_audio(
-                    TEMP_AUDIO_PATH
+                    audio_bytes
                 )
-                os.remove(TEMP_AUDIO_PATH)
 
     def _get_user_input(self) -> str:
         """
@@ -61,26 +161,70 @@ class UI:
             return user_input
 
     @staticmethod
-    def _display_conversation(history: st.session_state):
+    def _source_refs(source_documents: list) -> list[dict]:
+        """
+        Compact references to the source documents of an answer, kept instead of their content.
+
+        Args:
+            source_documents: The source documents of an answer.
+
+        Returns:
+            The source URL, relevance score and chunk hashes of every document.
+        """
+        from src.source_index import chunk_hash
+
+        return [
+            {
+                "source": doc.metadata["source"],
+                "score": doc.metadata.get("relevance_score"),
+                "chunk_hashes": doc.metadata.get("chunk_hashes")
+                or [chunk_hash(doc.page_content)],
+                "collection": doc.metadata.get("collection"),
+            }
+            for doc in source_documents
+        ]
+
+    def _display_source_refs(self, turn: int, source_refs: list[dict]):
+        """
+        Display the sources of an answer, fetching their content only on demand.
+
+        Args:
+            turn: Index of the conversation turn.
+            source_refs: References to the sources of the answer.
+        """
+        show_content = st.toggle("Show content", key=f"{turn}_show_content")
+        for ref in source_refs:
+            st.write(f"**Source:** {ref['source']}")
+            if len(self.db_routers) > 1 and ref.get("collection"):
+                st.write(f"**Collection:** {ref['collection']}")
+            if show_content:
+                db_router = self.db_routers.get(ref.get("collection"), self.db_router)
+                texts = db_router.get_chunk_texts(ref["source"], ref["chunk_hashes"])
+                content = " ".join(text for text in texts if text)
+                st.write(f"**Content:** {content or 'No longer available'}")
+            if ref["score"] is not None:
+                st.write(f"**Relevance to Query:** {round(ref['score'] * 100, 2)}%")
+            st.divider()
+
+    def _display_conversation(self, history: st.session_state):
         """
-        Display the conversation history in the UI.
+        Display the most recent turns of the conversation history in the UI.
 
         Args:
             history: The conversation history to display.
         """
-        for i, (past, generated, source_documents) in enumerate(
-            zip(history["past"], history["generated"], history["source_documents"])
-        ):
-            message(past, is_user=True, key=f"{i}_user")
-            message(generated, key=f"{i}")
-            with st.expander("See Resources"):
-                for source in source_documents:
-                    st.write(f"**Source:** {source.metadata['source']}")
-                    st.write(f"**Content:** {source.page_content}")
-                    st.write(
-                        f"**Relevance to Query:** {round(source.metadata['relevance_score'] * 100, 2)}%"
-                    )
-                    st.divider()
+        window = history.setdefault("history_window", CHAT_HISTORY_PAGE_SIZE)
+        first_turn = max(len(history["past"]) - window, 0)
+        if first_turn and st.button(f"Show earlier messages ({first_turn} hidden)"):
+            history["history_window"] += CHAT_HISTORY_PAGE_SIZE
+            st.experimental_rerun()
+
+        for i in range(first_turn, len(history["past"])):
+            message(history["past"][i], is_user=True, key=f"{i}_user")
+            message(history["generated"][i], key=f"{i}")
+            if history["source_refs"][i]:
+                with st.expander("See Resources"):
+                    self._display_source_refs(i, history["source_refs"][i])
 
     def show_main_page(self):
         """
@@ -92,22 +236,54 @@ class UI:
             st.session_state["generated"] = ["I am ready to help you"]
         if "past" not in st.session_state:
             st.session_state["past"] = ["Hey there!"]
-        if "source_documents" not in st.session_state:
-            st.session_state["source_documents"] = [[]]
+        if "source_refs" not in st.session_state:
+            st.session_state["source_refs"] = [[]]
         if "transcription" not in st.session_state:
             st.session_state["transcription"] = ""
 
         self._display_conversation(st.session_state)
 
+        stats = self.generator.answer_cache.stats
+        st.sidebar.caption(
+            f"Answer cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate, {stats['size']} entries)"
+        )
+        context_stats = self.generator.context_assembler.stats
+        st.sidebar.caption(
+            f"Context assembly: {context_stats['tokens_saved']} of "
+            f"{context_stats['tokens_in']} prompt tokens saved"
+        )
+        if len(self.generator.collections) > 1:
+            st.sidebar.multiselect(
+                "Search collections",
+                list(self.generator.collections),
+                key="search_collections",
+                help="Leave empty to search the collections closest to each question",
+            )
+
         user_input = self._get_user_input()
 
         if user_input:
-            with st.spinner("Searching knowledge base..."):
-                output = self.generator.search_db(user_input)
+            message(user_input, is_user=True, key="pending_user")
+            status = st.empty()
+            answer_placeholder = st.empty()
+            status.caption("Searching knowledge base...")
+
+            answer = ""
+            for kind, payload in self.generator.stream_search_db(user_input):
+                if kind == "sources":
+                    status.caption(f"Found {len(payload)} relevant sources")
+                elif kind == "token":
+                    answer += payload
+                    answer_placeholder.markdown(answer + "▌")
+                elif kind == "answer":
+                    output = payload
 
             st.session_state["past"].append(user_input)
             st.session_state["generated"].append(output["answer"])
-            st.session_state["source_documents"].append(output["source_documents"])
+            st.session_state["source_refs"].append(
+                self._source_refs(output["source_documents"])
+            )
 
             st.experimental_rerun()
 
@@ -122,9 +298,81 @@ class UI:
             submitted = st.form_submit_button("Add Document")
 
         if submitted and url:
-            with st.spinner("Adding document..."):
-                self.db_router.add_document_by_url(url)
-                st.experimental_rerun()
+            job_id = self.db_router.submit_document_by_url(
+                url, self.generator.credentials
+            )
+            st.info(f"Ingestion job #{job_id} queued for {url}", icon=":material/info:")
+
+    @st.experimental_fragment(run_every=JOB_POLL_INTERVAL)
+    def _display_ingestion_jobs(self):
+        """
+        Display the status and progress of the recent ingestion jobs, polling them in the background.
+        """
+        jobs = self.db_router.get_jobs(self.generator.credentials)
+        active_ids = {job["id"] for job in jobs if job["status"] in ACTIVE_STATUSES}
+
+        # Rerun the whole page once a job finishes, so the documents list picks it up
+        if st.session_state.get("active_job_ids", set()) - active_ids:
+            st.session_state["active_job_ids"] = active_ids
+            st.experimental_rerun()
+        st.session_state["active_job_ids"] = active_ids
+
+        if not jobs:
+            return
+
+        st.write("### Ingestion Jobs")
+        for job in jobs:
+            col1, col2, col3, col4 = st.columns((4, 1, 2, 1))
+            urls = job["url"].splitlines()
+            col1.write(
+                urls[0] if len(urls) == 1 else f"{urls[0]} and {len(urls) - 1} more"
+            )
+            col2.write(job["status"])
+            col3.write(
+                f"{job['pages_crawled']} pages, {job['chunks_embedded']} embedded, "
+                f"{job['chunks_written']} written"
+            )
+            if job["status"] in ACTIVE_STATUSES:
+                if col4.button("Cancel", key=f"cancel_job_{job['id']}"):
+                    self.db_router.cancel_job(job["id"], self.generator.credentials)
+            elif job["error"]:
+                col4.write(f":red[{job['error']}]")
+
+    def _add_documents_by_urls(self):
+        """
+        Display the UI to add many documents at once from a pasted list or an uploaded file of URLs.
+        """
+        st.write("### Add many documents by URLs")
+
+        with st.form(key="add_documents_form", clear_on_submit=True):
+            pasted_urls = st.text_area(
+                "Paste URLs (one per line or comma-separated)", key="add_urls"
+            )
+            uploaded_file = st.file_uploader(
+                "Or upload a file of URLs", type=["txt", "csv"], key="add_urls_file"
+            )
+            submitted = st.form_submit_button("Add Documents")
+
+        if submitted:
+            raw_urls = pasted_urls
+            if uploaded_file is not None:
+                raw_urls += "\n" + uploaded_file.getvalue().decode("utf-8")
+            urls = list(
+                dict.fromkeys(
+                    url.strip()
+                    for url in raw_urls.replace(",", "\n").splitlines()
+                    if url.strip()
+                )
+            )
+            if urls:
+                # Crawled concurrently, with the chunks of all URLs embedded in shared batches
+                job_id = self.db_router.submit_documents_by_urls(
+                    urls, self.generator.credentials
+                )
+                st.info(
+                    f"Ingestion job #{job_id} queued for {len(urls)} URLs",
+                    icon=":material/info:",
+                )
 
     def _display_existing_documents_metadata(self):
         """
@@ -134,32 +382,206 @@ class UI:
 
         st.write("### Existing Documents Metadata")
 
-        col1, col2, col3, col4 = st.columns((3, 3, 1, 1))
+        refresh_result = st.session_state.pop("refresh_result", None)
+        if refresh_result:
+            st.success(
+                f"Refreshed {refresh_result['url']}: {refresh_result['kept']} chunks kept, "
+                f"{refresh_result['added']} added, {refresh_result['removed']} removed",
+                icon=":material/check_circle:",
+            )
+
+        deleted_count = st.session_state.pop("deleted_count", None)
+        if deleted_count is not None:
+            st.success(
+                f"Deleted {deleted_count} chunks", icon=":material/check_circle:"
+            )
+
+        with st.form(key="delete_documents_form", clear_on_submit=True):
+            selected_urls = st.multiselect(
+                "Select documents to delete",
+                [metadata["source"] for metadata in metadata_list],
+                key="delete_urls",
+            )
+            compact = st.checkbox("Compact storage afterwards", key="delete_compact")
+            submitted = st.form_submit_button("Delete Selected")
+        if submitted and selected_urls:
+            with st.spinner(f"Deleting {len(selected_urls)} documents..."):
+                st.session_state["deleted_count"] = (
+                    self.db_router.delete_documents_by_urls(
+                        selected_urls, compact=compact
+                    )
+                )
+                st.experimental_rerun()
+
+        col1, col2, col3, col4 = st.columns((3, 3, 1, 2))
         col1.write("**Source**")
         col2.write("**Title**")
         col3.write("**Count**")
         col4.write("**Action**")
 
         for i, metadata in enumerate(metadata_list):
-            col1, col2, col3, col4 = st.columns((3, 3, 1, 1))
+            col1, col2, col3, col4, col5 = st.columns((3, 3, 1, 1, 1))
             col1.write(metadata["source"])
             col2.write(metadata.get("title", "No Title"))
             col3.write(metadata["count"])
 
-            if col4.button("Delete", key=f"delete_{i}"):
+            if col4.button("Refresh", key=f"refresh_{i}"):
+                with st.spinner("Refreshing document..."):
+                    st.session_state["refresh_result"] = {
+                        "url": metadata["source"],
+                        **self.db_router.refresh_document_by_url(
+                            metadata["source"], self.generator.credentials
+                        ),
+                    }
+                    st.experimental_rerun()
+            if col5.button("Delete", key=f"delete_{i}"):
                 with st.spinner("Deleting document..."):
                     self.db_router.delete_documents_by_url(metadata["source"])
                     st.experimental_rerun()
             st.divider()
 
+    def _schedule_refresh(self):
+        """
+        Display the state of the scheduled refresh, with controls for the refresh interval of a
+        source and to check all documents for updates at once.
+        """
+        freshness = self.db_router.freshness
+        st.write("### Scheduled Refresh")
+        self._display_refresh_result()
+
+        summary = freshness.store.summary(time.time())
+        st.caption(
+            ", ".join(f"{count} {status}" for status, count in summary.items())
+            + (
+                ""
+                if REFRESH_ENABLED
+                else " (background checks disabled, set REFRESH_ENABLED=true to enable)"
+            )
+        )
+
+        with st.form(key="refresh_interval_form"):
+            source = st.selectbox(
+                "Source (applies to the pages under it too)",
+                [
+                    metadata["source"]
+                    for metadata in self.db_router.get_all_documents_metadata
+                ],
+                key="refresh_source",
+            )
+            hours = st.number_input(
+                "Refresh interval (hours)",
+                min_value=0.25,
+                value=freshness.default_interval / 3600,
+                key="refresh_hours",
+            )
+            submitted = st.form_submit_button("Set Interval")
+        if submitted and source:
+            updated = freshness.set_interval(source, hours * 3600)
+            st.info(f"Interval set for {updated} pages", icon=":material/info:")
+
+        if st.button("Check all documents for updates now"):
+            freshness.request_refresh()
+            st.session_state["refresh_requested"] = True
+        self._display_refresh_check()
+
+    @st.experimental_fragment(run_every=JOB_POLL_INTERVAL)
+    def _display_refresh_check(self):
+        """
+        Display the progress and outcome of a requested check for updates, polling it in the
+        background.
+        """
+        if not st.session_state.get("refresh_requested"):
+            return
+        freshness = self.db_router.freshness
+        if freshness.refresh_pending:
+            st.info("Checking documents for updates...", icon=":material/sync:")
+            return
+
+        # Rerun the whole page once the check finishes, so the documents list picks it up
+        st.session_state["refresh_requested"] = False
+        st.session_state["refresh_check"] = freshness.last_result
+        st.experimental_rerun()
+
+    def _display_refresh_result(self):
+        """
+        Display the outcome of the last requested check for updates, once.
+        """
+        refresh_check = st.session_state.pop("refresh_check", None)
+        if not refresh_check:
+            return
+        if "error" in refresh_check:
+            st.error(
+                f"Error checking documents: {refresh_check['error']}",
+                icon=":material/error:",
+            )
+            return
+        st.success(
+            f"Checked {refresh_check['checked']} pages: "
+            f"{refresh_check.get('changed', 0)} changed, "
+            f"{refresh_check.get('gone', 0)} gone, "
+            f"{refresh_check.get('missing', 0)} missing (kept until confirmed), "
+            f"{refresh_check.get('added', 0)} chunks added, "
+            f"{refresh_check.get('removed', 0)} removed",
+            icon=":material/check_circle:",
+        )
+
+    def _manage_snapshots(self):
+        """
+        Display the UI to export the collection to a local snapshot, or to import one into an
+        empty collection.
+        """
+        with st.expander("Snapshots", expanded="imported_count" in st.session_state):
+            name = st.text_input(
+                "Snapshot name",
+                value=self.db_router.collection,
+                help=f"Snapshots are stored under {SNAPSHOTS_PATH} on the server",
+                key="snapshot_name",
+            )
+            col1, col2 = st.columns(2)
+            if col1.button("Export Snapshot"):
+                with st.spinner("Exporting snapshot..."):
+                    manifest = self.db_router.export_snapshot(
+                        name, self.generator.credentials
+                    )
+                st.success(
+                    f"Exported {manifest['count']} chunks to snapshot {name}",
+                    icon=":material/check_circle:",
+                )
+            if col2.button(
+                "Import Snapshot",
+                disabled=bool(self.db_router.get_all_documents_metadata),
+                help="Only into an empty collection",
+            ):
+                with st.spinner("Importing snapshot..."):
+                    st.session_state["imported_count"] = self.db_router.import_snapshot(
+                        name
+                    )
+                    st.experimental_rerun()
+            imported_count = st.session_state.pop("imported_count", None)
+            if imported_count is not None:
+                st.success(
+                    f"Imported {imported_count} chunks", icon=":material/check_circle:"
+                )
+
     def show_knowledge_base_page(self):
         """
         Display the knowledge base management page of the application.
         """
         st.title("knowledge-base-management 📖")
 
+        if len(self.db_routers) > 1:
+            st.selectbox("Collection", list(self.db_routers), key="kb_collection")
+
         self._add_document_by_url()
 
+        self._display_ingestion_jobs()
+
+        self._add_documents_by_urls()
+
+        self._schedule_refresh()
+
+        self._manage_snapshots()
+
         self._display_existing_documents_metadata()
 
     def main(self):
@@ -173,11 +595,69 @@ class UI:
         elif page == "Knowledge Base Management":
             self.show_knowledge_base_page()
 
+        if DEBUG_TRACES:
+            self._display_traces()
+
+    def _display_traces(self, limit: int = 5):
+        """
+        Display the stage timings of the session's most recent searches and transcriptions.
+
+        Args:
+            limit: Number of traces to display.
+        """
+        with st.sidebar.expander("Debug: stage timings"):
+            # The tracer is shared by the whole process, other sessions' traces are not shown
+            traces = tracer.recent_traces(limit, session=self.generator.session_id)
+            if not traces:
+                st.caption("No traces yet")
+            for trace in traces:
+                attributes = ", ".join(
+                    f"{k}={v}" for k, v in trace["attributes"].items()
+                )
+                st.caption(
+                    f"**{trace['name']}** {trace['duration_ms']:.0f} ms ({attributes})"
+                    + (f" failed: {trace['error']}" if trace["error"] else "")
+                )
+                st.dataframe(
+                    [
+                        {
+                            "stage": span["name"],
+                            "start (ms)": span["start_ms"],
+                            "duration (ms)": span["duration_ms"],
+                            **span["attributes"],
+                        }
+                        for span in trace["spans"]
+                    ],
+                    hide_index=True,
+                    use_container_width=True,
+                )
+
 
 if __name__ == "__main__":
+    warm_up()
     auth = Auth()
     auth.authentication_widget()
 
-    generator = Generator(st.session_state["credentials"])
-    ui = UI(generator, DBRouter(st.session_state["credentials"], generator.db))
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
+
+    from src.generator import Generator
+
+    start_metrics_server()
+    generator = Generator(
+        st.session_state["credentials"],
+        session_id=st.session_state["session_id"],
+        search_collections=st.session_state.get("search_collections") or None,
+        # Past exchanges after the greeting
+        chat_history=list(
+            zip(
+                st.session_state.get("past", [])[1:],
+                st.session_state.get("generated", [])[1:],
+            )
+        ),
+    )
+    ui = UI(
+        generator,
+        {name: load_db_router(generator, name) for name in generator.collections},
+    )
     ui.main()